@@ -0,0 +1,250 @@
+"""
+Предрасчитанные битовые маски блюд: какие аллергены и типы еды в них есть.
+Бит номер N соответствует Allergy.id == N (или FoodType.id == N).
+Проверка "подходит ли блюдо ученику" - побитовое И вместо join-ов
+Dish → Compound → Product → AllergyProducts/ProductType.
+
+Блюдо, которого нет в индексе (добавлено другим процессом), загружается из БД
+при первом обращении, а не считается безопасным. Изменения рецептур в других
+воркерах видны через общий счётчик версий (ALLERGEN_INDEX_BACKEND): при его
+изменении индекс перестраивается перед следующим персональным ответом.
+"""
+import os
+import threading
+import time
+from itertools import chain
+
+from flask import g, has_request_context
+from sqlalchemy import event, inspect, literal, select, union_all
+from sqlalchemy.orm import Session
+
+from auth import TTLCache
+from menu_cache import make_backend
+from models import (
+    db, AllergyProducts, Compound, Dish, ProductType, UserAllergy, UserDisliked,
+)
+
+# Полная перестройка раз в N секунд - чтобы подхватить изменения из других воркеров
+ALLERGEN_INDEX_TTL = float(os.getenv("ALLERGEN_INDEX_TTL", "300"))
+USER_MASK_CACHE_TTL = float(os.getenv("USER_MASK_CACHE_TTL", "60"))
+# "" - только этот процесс, "redis://..." - все воркеры. По умолчанию - как MENU_CACHE_BACKEND.
+ALLERGEN_INDEX_BACKEND = os.getenv("ALLERGEN_INDEX_BACKEND", os.getenv("MENU_CACHE_BACKEND", ""))
+
+
+def mask_bits(mask: int) -> list:
+    return [i for i in range(mask.bit_length()) if mask >> i & 1]
+
+
+class DishIndex:
+    VERSION_KEY = "allergen:index:ver"
+
+    def __init__(self, ttl=ALLERGEN_INDEX_TTL, backend=None):
+        self.ttl = ttl
+        self.backend = backend
+        self._allergens = {}
+        self._types = {}
+        self._stale = set()
+        self._loaded_at = None
+        self._version = None  # последняя увиденная общая версия
+        self._lock = threading.Lock()
+
+    def _load(self, dish_ids=None):
+        if dish_ids is None:
+            # все блюда, в том числе без аллергенов: отсутствие в индексе значит "ещё не загружено"
+            dish_ids = [r[0] for r in db.session.query(Dish.id)]
+        allergens = (
+            db.session.query(Compound.dish_id, AllergyProducts.allergy_id)
+            .join(AllergyProducts, AllergyProducts.product_id == Compound.product_id)
+        )
+        types = (
+            db.session.query(Compound.dish_id, ProductType.type_id)
+            .join(ProductType, ProductType.product_id == Compound.product_id)
+        )
+        if dish_ids is not None:
+            allergens = allergens.filter(Compound.dish_id.in_(dish_ids))
+            types = types.filter(Compound.dish_id.in_(dish_ids))
+
+        a_masks = dict.fromkeys(dish_ids, 0)
+        t_masks = dict.fromkeys(dish_ids, 0)
+        for dish_id, allergy_id in allergens:
+            a_masks[dish_id] = a_masks.get(dish_id, 0) | (1 << allergy_id)
+        for dish_id, type_id in types:
+            t_masks[dish_id] = t_masks.get(dish_id, 0) | (1 << type_id)
+        return a_masks, t_masks
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._loaded_at is None or now - self._loaded_at > self.ttl:
+            a_masks, t_masks = self._load()
+            with self._lock:
+                self._allergens, self._types = a_masks, t_masks
+                self._stale.clear()
+                self._loaded_at = now
+            return
+
+        if self._stale:
+            with self._lock:
+                stale, self._stale = self._stale, set()
+            a_masks, t_masks = self._load(sorted(stale))
+            with self._lock:
+                self._allergens.update(a_masks)
+                self._types.update(t_masks)
+
+    def masks_many(self, dish_ids) -> dict:
+        """{dish_id: (маска аллергенов, маска типов еды)}; неизвестные блюда читаются из БД."""
+        self._ensure_fresh()
+        missing = sorted({d for d in dish_ids if d not in self._allergens})
+        if missing:
+            a_masks, t_masks = self._load(missing)
+            with self._lock:
+                self._allergens.update(a_masks)
+                self._types.update(t_masks)
+        return {d: (self._allergens.get(d, 0), self._types.get(d, 0)) for d in dish_ids}
+
+    def masks(self, dish_id: int):
+        """(маска аллергенов, маска типов еды) блюда."""
+        return self.masks_many([dish_id])[dish_id]
+
+    def invalidate(self, dish_ids):
+        with self._lock:
+            self._stale.update(dish_ids)
+
+    def publish(self, dish_ids):
+        """Сбрасывает блюда здесь и увеличивает общую версию для остальных воркеров."""
+        dish_ids = set(dish_ids)
+        if not dish_ids:
+            return
+        self.invalidate(dish_ids)
+        if self.backend is None:
+            return
+        version = int(self.backend.incr(self.VERSION_KEY))
+        with self._lock:
+            if self._version is not None and version != self._version + 1:
+                # кто-то ещё менял рецептуры между нашими проверками
+                self._loaded_at = None
+            self._version = version
+
+    def sync(self):
+        """Сверяет общую версию (раз на запрос): если её меняли другие воркеры - полная перестройка."""
+        if self.backend is None:
+            return
+        if has_request_context():
+            # /menu/range персонализирует каждое меню отдельно - проверяем один раз
+            if g.get("allergen_index_synced"):
+                return
+            g.allergen_index_synced = True
+        version = int(self.backend.get(self.VERSION_KEY) or 0)
+        with self._lock:
+            if self._version is not None and version != self._version:
+                self._loaded_at = None
+            self._version = version
+
+    def reset(self):
+        with self._lock:
+            self._loaded_at = None
+
+
+dish_index = DishIndex(backend=make_backend(ALLERGEN_INDEX_BACKEND))
+_user_masks = TTLCache(10000, USER_MASK_CACHE_TTL)
+
+
+def user_masks(user_id: int):
+    """(маска аллергий, маска нелюбимых типов) ученика."""
+    masks = _user_masks.get(user_id)
+    if masks is None:
+        rows = union_all(
+            select(literal(0), UserAllergy.allergy_id).where(UserAllergy.user_id == user_id),
+            select(literal(1), UserDisliked.type_id).where(UserDisliked.user_id == user_id),
+        )
+        masks = [0, 0]
+        for kind, bit in db.session.execute(rows):
+            masks[kind] |= 1 << bit
+        masks = tuple(masks)
+        _user_masks.set(user_id, masks)
+    return masks
+
+
+def clear_user_masks():
+    """Сбросить кэш масок учеников (замеры холодного старта)."""
+    _user_masks.clear()
+
+
+def annotate_dishes(dishes: list, user_id: int, mode: str = "annotate") -> list:
+    """
+    Для сериализованных блюд (_dish_to_dict) ученика:
+    mode="annotate" - добавляет allergens, disliked и safe;
+    mode="filter" - оставляет только блюда без его аллергенов.
+    """
+    u_allergy, u_disliked = user_masks(user_id)
+    dish_index.sync()
+    masks = dish_index.masks_many([item["id"] for item in dishes])
+    result = []
+    for item in dishes:
+        a_mask, t_mask = masks[item["id"]]
+        hit = a_mask & u_allergy
+        if mode == "filter":
+            if not hit:
+                result.append(item)
+            continue
+        result.append({
+            **item,
+            "allergens": mask_bits(hit),
+            "disliked": bool(t_mask & u_disliked),
+            "safe": not hit,
+        })
+    return result
+
+
+def unsafe_dishes_by_join(user_id: int, dish_ids) -> set:
+    """То же, что annotate_dishes(mode="filter"), но join-ами в БД (для сравнения)."""
+    rows = (
+        db.session.query(Compound.dish_id)
+        .join(AllergyProducts, AllergyProducts.product_id == Compound.product_id)
+        .join(UserAllergy, UserAllergy.allergy_id == AllergyProducts.allergy_id)
+        .filter(UserAllergy.user_id == user_id, Compound.dish_id.in_(dish_ids))
+        .distinct()
+    )
+    return {r[0] for r in rows}
+
+
+# --- инкрементальное обновление ---
+
+def _history_values(obj, attr):
+    hist = getattr(inspect(obj).attrs, attr).history
+    return {v for v in chain(hist.added or (), hist.deleted or (), hist.unchanged or ()) if v is not None}
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_index_changes(session, flush_context):
+    dishes = session.info.setdefault("allergen_index_dishes", set())
+    users = session.info.setdefault("allergen_index_users", set())
+    products = set()
+
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Compound):
+            dishes |= _history_values(obj, "dish_id")
+            products |= _history_values(obj, "product_id")
+        elif isinstance(obj, (AllergyProducts, ProductType)):
+            products |= _history_values(obj, "product_id")
+        elif isinstance(obj, Dish) and obj.id is not None:
+            dishes.add(obj.id)
+        elif isinstance(obj, (UserAllergy, UserDisliked)):
+            users |= _history_values(obj, "user_id")
+
+    if products:
+        with session.no_autoflush:
+            rows = session.query(Compound.dish_id).filter(Compound.product_id.in_(products)).distinct()
+            dishes.update(r[0] for r in rows if r[0] is not None)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_index_changes(session):
+    dish_index.publish(session.info.pop("allergen_index_dishes", ()))
+    for user_id in session.info.pop("allergen_index_users", ()):
+        _user_masks.pop(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_index_changes(session):
+    session.info.pop("allergen_index_dishes", None)
+    session.info.pop("allergen_index_users", None)
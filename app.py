@@ -1,15 +1,30 @@
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
 import os
-from datetime import date, datetime, timedelta, timezone
 
-import jwt
-from flask import Flask, jsonify, request, send_from_directory
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, g, jsonify, request
+from auth import JWT_EXPIRES_MINUTES, keep_tokens, login_required, make_token, revoke_token
+from commands import register_commands
+from db_routing import configure as configure_db
+from exports import export_bp
+from feedback import feedback_bp
+from inventory import inventory_bp
+from jobs import jobs_bp
+from listings import listings_bp
+from live import live_bp
 from menu_routes import menu_bp
+from metrics import init_metrics
+from pickup_routes import pickup_bp
+from planner import planner_bp
+from purchase_routes import purchase_bp
+from reports import reports_bp
+from roster import roster_bp
 from models import db, User, UserRole
-import fill
+from passwords import hasher, PasswordPoolBusy
+from static_assets import assets
 
-JWT_SECRET = os.getenv("JWT_SECRET", "change-me")
-JWT_EXPIRES_MINUTES = int(os.getenv("JWT_EXPIRES_MINUTES", "60"))
 DATABASE_URL = os.getenv(
     "DATABASE_URL",
     "postgresql+psycopg2://app:app@db:5432/app"
@@ -17,49 +32,57 @@ DATABASE_URL = os.getenv(
 
 
 def create_app():
-    app = Flask(__name__, static_folder="public", static_url_path="")
+    # встроенный static Flask не используется: public/ раздаёт static_assets
+    app = Flask(__name__, static_folder=None)
 
-    app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
+    # пул соединений и реплика для чтения: DB_* и DATABASE_REPLICA_URL (db_routing.py)
+    configure_db(app, DATABASE_URL)
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+    # Схема и тестовые данные создаются командами migrate / seed (см. commands.py),
+    # а не здесь: create_app выполняется в каждом воркере gunicorn.
     db.init_app(app)
 
-    with app.app_context():
-        db.create_all()
-        fill.seed_test_data(date(2026, 2, 9), days=10)
-
     app.register_blueprint(menu_bp)
-
-    def make_token(user):
-        now = datetime.now(timezone.utc)
-        payload = {
-            "sub": str(user.id),
-            "login": user.login,
-            "role": user.role.name,
-            "iat": int(now.timestamp()),
-            "exp": int((now + timedelta(minutes=JWT_EXPIRES_MINUTES)).timestamp()),
-        }
-        return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
+    app.register_blueprint(purchase_bp)
+    app.register_blueprint(pickup_bp)
+    app.register_blueprint(planner_bp)
+    app.register_blueprint(inventory_bp)
+    app.register_blueprint(reports_bp)
+    app.register_blueprint(export_bp)
+    app.register_blueprint(live_bp)
+    app.register_blueprint(roster_bp)
+    app.register_blueprint(feedback_bp)
+    app.register_blueprint(listings_bp)
+    app.register_blueprint(jobs_bp)
+    register_commands(app)
+    init_metrics(app)
+    # собранная статика (build-static), без неё файлы отдаются из public/ как есть
+    assets.load()
+
+    @app.errorhandler(PasswordPoolBusy)
+    def password_pool_busy(e):
+        return {"message": "Сервер перегружен, повторите попытку"}, 503, {"Retry-After": "1"}
 
     @app.get("/")
     def index():
-        return send_from_directory(app.static_folder, "login.html")
+        return assets.serve("login.html")
 
     # Страницы
     @app.get("/login")
     def login_page():
-        return send_from_directory(app.static_folder, "login.html")
+        return assets.serve("login.html")
 
     @app.get("/register")
     def register_page():
-        return send_from_directory(app.static_folder, "register.html")
+        return assets.serve("register.html")
 
     # ДОБАВЛЕНО:
     # универсальная раздача всех статических файлов
     # styles.css, vegetables.png, js, fonts и т.д.
     @app.get("/<path:filename>")
     def static_files(filename):
-        return send_from_directory(app.static_folder, filename)
+        return assets.serve(filename)
 
     @app.post("/register")
     def register():
@@ -76,7 +99,7 @@ def create_app():
 
         user = User(
             login=login,
-            password_hash=generate_password_hash(password),
+            password_hash=hasher.hash(password),
             role=UserRole.STUDENT,
             money=0
         )
@@ -95,9 +118,16 @@ def create_app():
 
         user = User.query.filter_by(login=login).first()
 
-        if not user or not check_password_hash(user.password_hash, password):
+        if not user or not hasher.check(user.password_hash, password):
             return {"message": "Неверный login или пароль"}, 401
 
+        # параметры хэширования поменялись - пересчитываем хэш, пока знаем пароль
+        if hasher.needs_rehash(user.password_hash):
+            user.password_hash = hasher.hash(password)
+            # пароль тот же: выданные токены остаются действительными
+            keep_tokens(user.id)
+            db.session.commit()
+
         token = make_token(user)
 
         return jsonify({
@@ -106,6 +136,19 @@ def create_app():
             "expires_in_minutes": JWT_EXPIRES_MINUTES
         })
 
+    @app.get("/me")
+    @login_required()
+    def me():
+        return jsonify(g.principal.to_dict())
+
+    @app.post("/logout")
+    @login_required()
+    def logout():
+        revoke_token(g.token)
+        return {"message": "Выход выполнен"}
+
+    app.config["BOOT_SECONDS"] = time.perf_counter() - _IMPORT_STARTED
+    app.logger.info("app ready in %.1f ms", app.config["BOOT_SECONDS"] * 1000)
     return app
 
 app = create_app()
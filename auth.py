@@ -0,0 +1,308 @@
+"""
+JWT-аутентификация для защищённых эндпоинтов.
+Проверенные токены и данные пользователей (роль, баланс) кэшируются
+на короткое время, поэтому обычная проверка роли не ходит в БД.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+
+import jwt
+from flask import g, request
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from menu_cache import make_backend
+from models import db, User, UserRole
+
+JWT_SECRET = os.getenv("JWT_SECRET", "change-me")
+JWT_EXPIRES_MINUTES = int(os.getenv("JWT_EXPIRES_MINUTES", "60"))
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+AUTH_TOKEN_CACHE_TTL = float(os.getenv("AUTH_TOKEN_CACHE_TTL", "300"))
+AUTH_PRINCIPAL_CACHE_SIZE = int(os.getenv("AUTH_PRINCIPAL_CACHE_SIZE", "10000"))
+AUTH_PRINCIPAL_CACHE_TTL = float(os.getenv("AUTH_PRINCIPAL_CACHE_TTL", "30"))
+# Отзыв токенов (выход, смена пароля): "" - только в памяти процесса,
+# "redis://..." - общий для воркеров gunicorn. По умолчанию - как MENU_CACHE_BACKEND.
+AUTH_BACKEND = os.getenv("AUTH_BACKEND", os.getenv("MENU_CACHE_BACKEND", ""))
+# Сколько секунд воркер помнит ответ общего хранилища
+AUTH_REVOCATION_CACHE_TTL = float(os.getenv("AUTH_REVOCATION_CACHE_TTL", "5"))
+
+
+class TTLCache:
+    """Ограниченный по размеру LRU, у каждой записи свой срок жизни."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class Principal:
+    __slots__ = ("id", "login", "role", "money")
+
+    def __init__(self, id, login, role, money):
+        self.id = id
+        self.login = login
+        self.role = role
+        self.money = money
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "login": self.login,
+            "role": self.role.value if self.role else None,
+            "role_code": self.role.name if self.role else None,
+            "money": self.money,
+        }
+
+
+class Revocations:
+    """
+    Отозванные токены и время, раньше которого выданные пользователю токены
+    недействительны. Записи живут не дольше токена. С общим хранилищем
+    (backend) локальные кэши - только короткий кэш чтения.
+    """
+
+    def __init__(self, backend=None, lifetime=JWT_EXPIRES_MINUTES * 60, read_ttl=AUTH_REVOCATION_CACHE_TTL):
+        self._backend = backend
+        self.lifetime = lifetime
+        # без общего хранилища локальные записи - единственные, живут весь срок токена
+        self._local_ttl = lifetime if backend is None else read_ttl
+        self._tokens = TTLCache(AUTH_TOKEN_CACHE_SIZE, lifetime)
+        self._not_before = TTLCache(AUTH_PRINCIPAL_CACHE_SIZE, lifetime)
+
+    @staticmethod
+    def _token_key(token: str) -> str:
+        return "auth:revoked:" + hashlib.sha256(token.encode()).hexdigest()
+
+    def revoke(self, token: str, expires_in: float):
+        key = self._token_key(token)
+        self._tokens.set(key, True, ttl=expires_in)
+        if self._backend is not None and expires_in > 0:
+            self._backend.set(key, "1", ex=expires_in)
+
+    def revoke_user(self, user_id: int):
+        # iat токенов - с миллисекундами: токен, выданный сразу после отзыва, действителен
+        not_before = time.time()
+        self._not_before.set(user_id, not_before, ttl=self._local_ttl)
+        if self._backend is not None:
+            self._backend.set(f"auth:nbf:{user_id}", str(not_before), ex=self.lifetime + 1)
+
+    def is_revoked(self, token: str, claims: dict) -> bool:
+        key, user_id = self._token_key(token), int(claims["sub"])
+        revoked, not_before = self._tokens.get(key), self._not_before.get(user_id)
+        if (revoked is None or not_before is None) and self._backend is not None:
+            raw_revoked, raw_not_before = self._backend.get_many(key, f"auth:nbf:{user_id}")
+            if revoked is None:
+                revoked = raw_revoked is not None
+                self._tokens.set(key, revoked, ttl=None if revoked else self._local_ttl)
+            if not_before is None:
+                not_before = float(raw_not_before or 0)
+                self._not_before.set(user_id, not_before, ttl=self._local_ttl)
+        return bool(revoked) or claims.get("iat", 0) < (not_before or 0)
+
+
+_claims_cache = TTLCache(AUTH_TOKEN_CACHE_SIZE, AUTH_TOKEN_CACHE_TTL)
+_principal_cache = TTLCache(AUTH_PRINCIPAL_CACHE_SIZE, AUTH_PRINCIPAL_CACHE_TTL)
+_revocations = Revocations(make_backend(AUTH_BACKEND))
+
+
+class AuthError(Exception):
+    def __init__(self, message, status=401):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def make_token(user):
+    now = datetime.now(timezone.utc)
+    payload = {
+        "sub": str(user.id),
+        "login": user.login,
+        "role": user.role.name,
+        "iat": round(now.timestamp(), 3),
+        "exp": int((now + timedelta(minutes=JWT_EXPIRES_MINUTES)).timestamp()),
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
+
+
+def verify_token(token: str) -> dict:
+    """Проверяет подпись и срок токена; результат кэшируется до exp."""
+    claims = _claims_cache.get(token)
+    if claims is None:
+        try:
+            claims = jwt.decode(token, JWT_SECRET, algorithms=["HS256"], options={"require": ["sub", "exp"]})
+        except jwt.ExpiredSignatureError:
+            raise AuthError("Срок действия токена истёк")
+        except jwt.InvalidTokenError:
+            raise AuthError("Неверный токен")
+        _claims_cache.set(token, claims, ttl=claims["exp"] - time.time())
+    elif claims["exp"] <= time.time():
+        _claims_cache.pop(token)
+        raise AuthError("Срок действия токена истёк")
+
+    if _revocations.is_revoked(token, claims):
+        raise AuthError("Токен отозван")
+    return claims
+
+
+def load_principal(user_id: int) -> Principal | None:
+    principal = _principal_cache.get(user_id)
+    if principal is None:
+        row = (
+            db.session.query(User.id, User.login, User.role, User.money)
+            .filter(User.id == user_id)
+            .first()
+        )
+        if row is None:
+            return None
+        principal = Principal(*row)
+        _principal_cache.set(user_id, principal)
+    return principal
+
+
+def _bearer_token() -> str | None:
+    header = request.headers.get("Authorization", "")
+    scheme, _, token = header.partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    return token.strip()
+
+
+def current_principal() -> Principal:
+    """Проверяет токен текущего запроса и возвращает пользователя."""
+    token = _bearer_token()
+    if not token:
+        raise AuthError("Нужен заголовок Authorization: Bearer <token>")
+
+    claims = verify_token(token)
+    principal = load_principal(int(claims["sub"]))
+    if principal is None:
+        raise AuthError("Пользователь не найден")
+    return principal
+
+
+def login_required(*roles: UserRole):
+    """
+    Декоратор для эндпоинтов: без ролей - любой вошедший пользователь,
+    иначе только перечисленные роли. Пользователь доступен как g.principal.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                principal = current_principal()
+            except AuthError as e:
+                return {"message": e.message}, e.status
+
+            if roles and principal.role not in roles:
+                return {"message": "Недостаточно прав"}, 403
+
+            g.principal = principal
+            g.token = _bearer_token()
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --- отзыв и сброс кэшей ---
+
+def revoke_token(token: str):
+    try:
+        claims = jwt.decode(token, JWT_SECRET, algorithms=["HS256"], options={"require": ["exp"]})
+    except jwt.InvalidTokenError:
+        # истёкший или чужой токен и так не пройдёт проверку
+        return
+    _claims_cache.pop(token)
+    _revocations.revoke(token, claims["exp"] - time.time())
+
+
+def revoke_user_tokens(user_id: int):
+    """Отзывает все токены пользователя, выданные до этого момента."""
+    _revocations.revoke_user(user_id)
+    _principal_cache.pop(user_id)
+
+
+def evict_principal(user_id: int):
+    _principal_cache.pop(user_id)
+
+
+def clear_caches():
+    """Для пересоздания пользователей в обход ORM (seed): id могут достаться новым пользователям."""
+    _claims_cache.clear()
+    _principal_cache.clear()
+
+
+def keep_tokens(user_id: int):
+    """Смена password_hash в текущей транзакции - пересчёт хэша того же пароля, токены не отзывать."""
+    db.session.info.setdefault("auth_keep_tokens", set()).add(user_id)
+
+
+# После коммита: изменённые и удалённые пользователи убираются из кэша,
+# а при смене пароля или роли их токены отзываются во всех воркерах.
+
+@event.listens_for(Session, "after_flush")
+def _collect_user_changes(session, flush_context):
+    ids = session.info.setdefault("auth_evict_users", set())
+    revoke = session.info.setdefault("auth_revoke_users", set())
+    keep = session.info.get("auth_keep_tokens", ())
+    for obj in list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, User) or obj.id is None:
+            continue
+        ids.add(obj.id)
+        state = inspect(obj)
+        if state.deleted or state.was_deleted:
+            revoke.add(obj.id)
+        elif (state.attrs.role.history.has_changes()
+              or (state.attrs.password_hash.history.has_changes() and obj.id not in keep)):
+            revoke.add(obj.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_user_changes(session):
+    session.info.pop("auth_keep_tokens", None)
+    for user_id in session.info.pop("auth_revoke_users", ()):
+        revoke_user_tokens(user_id)
+    for user_id in session.info.pop("auth_evict_users", ()):
+        evict_principal(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_user_changes(session):
+    for key in ("auth_evict_users", "auth_revoke_users", "auth_keep_tokens"):
+        session.info.pop(key, None)
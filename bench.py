@@ -0,0 +1,461 @@
+"""
+Нагрузочные сценарии API (flask --app app bench).
+Запросы выполняются пулом потоков либо внутри процесса (test_client),
+либо по HTTP к запущенному серверу (--url). Для каждого сценария считаются
+пропускная способность и p50/p95/p99; результат можно сохранить как базовую
+линию (JSON) и сравнивать с ней следующие прогоны.
+
+Данные: generate_dataset из fill.py (ученики student000000@load.test, пароль "student").
+Сценарии покупок и выдачи меняют данные, поэтому запускайте их на отдельной БД.
+"""
+import http.client
+import json
+import math
+import platform
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+
+from sqlalchemy import func, insert, select, update
+
+from auth import make_token
+from models import db, Menu, MealType, PaidMenu, User, UserRole
+from passwords import hasher
+from pickup_routes import make_pickup_code
+
+LOAD_PASSWORD = "student"
+LOAD_LOGIN_LIKE = "%@load.test"
+# сколько дней вперёд от сегодня генерируется меню (для покупок)
+FUTURE_DAYS = 14
+
+
+# --- клиенты ---
+
+class _LocalClient:
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method, path, body=None, headers=None):
+        resp = self._client.open(path, method=method, json=body, headers=headers or {})
+        return resp.status_code, resp.get_data()
+
+
+class _HttpClient:
+    """Одно keep-alive соединение на поток."""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self._host = parts.hostname
+        self._port = parts.port or 80
+        self._conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        data = json.dumps(body).encode() if body is not None else None
+        headers = {"Content-Type": "application/json", **(headers or {})}
+        for attempt in (1, 2):
+            if self._conn is None:
+                self._conn = http.client.HTTPConnection(self._host, self._port, timeout=30)
+            try:
+                self._conn.request(method, path, body=data, headers=headers)
+                resp = self._conn.getresponse()
+                return resp.status, resp.read()
+            except (http.client.HTTPException, ConnectionError):
+                # сервер закрыл keep-alive соединение - переподключаемся один раз
+                self._conn.close()
+                self._conn = None
+                if attempt == 2:
+                    raise
+
+
+# --- данные ---
+
+def prepare(students=2000, history_days=60, seed=42, log=print) -> dict:
+    """Пересоздаёт данные: history_days дней до сегодня и FUTURE_DAYS вперёд."""
+    import fill
+    import reports
+
+    stats = fill.generate_dataset(
+        students=students, start=date.today() - timedelta(days=history_days),
+        days=history_days + FUTURE_DAYS, seed=seed, log=log,
+    )
+    reports.rebuild()
+    return stats
+
+
+def _load_users(limit: int) -> list:
+    return (
+        User.query
+        .filter(User.login.like(LOAD_LOGIN_LIKE))
+        .order_by(User.id.asc())
+        .limit(limit)
+        .all()
+    )
+
+
+def _bearer(user) -> dict:
+    # токены выпускаются напрямую: подготовка не должна нагружать хэширование паролей
+    return {"Authorization": "Bearer " + make_token(user)}
+
+
+# --- сценарии ---
+# Каждый сценарий готовит список запросов (method, path, body, headers, ожидаемые статусы)
+# заранее, чтобы подготовка не попадала в замер.
+
+def _login(n, rng):
+    users = _load_users(min(n, 1000))
+    return [
+        ("POST", "/login", {"login": users[i % len(users)].login, "password": LOAD_PASSWORD}, None, {200})
+        for i in range(n)
+    ]
+
+
+@contextmanager
+def _inline_hashing():
+    # как до выноса хэширования в пул: PBKDF2/scrypt прямо в потоке запроса
+    hasher._run = lambda fn, *args: fn(*args)
+    try:
+        yield
+    finally:
+        del hasher._run
+
+
+def _menu_today(n, rng):
+    return [("GET", "/menu/today", None, None, {200})] * n
+
+
+def _menu_range(n, rng):
+    first, last = db.session.query(func.min(Menu.date), func.max(Menu.date)).one()
+    span = max((last - first).days - 6, 0)
+    requests = []
+    for _ in range(n):
+        d = first + timedelta(days=rng.randint(0, span))
+        requests.append(("GET", f"/menu/range?from={d}&to={d + timedelta(days=6)}", None, None, {200}))
+    return requests
+
+
+def _purchase(n, rng):
+    today = date.today()
+    menus = [m for (m,) in db.session.query(Menu.id).filter(Menu.date > today).order_by(Menu.id)]
+    users = _load_users(n)
+    if not menus or not users:
+        return []
+
+    db.session.execute(
+        update(User).where(User.id.in_([u.id for u in users])).values(money=10_000_000)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    bought = set(db.session.execute(
+        select(PaidMenu.user_id, PaidMenu.menu_id)
+        .where(PaidMenu.user_id.in_([u.id for u in users]), PaidMenu.menu_id.in_(menus))
+    ).all())
+
+    requests = []
+    for user in users:
+        headers = _bearer(user)
+        for menu_id in menus:
+            if (user.id, menu_id) not in bought:
+                requests.append(("POST", f"/menu/{menu_id}/buy", None, headers, {201}))
+    rng.shuffle(requests)
+    return requests[:n]
+
+
+def _pickup(n, rng):
+    today = date.today()
+    menu = Menu.query.filter(Menu.date == today, Menu.type == MealType.LUNCH).first()
+    cook = User.query.filter_by(role=UserRole.COOK).first()
+    if menu is None or cook is None:
+        return []
+    menu_id = menu.id
+
+    # недостающие сегодняшние покупки добавляются, выдача сбрасывается
+    users = [u.id for u in _load_users(n)]
+    paid = {u for (u,) in db.session.query(PaidMenu.user_id).filter(PaidMenu.menu_id == menu_id)}
+    missing = [{"user_id": u, "menu_id": menu_id, "is_taken": False, "price": menu.price} for u in users if u not in paid]
+    if missing:
+        db.session.execute(insert(PaidMenu), missing)
+    db.session.execute(
+        update(PaidMenu).where(PaidMenu.menu_id == menu_id, PaidMenu.user_id.in_(users)).values(is_taken=False)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+    ids = [i for (i,) in db.session.query(PaidMenu.id).filter(PaidMenu.menu_id == menu_id, PaidMenu.user_id.in_(users))]
+    rng.shuffle(ids)
+    headers = _bearer(cook)
+    return [("POST", "/pickup", {"code": make_pickup_code(i, today)}, headers, {200}) for i in ids[:n]]
+
+
+# имя -> (подготовка запросов, контекст на время замера, только внутри процесса, прогрев)
+# Покупки и выдача не прогреваются: повтор запроса вернул бы 409.
+# login_inline - сравнение p99 входа с хэшированием в потоке запроса и в пуле (login).
+SCENARIOS = {
+    "login": (_login, nullcontext, False, True),
+    "login_inline": (_login, _inline_hashing, True, True),
+    "menu_today": (_menu_today, nullcontext, False, True),
+    "menu_range": (_menu_range, nullcontext, False, True),
+    "purchase": (_purchase, nullcontext, False, False),
+    "pickup": (_pickup, nullcontext, False, False),
+}
+
+
+# --- замер ---
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    # nearest-rank
+    k = min(len(sorted_values), max(1, math.ceil(p / 100 * len(sorted_values)))) - 1
+    return sorted_values[k]
+
+
+def _measure(make_client, requests, concurrency) -> dict:
+    local = threading.local()
+
+    def one(req):
+        method, path, body, headers, expected = req
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = make_client()
+        started = time.perf_counter()
+        try:
+            status, _ = client.request(method, path, body, headers)
+            ok = status in expected
+        except Exception:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, requests))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(dt for dt, _ in results)
+    return {
+        "requests": len(results),
+        "errors": sum(1 for _, ok in results if not ok),
+        "seconds": round(wall, 3),
+        "rps": round(len(results) / wall, 1) if wall else 0.0,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+def run(app, names, requests=500, concurrency=8, url=None, seed=42, log=print) -> dict:
+    """Выполняет сценарии names. Возвращает {"meta": ..., "scenarios": {имя: результат}}."""
+    if url:
+        def make_client():
+            return _HttpClient(url)
+    else:
+        def make_client():
+            return _LocalClient(app)
+
+    rng = random.Random(seed)
+    results = {}
+    for name in names:
+        build, during, local_only, warmup = SCENARIOS[name]
+        if local_only and url:
+            log(f"{name}: пропущен, работает только без --url")
+            continue
+        plan = build(requests, rng)
+        db.session.remove()
+        if not plan:
+            log(f"{name}: нет данных для сценария (запустите с --prepare)")
+            continue
+
+        with during():
+            if warmup:
+                # соединения, кэши, пул хэширования
+                _measure(make_client, plan[:concurrency], concurrency)
+            results[name] = _measure(make_client, plan, concurrency)
+        r = results[name]
+        log(f"{name}: {r['requests']} запросов, ошибок {r['errors']}, {r['rps']} rps, "
+            f"p50 {r['p50_ms']} мс, p95 {r['p95_ms']} мс, p99 {r['p99_ms']} мс")
+
+    return {
+        "meta": {
+            "target": url or "in-process",
+            "dialect": db.engine.dialect.name,
+            "requests": requests,
+            "concurrency": concurrency,
+            "python": platform.python_version(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "scenarios": results,
+    }
+
+
+def compare(result: dict, baseline: dict, threshold=0.2) -> list:
+    """
+    Регрессии относительно базовой линии: p95 вырос или rps упал больше чем
+    на threshold, либо появились ошибки. Возвращает список описаний.
+    """
+    regressions = []
+    for name, base in baseline.get("scenarios", {}).items():
+        cur = result["scenarios"].get(name)
+        if cur is None:
+            continue
+        if cur["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {base['p95_ms']} -> {cur['p95_ms']} мс")
+        if cur["rps"] < base["rps"] / (1 + threshold):
+            regressions.append(f"{name}: rps {base['rps']} -> {cur['rps']}")
+        if cur["errors"] > base["errors"]:
+            regressions.append(f"{name}: ошибок {base['errors']} -> {cur['errors']}")
+    return regressions
+
+
+# --- опрос меню при разном числе клиентов (сравнение режимов gunicorn) ---
+
+def poll(url, clients, seconds=10.0, interval=1.0, path="/menu/today") -> dict:
+    """clients клиентов по HTTP опрашивают path раз в interval секунд в течение seconds."""
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+    deadline = time.perf_counter() + seconds
+
+    def client_loop(i):
+        client = _HttpClient(url)
+        # старты клиентов разнесены по интервалу, как у настоящих планшетов
+        time.sleep(interval * i / clients)
+        mine, failed = [], 0
+        while True:
+            started = time.perf_counter()
+            if started >= deadline:
+                break
+            try:
+                status, _ = client.request("GET", path)
+                failed += status != 200
+            except Exception:
+                failed += 1
+            dt = time.perf_counter() - started
+            mine.append(dt)
+            time.sleep(max(0.0, interval - dt))
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client_loop, args=(i,), daemon=True) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    latencies.sort()
+    return {
+        "clients": clients,
+        "polls": len(latencies),
+        "expected": round(clients * seconds / interval),
+        "errors": errors[0],
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def _server_memory_mb(url):
+    """Память всех воркеров сервера по /metrics (metrics.py)."""
+    try:
+        status, body = _HttpClient(url).request("GET", "/metrics")
+    except Exception:
+        return None
+    for line in body.decode().splitlines():
+        if line.startswith("canteen_process_resident_memory_bytes "):
+            return round(float(line.split()[1]) / 2 ** 20, 1)
+    return None
+
+
+def sweep(url, levels, seconds=10.0, interval=1.0, slo_ms=200.0, log=print) -> dict:
+    """
+    Увеличивает число клиентов, пока сервер справляется: без ошибок, p95 не больше
+    slo_ms и не меньше 95% ожидаемых опросов. Возвращает уровни и максимум.
+    """
+    results = []
+    max_clients = 0
+    for clients in levels:
+        r = poll(url, clients, seconds, interval)
+        r["sustained"] = r["errors"] == 0 and r["p95_ms"] <= slo_ms and r["polls"] >= 0.95 * r["expected"]
+        r["server_rss_mb"] = _server_memory_mb(url)
+        results.append(r)
+        log(f"{clients} клиентов: {r['polls']}/{r['expected']} опросов, ошибок {r['errors']}, "
+            f"p50 {r['p50_ms']} мс, p95 {r['p95_ms']} мс, память сервера {r['server_rss_mb']} МБ"
+            + ("" if r["sustained"] else " - не справляется"))
+        if not r["sustained"]:
+            break
+        max_clients = clients
+
+    return {
+        "meta": {"target": url, "seconds": seconds, "interval": interval, "slo_ms": slo_ms,
+                 "created": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "levels": results,
+        "max_clients": max_clients,
+    }
+
+
+# --- далёкие страницы списков админки (listings.py) ---
+
+def _timed_ms(fn, repeat=3) -> float:
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        dt = time.perf_counter() - started
+        best = dt if best is None else min(best, dt)
+    return round(best * 1000, 2)
+
+
+def deep_pages(app, kind, pages=200, limit=100, url=None, log=print) -> dict:
+    """
+    Проходит до pages страниц /admin/<kind> по cursor и на нескольких глубинах
+    сравнивает время страницы: через API, тот же SQL по ключу и через OFFSET.
+    """
+    import listings
+
+    listing = listings.LISTINGS[kind]
+    admin = User.query.filter_by(role=UserRole.ADMIN).order_by(User.id.asc()).first()
+    if admin is None:
+        raise RuntimeError("Нет администратора: сначала seed или generate-data")
+    headers = _bearer(admin)
+    client = _HttpClient(url) if url else _LocalClient(app)
+
+    cursors, api_ms = [None], []
+    while len(api_ms) < pages:
+        cursor = cursors[-1]
+        path = f"/admin/{kind}?limit={limit}" + (f"&cursor={cursor}" if cursor else "")
+        started = time.perf_counter()
+        status, body = client.request("GET", path, None, headers)
+        api_ms.append(round((time.perf_counter() - started) * 1000, 2))
+        if status != 200:
+            raise RuntimeError(f"{path}: HTTP {status}")
+        cursor = json.loads(body)["next_cursor"]
+        if cursor is None:
+            break
+        cursors.append(cursor)
+
+    fields = listing.default_fields
+    depths = sorted({0, len(api_ms) // 4, len(api_ms) // 2, len(api_ms) * 3 // 4, len(api_ms) - 1})
+    rows = []
+    for page in depths:
+        offset_query = listing.select(fields, []).order_by(*listing.order_by()).offset(page * limit).limit(limit)
+        row = {
+            "page": page + 1,
+            "api_ms": api_ms[page],
+            "keyset_ms": _timed_ms(lambda: listing.page(fields, [], cursors[page], limit)),
+            "offset_ms": _timed_ms(lambda: db.session.execute(offset_query).all()),
+        }
+        rows.append(row)
+        log(f"страница {row['page']}: API {row['api_ms']} мс, SQL по ключу {row['keyset_ms']} мс, "
+            f"OFFSET {row['offset_ms']} мс")
+    db.session.rollback()
+
+    return {
+        "meta": {"kind": kind, "limit": limit, "target": url or "in-process",
+                 "created": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "pages": len(api_ms),
+        "depths": rows,
+    }
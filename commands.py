@@ -0,0 +1,353 @@
+"""
+CLI-команды (flask --app app <команда>).
+Схема и тестовые данные создаются только ими, а не при старте воркера.
+Тяжёлые модули (fill) импортируются внутри команд.
+"""
+import time
+from datetime import date
+
+import click
+from flask.cli import with_appcontext
+
+from models import db
+
+
+@click.command("migrate")
+@with_appcontext
+def migrate_command():
+    """Применяет недостающие миграции схемы."""
+    import migrations
+
+    applied = migrations.migrate(db.engine, log=click.echo)
+    click.echo(f"Схема БД готова, версия {migrations.current_version(db.engine)}"
+               + ("" if applied else " (без изменений)"))
+
+
+@click.command("check-plans")
+@with_appcontext
+def check_plans_command():
+    """Проверяет, что горячие запросы используют индексы (на большом наборе данных)."""
+    import query_plans
+
+    failed = query_plans.check_plans(log=click.echo)
+    if failed:
+        raise click.ClickException(f"Полный проход таблицы в запросах: {', '.join(failed)}")
+
+
+@click.command("seed")
+@click.option("--start", "start_str", default="2026-02-09", show_default=True, help="Первый день (YYYY-MM-DD)")
+@click.option("--days", default=10, show_default=True, help="Количество дней меню")
+@with_appcontext
+def seed_command(start_str, days):
+    """Очищает таблицы и заполняет их тестовыми данными."""
+    import feedback
+    import fill
+    import reports
+
+    result = fill.seed_test_data(date.fromisoformat(start_str), days=days)
+    reports.rebuild()
+    feedback.rebuild()
+    click.echo(f"Тестовые данные созданы: {result}")
+
+
+@click.command("generate-data")
+@click.option("--students", default=20000, show_default=True, help="Количество учеников")
+@click.option("--start", "start_str", default="2024-09-02", show_default=True, help="Первый день (YYYY-MM-DD)")
+@click.option("--days", default=730, show_default=True, help="Количество дней меню")
+@click.option("--seed", default=42, show_default=True, help="Seed генератора")
+@click.option("--batch-size", default=10000, show_default=True, help="Размер пачки при загрузке")
+@click.option("--feedback-rate", default=0.01, show_default=True, help="Доля выданных обедов с отзывом")
+@with_appcontext
+def generate_data_command(students, start_str, days, seed, batch_size, feedback_rate):
+    """Заполняет БД большим синтетическим набором данных."""
+    import feedback
+    import fill
+    import reports
+
+    t0 = time.perf_counter()
+    stats = fill.generate_dataset(
+        students=students, start=date.fromisoformat(start_str), days=days,
+        seed=seed, batch_size=batch_size, feedback_rate=feedback_rate, log=click.echo,
+    )
+    total = sum(s["rows"] for s in stats.values())
+    dt = time.perf_counter() - t0
+    click.echo(f"Итого: {total} строк за {dt:.2f} с ({round(total / dt)} строк/с)")
+    click.echo(f"Строк в отчётах: {reports.rebuild()}")
+    click.echo(f"Отзывов в сводке: {feedback.rebuild()}")
+
+
+@click.command("plan-demand")
+@click.option("--from", "from_str", required=True, help="Первый день (YYYY-MM-DD)")
+@click.option("--to", "to_str", required=True, help="Последний день (YYYY-MM-DD)")
+@click.option("--draft", is_flag=True, help="Создать заявки ProductRequest на нехватку")
+@with_appcontext
+def plan_demand_command(from_str, to_str, draft):
+    """Считает потребность в продуктах на оплаченные меню за период."""
+    import planner
+
+    demand = planner.compute_demand(date.fromisoformat(from_str), date.fromisoformat(to_str))
+    for item in demand:
+        click.echo(
+            f"{item['name']}: нужно {item['demand']} {item['unit']}, есть {item['stock']}, "
+            f"заказано {item['ordered']}, не хватает {item['shortfall']}"
+        )
+    if draft:
+        drafts = planner.draft_requests(demand)
+        click.echo(f"Создано заявок: {len(drafts)}")
+
+
+@click.command("generate-menus")
+@click.option("--from", "from_str", required=True, help="Первый день (YYYY-MM-DD)")
+@click.option("--days", default=30, show_default=True, help="Количество дней")
+@click.option("--weekdays-only", is_flag=True, help="Только будние дни")
+@click.option("--portions", default=None, type=int, help="Порций на меню, по умолчанию - по продажам")
+@click.option("--seed", default=0, show_default=True, help="Seed локального поиска")
+@click.option("--dry-run", is_flag=True, help="Только показать, не записывать")
+@with_appcontext
+def generate_menus_command(from_str, days, weekdays_only, portions, seed, dry_run):
+    """Составляет меню на период с учётом остатков, рецептур и аллергий учеников."""
+    import menu_generator
+    from models import MealType
+
+    result = menu_generator.generate(
+        date.fromisoformat(from_str), days, weekdays_only=weekdays_only, dry_run=dry_run, seed=seed,
+        portions=dict.fromkeys(MealType, portions) if portions else None,
+    )
+    for menu in result["menus"]:
+        click.echo(f"{menu['date']} {menu['type']}: {', '.join(map(str, menu['dishes']))} ({menu['portions']} порций)")
+    for slot in result["skipped"]:
+        click.echo(f"{slot['date']} {slot['type']}: меню уже есть, пропущено")
+    for slot in result["unfilled"]:
+        click.echo(f"{slot['date']} {slot['type']}: не хватает продуктов на {slot['missing']} блюд(а)", err=True)
+    click.echo(
+        f"Меню: {len(result['menus'])}, записано: {result['created']}, оценка {result['score']}, "
+        f"близких повторов {result['close_repeats']}; загрузка {result['load_seconds']} с, "
+        f"поиск {result['seconds']} с"
+    )
+
+
+@click.command("bench-allergens")
+@click.option("--users", default=2000, show_default=True, help="Сколько учеников с аллергиями проверить")
+@with_appcontext
+def bench_allergens_command(users):
+    """Сравнивает фильтрацию блюд по аллергенам: join-ы в БД против битовых масок."""
+    from allergen_index import clear_user_masks, dish_index, unsafe_dishes_by_join, user_masks
+    from models import Dish, UserAllergy
+
+    dish_ids = [d for (d,) in db.session.query(Dish.id)]
+    user_ids = [u for (u,) in db.session.query(UserAllergy.user_id).distinct().limit(users)]
+
+    t0 = time.perf_counter()
+    by_join = {u: unsafe_dishes_by_join(u, dish_ids) for u in user_ids}
+    t_join = time.perf_counter() - t0
+
+    def by_mask():
+        result = {}
+        for u in user_ids:
+            allergy_mask, _ = user_masks(u)
+            result[u] = {d for d in dish_ids if dish_index.masks(d)[0] & allergy_mask}
+        return result
+
+    dish_index.reset()
+    clear_user_masks()
+    t0 = time.perf_counter()
+    cold = by_mask()
+    t_cold = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    by_mask()
+    t_warm = time.perf_counter() - t0
+
+    click.echo(f"учеников: {len(user_ids)}, блюд: {len(dish_ids)}, результаты совпадают: {cold == by_join}")
+    for name, dt in (("join", t_join), ("маски (холодный кэш)", t_cold), ("маски (тёплый кэш)", t_warm)):
+        click.echo(f"{name}: {dt * 1000:.1f} мс, {dt * 1e6 / max(len(user_ids), 1):.1f} мкс на ученика")
+
+
+@click.command("compact-stock")
+@with_appcontext
+def compact_stock_command():
+    """Сжимает журнал движений продуктов в снимки остатков."""
+    import inventory
+
+    click.echo(f"Новых снимков: {inventory.compact()}")
+
+
+@click.command("rebuild-reports")
+@click.option("--from", "from_str", default=None, help="Первый день (YYYY-MM-DD), по умолчанию - всё")
+@click.option("--to", "to_str", default=None, help="Последний день (YYYY-MM-DD)")
+@with_appcontext
+def rebuild_reports_command(from_str, to_str):
+    """Пересобирает итоги для отчётов по PaidMenu и сводку отзывов (после загрузки данных в обход API)."""
+    import feedback
+    import reports
+
+    n = reports.rebuild(
+        date.fromisoformat(from_str) if from_str else None,
+        date.fromisoformat(to_str) if to_str else None,
+    )
+    click.echo(f"Строк в отчётах: {n}")
+    if from_str is None and to_str is None:
+        # счётчики отзывов пересчитываются только целиком
+        click.echo(f"Отзывов в сводке: {feedback.rebuild()}")
+
+
+@click.command("export")
+@click.argument("kind", type=click.Choice(["purchases", "feedback", "product-requests"]))
+@click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]), default="csv", show_default=True)
+@click.option("--from", "from_str", default=None, help="Первый день (YYYY-MM-DD)")
+@click.option("--to", "to_str", default=None, help="Последний день (YYYY-MM-DD)")
+@click.option("--output", "-o", type=click.File("w", encoding="utf-8"), default="-", help="Файл (по умолчанию stdout)")
+@with_appcontext
+def export_command(kind, fmt, from_str, to_str, output):
+    """Потоковая выгрузка покупок, отзывов или заявок на продукты."""
+    import resource
+
+    import exports
+
+    counter = [0]
+    t0 = time.perf_counter()
+    rows = exports.iter_rows(
+        kind,
+        date.fromisoformat(from_str) if from_str else None,
+        date.fromisoformat(to_str) if to_str else None,
+    )
+    for chunk in exports.iter_chunks(rows, fmt, counter):
+        output.write(chunk)
+    dt = time.perf_counter() - t0
+
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    click.echo(
+        f"{kind}: {counter[0]} строк за {dt:.2f} с ({round(counter[0] / dt) if dt else counter[0]} строк/с), "
+        f"пик памяти {peak_mb:.0f} МБ",
+        err=True,
+    )
+
+
+@click.command("import-roster")
+@click.argument("file", type=click.File("r", encoding="utf-8-sig"))
+@click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]), default=None,
+              help="Формат, по умолчанию - по расширению файла")
+@click.option("--batch-size", default=500, show_default=True, help="Строк в пачке")
+@with_appcontext
+def import_roster_command(file, fmt, batch_size):
+    """Загружает учеников из CSV/NDJSON (login, password, money, allergies, disliked)."""
+    import roster
+
+    fmt = fmt or ("ndjson" if file.name.endswith((".ndjson", ".jsonl")) else "csv")
+    for result in roster.import_roster(roster.parse(file, fmt), batch_size=batch_size):
+        if "summary" in result:
+            s = result["summary"]
+            click.echo(
+                f"Строк: {s['rows']}, создано: {s['created']}, ошибок: {s['errors']} за {s['seconds']} с "
+                f"({s['rows_per_sec']} строк/с; хэширование {s['hash_seconds']} с, вставка {s['insert_seconds']} с)"
+            )
+        else:
+            click.echo(f"строка {result['line']} ({result['login'] or '-'}): {result['error']}", err=True)
+
+
+@click.command("build-static")
+@click.option("--src", default=None, help="Каталог исходников, по умолчанию PUBLIC_DIR (public/)")
+@click.option("--out", default=None, help="Куда собрать, по умолчанию STATIC_BUILD_DIR")
+def build_static_command(src, out):
+    """Хэширует имена статических файлов, сжимает их (gzip/brotli) и переписывает ссылки в HTML."""
+    import static_assets
+
+    static_assets.build(src or static_assets.PUBLIC_DIR, out or static_assets.STATIC_BUILD_DIR, log=click.echo)
+
+
+@click.command("bench")
+@click.option("--scenario", "scenarios", multiple=True,
+              type=click.Choice(["login", "login_inline", "menu_today", "menu_range", "purchase", "pickup"]),
+              help="Сценарий (можно несколько), по умолчанию - все")
+@click.option("--requests", "n", default=500, show_default=True, help="Запросов на сценарий")
+@click.option("--concurrency", default=8, show_default=True, help="Параллельных клиентов")
+@click.option("--url", default=None, help="Адрес запущенного сервера, по умолчанию - внутри процесса")
+@click.option("--prepare", is_flag=True, help="Пересоздать данные перед замером (очищает таблицы)")
+@click.option("--students", default=2000, show_default=True, help="Учеников при --prepare")
+@click.option("--history-days", default=60, show_default=True, help="Дней истории при --prepare")
+@click.option("--seed", default=42, show_default=True, help="Seed данных и выбора запросов")
+@click.option("--save", "save_to", type=click.Path(dir_okay=False), default=None, help="Сохранить результат в JSON")
+@click.option("--baseline", type=click.Path(exists=True, dir_okay=False), default=None,
+              help="JSON базовой линии: при регрессии команда завершается с ошибкой")
+@click.option("--threshold", default=0.2, show_default=True, help="Допустимое ухудшение p95 и rps (доля)")
+@with_appcontext
+def bench_command(scenarios, n, concurrency, url, prepare, students, history_days, seed, save_to, baseline,
+                  threshold):
+    """Нагрузочные сценарии: вход, меню, покупки, выдача. Печатает rps и p50/p95/p99."""
+    import json
+
+    from flask import current_app
+
+    import bench
+
+    if prepare:
+        bench.prepare(students=students, history_days=history_days, seed=seed, log=click.echo)
+
+    result = bench.run(
+        current_app._get_current_object(), scenarios or list(bench.SCENARIOS),
+        requests=n, concurrency=concurrency, url=url, seed=seed, log=click.echo,
+    )
+    if save_to:
+        with open(save_to, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        click.echo(f"Результат сохранён в {save_to}")
+
+    if baseline:
+        with open(baseline, encoding="utf-8") as f:
+            regressions = bench.compare(result, json.load(f), threshold)
+        if regressions:
+            raise click.ClickException("Регрессии: " + "; ".join(regressions))
+        click.echo(f"Регрессий нет (порог {threshold:.0%})")
+
+
+@click.command("bench-poll")
+@click.option("--url", required=True, help="Адрес запущенного сервера")
+@click.option("--clients", default="50,100,200,400,800,1600", show_default=True,
+              help="Уровни числа клиентов через запятую")
+@click.option("--seconds", default=10.0, show_default=True, help="Длительность уровня")
+@click.option("--interval", default=1.0, show_default=True, help="Период опроса одного клиента, с")
+@click.option("--slo-ms", default=200.0, show_default=True, help="Допустимый p95, мс")
+@click.option("--save", "save_to", type=click.Path(dir_okay=False), default=None, help="Сохранить результат в JSON")
+def bench_poll_command(url, clients, seconds, interval, slo_ms, save_to):
+    """Сколько клиентов, опрашивающих /menu/today, выдерживает сервер (сравнение режимов gunicorn)."""
+    import json
+
+    import bench
+
+    levels = [int(x) for x in clients.split(",") if x.strip()]
+    result = bench.sweep(url, levels, seconds=seconds, interval=interval, slo_ms=slo_ms, log=click.echo)
+    click.echo(f"Максимум клиентов: {result['max_clients']}")
+    if save_to:
+        with open(save_to, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+@click.command("bench-pages")
+@click.option("--kind", type=click.Choice(["users", "purchases", "product-requests"]), default="purchases",
+              show_default=True)
+@click.option("--pages", default=200, show_default=True, help="Сколько страниц пройти")
+@click.option("--limit", default=100, show_default=True, help="Строк на странице")
+@click.option("--url", default=None, help="Адрес запущенного сервера (по умолчанию - внутри процесса)")
+@click.option("--save", "save_to", type=click.Path(dir_okay=False), default=None, help="Сохранить результат в JSON")
+@with_appcontext
+def bench_pages_command(kind, pages, limit, url, save_to):
+    """Время далёких страниц списков админки: по ключу против OFFSET."""
+    import json
+
+    from flask import current_app
+
+    import bench
+
+    result = bench.deep_pages(current_app._get_current_object(), kind, pages=pages, limit=limit, url=url,
+                              log=click.echo)
+    click.echo(f"Пройдено страниц: {result['pages']}")
+    if save_to:
+        with open(save_to, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+def register_commands(app):
+    for command in (migrate_command, check_plans_command, seed_command, generate_data_command, plan_demand_command,
+                    generate_menus_command, bench_allergens_command, compact_stock_command, rebuild_reports_command,
+                    export_command, import_roster_command, build_static_command, bench_command, bench_poll_command,
+                    bench_pages_command):
+        app.cli.add_command(command)
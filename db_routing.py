@@ -0,0 +1,160 @@
+"""
+Настройки пула соединений и чтение с реплики.
+
+Если задан DATABASE_REPLICA_URL, маршруты, вызвавшие use_replica() (menu_bp),
+выполняют SELECT на реплике, а запись и всё остальное идёт в основную БД.
+После покупки (mark_written) чтения этого пользователя DB_STICKY_SECONDS
+секунд тоже идут в основную БД, чтобы он сразу видел свои изменения,
+даже если реплика отстаёт. Ответы, которые попадут в общий кэш, читаются
+из основной БД (read_primary): иначе после сброса кэша отстающая реплика
+вернула бы в него старые данные надолго.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import request
+from flask_sqlalchemy.session import Session
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Соединения старше стольких секунд пересоздаются (idle-таймауты сервера и балансировщиков)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+# PgBouncer в режиме pool_mode=transaction: пулом управляет он, приложение
+# держит соединение только на время транзакции (NullPool)
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "0") == "1"
+
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL", "")
+DB_STICKY_SECONDS = float(os.getenv("DB_STICKY_SECONDS", "5"))
+# "" - в памяти процесса, "local" или "redis://..." - общий для воркеров (как MENU_CACHE_BACKEND)
+DB_STICKY_BACKEND = os.getenv("DB_STICKY_BACKEND", "")
+
+REPLICA_BIND = "replica"
+
+
+def engine_options(url: str) -> dict:
+    """Параметры create_engine для url с учётом настроек пула."""
+    if make_url(url).get_backend_name() != "postgresql":
+        # у SQLite свой пул, размеры к нему не применимы
+        return {"pool_pre_ping": DB_POOL_PRE_PING}
+    if DB_PGBOUNCER:
+        return {"poolclass": NullPool}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def configure(app, url: str, replica_url: str = DATABASE_REPLICA_URL):
+    app.config["SQLALCHEMY_DATABASE_URI"] = url
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(url)
+    if replica_url:
+        app.config["SQLALCHEMY_BINDS"] = {REPLICA_BIND: {"url": replica_url, **engine_options(replica_url)}}
+
+
+class RoutingSession(Session):
+    """Сессия, отправляющая SELECT на реплику, если так решил use_replica()."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and self.info.get(REPLICA_BIND)
+            and not self._flushing
+            and getattr(clause, "is_select", False)
+        ):
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class StickyWrites:
+    """Пользователи, недавно писавшие в основную БД: user_id -> до какого времени."""
+
+    def __init__(self, backend=None):
+        self._backend = backend
+        self._local = {}
+        self._lock = threading.Lock()
+
+    def mark(self, user_id: int):
+        until = time.time() + DB_STICKY_SECONDS
+        if self._backend is not None:
+            self._backend.set(f"db:sticky:{user_id}", repr(until))
+            return
+        with self._lock:
+            self._local[user_id] = until
+            if len(self._local) > 10000:
+                now = time.time()
+                self._local = {u: t for u, t in self._local.items() if t > now}
+
+    def active(self, user_id: int) -> bool:
+        if self._backend is not None:
+            until = self._backend.get(f"db:sticky:{user_id}")
+        else:
+            until = self._local.get(user_id)
+        return until is not None and float(until) > time.time()
+
+
+_sticky = None
+
+
+def _sticky_writes() -> StickyWrites:
+    # создаётся при первом обращении: models импортирует этот модуль раньше menu_cache
+    global _sticky
+    if _sticky is None:
+        from menu_cache import make_backend
+
+        _sticky = StickyWrites(make_backend(DB_STICKY_BACKEND))
+    return _sticky
+
+
+def _request_user_id():
+    from auth import AuthError, verify_token
+
+    header = request.headers.get("Authorization", "")
+    if not header.startswith("Bearer "):
+        return None
+    try:
+        return int(verify_token(header[len("Bearer "):].strip())["sub"])
+    except (AuthError, ValueError):
+        return None
+
+
+def use_replica():
+    """Чтения текущего запроса - с реплики (если она есть и пользователь недавно не писал)."""
+    if not DATABASE_REPLICA_URL:
+        return
+    user_id = _request_user_id()
+    if user_id is not None and _sticky_writes().active(user_id):
+        return
+
+    from models import db
+
+    db.session.info[REPLICA_BIND] = True
+
+
+@contextmanager
+def read_primary():
+    """Чтения внутри блока - из основной БД, даже если запрос вызвал use_replica()."""
+    from models import db
+
+    replica = db.session.info.pop(REPLICA_BIND, None)
+    try:
+        yield
+    finally:
+        if replica:
+            db.session.info[REPLICA_BIND] = replica
+
+
+def mark_written(user_id: int):
+    """Вызывается после коммита записи пользователя."""
+    if DATABASE_REPLICA_URL:
+        _sticky_writes().mark(user_id)
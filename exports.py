@@ -0,0 +1,150 @@
+"""
+Потоковая выгрузка больших таблиц в CSV/NDJSON.
+Строки читаются курсором на стороне сервера (yield_per) и сразу отдаются
+клиенту, поэтому память воркера не растёт с количеством строк.
+"""
+import csv
+import io
+import json
+from datetime import date as _date
+from enum import Enum
+
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from sqlalchemy import select
+
+from auth import login_required
+from models import db, Feedback, Menu, PaidMenu, Product, ProductRequest, User, UserRole
+
+
+export_bp = Blueprint("export", __name__, url_prefix="/export")
+
+EXPORT_BATCH_ROWS = 2000
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _purchases(d_from, d_to):
+    q = (
+        select(
+            PaidMenu.id, PaidMenu.user_id, User.login, PaidMenu.menu_id,
+            Menu.date, Menu.type, Menu.price, PaidMenu.is_taken,
+        )
+        .join(Menu, Menu.id == PaidMenu.menu_id)
+        .join(User, User.id == PaidMenu.user_id)
+        .order_by(PaidMenu.id.asc())
+    )
+    if d_from:
+        q = q.where(Menu.date >= d_from)
+    if d_to:
+        q = q.where(Menu.date <= d_to)
+    return q
+
+
+def _feedback(d_from, d_to):
+    q = (
+        select(
+            Feedback.id, Feedback.user_id, Feedback.menu_id, Menu.date,
+            Feedback.dish_id, Feedback.text,
+        )
+        .outerjoin(Menu, Menu.id == Feedback.menu_id)
+        .order_by(Feedback.id.asc())
+    )
+    if d_from:
+        q = q.where(Menu.date >= d_from)
+    if d_to:
+        q = q.where(Menu.date <= d_to)
+    return q
+
+
+def _product_requests(d_from, d_to):
+    q = (
+        select(
+            ProductRequest.id, ProductRequest.product_id, Product.name.label("product"),
+            ProductRequest.amount, Product.unit, ProductRequest.is_agreed,
+            ProductRequest.created, ProductRequest.fulfilled,
+        )
+        .join(Product, Product.id == ProductRequest.product_id)
+        .order_by(ProductRequest.id.asc())
+    )
+    if d_from:
+        q = q.where(ProductRequest.created >= d_from)
+    if d_to:
+        q = q.where(ProductRequest.created <= d_to)
+    return q
+
+
+EXPORTS = {
+    "purchases": _purchases,
+    "feedback": _feedback,
+    "product-requests": _product_requests,
+}
+
+
+def json_value(v):
+    """Значение колонки для JSON/CSV: перечисление - по имени, дата - ISO."""
+    if isinstance(v, Enum):
+        return v.name
+    if isinstance(v, _date):
+        return v.isoformat()
+    return v
+
+
+def iter_rows(kind: str, d_from=None, d_to=None):
+    """Генератор: сначала кортеж имён колонок, затем строки."""
+    q = EXPORTS[kind](d_from, d_to)
+    result = db.session.execute(q.execution_options(yield_per=EXPORT_BATCH_ROWS))
+    yield tuple(result.keys())
+    for row in result:
+        yield tuple(json_value(v) for v in row)
+
+
+def iter_chunks(rows, fmt: str, counter=None):
+    """Превращает строки в куски текста по EXPORT_BATCH_ROWS строк."""
+    header = next(rows)
+    buf = io.StringIO()
+    writer = csv.writer(buf) if fmt == "csv" else None
+    if writer:
+        writer.writerow(header)
+
+    n = 0
+    for row in rows:
+        if writer:
+            writer.writerow(row)
+        else:
+            buf.write(json.dumps(dict(zip(header, row)), ensure_ascii=False))
+            buf.write("\n")
+        n += 1
+        if n % EXPORT_BATCH_ROWS == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            if counter is not None:
+                counter[0] = n
+
+    if counter is not None:
+        counter[0] = n
+    yield buf.getvalue()
+
+
+@export_bp.get("/<kind>")
+@login_required(UserRole.ADMIN)
+def export(kind: str):
+    if kind not in EXPORTS:
+        return jsonify({"message": f"Неизвестная выгрузка, доступны: {', '.join(EXPORTS)}"}), 404
+
+    fmt = (request.args.get("format") or "csv").strip()
+    if fmt not in FORMATS:
+        return jsonify({"message": "format должен быть csv или ndjson"}), 400
+
+    try:
+        d_from = _date.fromisoformat(request.args["from"]) if request.args.get("from") else None
+        d_to = _date.fromisoformat(request.args["to"]) if request.args.get("to") else None
+    except ValueError:
+        return jsonify({"message": "Неверный формат from/to. Используй YYYY-MM-DD"}), 400
+
+    chunks = iter_chunks(iter_rows(kind, d_from, d_to), fmt)
+    resp = Response(stream_with_context(chunks), mimetype=FORMATS[fmt])
+    resp.headers["Content-Disposition"] = f'attachment; filename="{kind}.{fmt}"'
+    return resp
@@ -0,0 +1,312 @@
+"""
+Отзывы: добавление, полнотекстовый поиск и сводка по блюдам (/feedback).
+
+Поиск идёт по полнотекстовому индексу из миграции 4: на PostgreSQL -
+GIN-индекс по to_tsvector('russian', text), на SQLite - таблица FTS5
+feedback_fts, которую триггеры держат в согласии с feedback. Страницы
+отдаются по ключу (after = id последнего отзыва на странице), без OFFSET.
+
+Число отзывов по блюду и меню и счётчики меток (TAGS) лежат в
+DishFeedbackStats, MenuFeedbackStats и DishFeedbackTag: они обновляются
+при добавлении отзыва, поэтому сводке не нужен проход по feedback.
+После загрузки отзывов в обход API (seed, generate-data) - rebuild().
+"""
+import re
+from collections import Counter
+
+from flask import Blueprint, g, jsonify, request
+from sqlalchemy import column, delete, func, literal_column, select, table, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from auth import login_required
+from models import (
+    db, Dish, DishFeedbackStats, DishFeedbackTag, Feedback, Menu, MenuDishes, MenuFeedbackStats, PaidMenu, UserRole,
+)
+from reports import parse_range
+
+# конфигурация to_tsvector; индекс строится с ней же, поэтому не настраивается
+FTS_CONFIG = "russian"
+SEARCH_PAGE_SIZE = 50
+MAX_SEARCH_PAGE_SIZE = 200
+MAX_TEXT_LENGTH = 500
+
+# метка -> начала слов; "не" перед словом метку отменяет ("не вкусно")
+TAGS = {
+    "вкусно": ("вкусн", "отличн", "хорош", "спасибо"),
+    "невкусно": ("невкусн", "противн", "отвратительн"),
+    "холодное": ("холодн", "остыл", "остывш"),
+    "пересолено": ("солён", "солен", "пересол"),
+    "сладко": ("сладк", "сахар"),
+    "мало": ("мало", "маленьк", "недостаточн"),
+    "однообразно": ("разнообраз", "однообраз"),
+}
+
+_WORD = re.compile(r"\w+")
+_fts = table("feedback_fts", column("rowid"))
+
+
+feedback_bp = Blueprint("feedback", __name__, url_prefix="/feedback")
+
+
+def tags(value: str | None) -> set:
+    found = set()
+    prev = None
+    for word in _WORD.findall((value or "").lower()):
+        if prev != "не":
+            found.update(tag for tag, stems in TAGS.items() if word.startswith(stems))
+        prev = word
+    return found
+
+
+# --- индекс ---
+
+_SQLITE_FTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS feedback_fts USING fts5("
+    "text, content='feedback', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS feedback_fts_ai AFTER INSERT ON feedback BEGIN "
+    "INSERT INTO feedback_fts(rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS feedback_fts_ad AFTER DELETE ON feedback BEGIN "
+    "INSERT INTO feedback_fts(feedback_fts, rowid, text) VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER IF NOT EXISTS feedback_fts_au AFTER UPDATE OF text ON feedback BEGIN "
+    "INSERT INTO feedback_fts(feedback_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+    "INSERT INTO feedback_fts(rowid, text) VALUES (new.id, new.text); END",
+    # заполняет индекс по уже существующим строкам
+    "INSERT INTO feedback_fts(feedback_fts) VALUES ('rebuild')",
+]
+
+
+def _tsvector():
+    # то же выражение, что в индексе ix_feedback_text_fts, иначе PostgreSQL его не использует
+    return func.to_tsvector(literal_column(f"'{FTS_CONFIG}'"), func.coalesce(Feedback.text, literal_column("''")))
+
+
+def create_search_index(conn):
+    """Полнотекстовый индекс по feedback.text (миграция 4), повторный вызов ничего не ломает."""
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_feedback_text_fts ON feedback "
+            f"USING gin (to_tsvector('{FTS_CONFIG}', coalesce(text, '')))"
+        ))
+        return
+    for statement in _SQLITE_FTS:
+        conn.execute(text(statement))
+
+
+# --- счётчики ---
+
+def _tally(items, dishes: Counter, menus: Counter, dish_tags: Counter):
+    for menu_id, dish_id, value in items:
+        if menu_id is not None:
+            menus[menu_id] += 1
+        if dish_id is not None:
+            dishes[dish_id] += 1
+            for tag in tags(value):
+                dish_tags[dish_id, tag] += 1
+
+
+def _upsert_counts(conn, model, keys: list, rows: list):
+    """Прибавляет count по ключу keys одним INSERT ... ON CONFLICT DO UPDATE."""
+    if not rows:
+        return
+    make_insert = pg_insert if conn.dialect.name == "postgresql" else sqlite_insert
+    stmt = make_insert(model)
+    stmt = stmt.on_conflict_do_update(index_elements=keys, set_={"count": model.count + stmt.excluded.count})
+    conn.execute(stmt, rows)
+
+
+def _apply(conn, dishes: Counter, menus: Counter, dish_tags: Counter):
+    _upsert_counts(conn, DishFeedbackStats, [DishFeedbackStats.dish_id],
+                   [{"dish_id": k, "count": n} for k, n in dishes.items()])
+    _upsert_counts(conn, MenuFeedbackStats, [MenuFeedbackStats.menu_id],
+                   [{"menu_id": k, "count": n} for k, n in menus.items()])
+    _upsert_counts(conn, DishFeedbackTag, [DishFeedbackTag.dish_id, DishFeedbackTag.tag],
+                   [{"dish_id": d, "tag": t, "count": n} for (d, t), n in dish_tags.items()])
+
+
+def record_feedback(items):
+    """Счётчики по новым отзывам [(menu_id, dish_id, text)]. Коммит делает вызывающий код."""
+    counters = Counter(), Counter(), Counter()
+    _tally(items, *counters)
+    _apply(db.session.connection(), *counters)
+
+
+def rebuild_stats(conn, batch_size=10000) -> int:
+    """Пересчитывает счётчики по всей таблице feedback. Возвращает число отзывов."""
+    for model in (DishFeedbackTag, DishFeedbackStats, MenuFeedbackStats):
+        conn.execute(delete(model))
+
+    counters = Counter(), Counter(), Counter()
+    total, last_id = 0, 0
+    while True:
+        rows = conn.execute(
+            select(Feedback.id, Feedback.menu_id, Feedback.dish_id, Feedback.text)
+            .where(Feedback.id > last_id)
+            .order_by(Feedback.id.asc())
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        _tally(((menu_id, dish_id, value) for _, menu_id, dish_id, value in rows), *counters)
+        total += len(rows)
+        last_id = rows[-1][0]
+    _apply(conn, *counters)
+    return total
+
+
+def rebuild() -> int:
+    n = rebuild_stats(db.session.connection())
+    db.session.commit()
+    return n
+
+
+# --- поиск ---
+
+def _match(q: str) -> str:
+    # FTS5 без стемминга: слова запроса ищутся как префиксы ("холодн суп" -> "холодн"* "суп"*)
+    return " ".join(f'"{w}"*' for w in _WORD.findall(q.lower()))
+
+
+def search(q: str | None = None, dish_id=None, menu_id=None, after=None, limit=SEARCH_PAGE_SIZE) -> tuple:
+    """Страница отзывов от новых к старым. Возвращает (отзывы, after для следующей страницы или None)."""
+    key = Feedback.id
+    query = (
+        select(Feedback.id, Feedback.text, Feedback.user_id, Feedback.menu_id, Menu.date, Feedback.dish_id, Dish.name)
+        .outerjoin(Menu, Menu.id == Feedback.menu_id)
+        .outerjoin(Dish, Dish.id == Feedback.dish_id)
+    )
+    if q:
+        if db.session.get_bind().dialect.name == "postgresql":
+            query = query.where(_tsvector().bool_op("@@")(
+                func.websearch_to_tsquery(literal_column(f"'{FTS_CONFIG}'"), q)
+            ))
+        else:
+            # ключ страниц - rowid FTS5: так ограничение и сортировку выполняет сам индекс
+            key = _fts.c.rowid
+            query = query.join(_fts, _fts.c.rowid == Feedback.id).where(
+                text("feedback_fts MATCH :match").bindparams(match=_match(q))
+            )
+    if dish_id is not None:
+        query = query.where(Feedback.dish_id == dish_id)
+    if menu_id is not None:
+        query = query.where(Feedback.menu_id == menu_id)
+    if after is not None:
+        query = query.where(key < after)
+
+    rows = db.session.execute(query.order_by(key.desc()).limit(limit + 1)).all()
+    items = [
+        {
+            "id": feedback_id,
+            "text": value,
+            "user_id": user_id,
+            "menu_id": m_id,
+            "date": d.isoformat() if d else None,
+            "dish_id": d_id,
+            "dish": dish_name,
+            "tags": sorted(tags(value)),
+        }
+        for feedback_id, value, user_id, m_id, d, d_id, dish_name in rows[:limit]
+    ]
+    return items, (items[-1]["id"] if len(rows) > limit else None)
+
+
+def _int_arg(name: str, default=None):
+    value = (request.args.get(name) or "").strip()
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} должно быть целым числом")
+
+
+# --- эндпоинты ---
+
+@feedback_bp.post("")
+@login_required(UserRole.STUDENT)
+def add_feedback():
+    data = request.get_json(silent=True) or {}
+    value = str(data.get("text") or "").strip()
+    try:
+        menu_id = int(data.get("menu_id"))
+        dish_id = int(data.get("dish_id"))
+    except (TypeError, ValueError):
+        return jsonify({"message": "Нужны целые menu_id и dish_id"}), 400
+    if not value or len(value) > MAX_TEXT_LENGTH:
+        return jsonify({"message": f"Текст отзыва от 1 до {MAX_TEXT_LENGTH} символов"}), 400
+
+    taken = (
+        db.session.query(PaidMenu.id)
+        .filter(PaidMenu.user_id == g.principal.id, PaidMenu.menu_id == menu_id, PaidMenu.is_taken.is_(True))
+        .first()
+    )
+    if taken is None:
+        return jsonify({"message": "Отзыв можно оставить только на полученное меню"}), 403
+    in_menu = db.session.query(MenuDishes.dish_id).filter_by(menu_id=menu_id, dish_id=dish_id).first()
+    if in_menu is None:
+        return jsonify({"message": "Блюда нет в этом меню"}), 404
+
+    item = Feedback(text=value, user_id=g.principal.id, menu_id=menu_id, dish_id=dish_id)
+    db.session.add(item)
+    db.session.flush()
+    record_feedback([(menu_id, dish_id, value)])
+    db.session.commit()
+    return jsonify({"id": item.id, "menu_id": menu_id, "dish_id": dish_id, "text": value,
+                    "tags": sorted(tags(value))}), 201
+
+
+@feedback_bp.get("/search")
+@login_required(UserRole.ADMIN)
+def search_feedback():
+    q = (request.args.get("q") or "").strip()
+    if q and not _WORD.search(q):
+        return jsonify({"message": "В запросе нет слов"}), 400
+    try:
+        dish_id = _int_arg("dish_id")
+        menu_id = _int_arg("menu_id")
+        after = _int_arg("after")
+        limit = _int_arg("limit", SEARCH_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    if not 1 <= limit <= MAX_SEARCH_PAGE_SIZE:
+        return jsonify({"message": f"limit от 1 до {MAX_SEARCH_PAGE_SIZE}"}), 400
+
+    items, next_after = search(q or None, dish_id, menu_id, after, limit)
+    return jsonify({"q": q, "items": items, "next_after": next_after})
+
+
+@feedback_bp.get("/dishes")
+@login_required(UserRole.ADMIN)
+def dish_summary():
+    rows = (
+        db.session.query(Dish.id, Dish.name, DishFeedbackStats.count)
+        .join(DishFeedbackStats, DishFeedbackStats.dish_id == Dish.id)
+        .order_by(DishFeedbackStats.count.desc(), Dish.id.asc())
+        .all()
+    )
+    dish_tags = {}
+    for dish_id, tag, n in db.session.query(DishFeedbackTag.dish_id, DishFeedbackTag.tag, DishFeedbackTag.count):
+        dish_tags.setdefault(dish_id, {})[tag] = n
+    return jsonify({"dishes": [
+        {"dish_id": dish_id, "name": name, "count": n, "tags": dish_tags.get(dish_id, {})}
+        for dish_id, name, n in rows
+    ]})
+
+
+@feedback_bp.get("/menus")
+@login_required(UserRole.ADMIN)
+def menu_summary():
+    d_from, d_to, error = parse_range()
+    if error:
+        return error
+    rows = (
+        db.session.query(Menu.id, Menu.date, Menu.type, MenuFeedbackStats.count)
+        .join(MenuFeedbackStats, MenuFeedbackStats.menu_id == Menu.id)
+        .filter(Menu.date >= d_from, Menu.date <= d_to)
+        .order_by(Menu.date.asc(), Menu.id.asc())
+        .all()
+    )
+    return jsonify({"from": d_from.isoformat(), "to": d_to.isoformat(), "menus": [
+        {"menu_id": menu_id, "date": d.isoformat(), "type": t.value if t else None, "count": n}
+        for menu_id, d, t, n in rows
+    ]})
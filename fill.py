@@ -1,13 +1,22 @@
+import csv
+import io
+import random
+import time
 from datetime import date, timedelta
+
+from sqlalchemy import insert, select
 from werkzeug.security import generate_password_hash
 
+import menu_generator
 from models import (
     db,
     UserRole, MealType, Unit,
     User, FoodType, Product, ProductType,
     Allergy, AllergyProducts, UserDisliked, UserAllergy,
     Dish, Compound, Menu, MenuDishes,
-    PaidMenu, Feedback, ProductRequest
+    PaidMenu, PurchaseKey, Feedback, ProductRequest,
+    StockMovement, StockSnapshot, MenuStats, MenuStatsDelta,
+    DishFeedbackStats, DishFeedbackTag, MenuFeedbackStats
 )
 
 def seed_test_data(start=date(2026, 2, 9), days=10):
@@ -16,16 +25,12 @@ def seed_test_data(start=date(2026, 2, 9), days=10):
     По умолчанию: 10 дней с 09.02.2026 по 18.02.2026 включительно.
     Чтобы получить по 19.02 включительно — поставь days=11.
     """
-    # --- helpers ---
-    def daterange(d0, n):
-        for i in range(n):
-            yield d0 + timedelta(days=i)
-
     # Очистка (по желанию). Если не нужно — закомментируй.
     # Важно: порядок удаления из-за FK.
     for model in [
-        Feedback, PaidMenu, MenuDishes, Menu, Compound, Dish,
-        ProductRequest, AllergyProducts, UserAllergy, UserDisliked,
+        DishFeedbackTag, DishFeedbackStats, MenuFeedbackStats,
+        Feedback, PurchaseKey, MenuStats, MenuStatsDelta, PaidMenu, MenuDishes, Menu, Compound, Dish,
+        StockSnapshot, StockMovement, ProductRequest, AllergyProducts, UserAllergy, UserDisliked,
         ProductType, Allergy, Product, FoodType, User
     ]:
         db.session.query(model).delete()
@@ -205,81 +210,79 @@ def seed_test_data(start=date(2026, 2, 9), days=10):
     ]
     db.session.add_all(compounds)
 
-    # --- меню на дни ---
-    menus = []
-    for day in daterange(start, days):
-        menus.append(Menu(date=day, type=MealType.BREAKFAST))
-        menus.append(Menu(date=day, type=MealType.LUNCH))
-    db.session.add_all(menus)
     db.session.flush()
 
-    # Привязка блюд к меню (MenuDishes)
-    # Завтраки чередуем
-    breakfast_sets = [
-        ["Овсяная каша на молоке", "Чай с сахаром", "Фрукты (яблоко/банан)"],
-        ["Омлет", "Чай с сахаром", "Бутерброд с сыром"],
-    ]
-    # Обеды чередуем (в т.ч. рыба раз в 3 дня)
-    lunch_sets = [
-        ["Куриный суп", "Гречка с курицей", "Овощной салат"],
-        ["Куриный суп", "Рис с говядиной", "Овощной салат"],
-        ["Куриный суп", "Рыба с картофелем", "Овощной салат"],
-    ]
-
-    md_rows = []
-    for i in range(days):
-        day = start + timedelta(days=i)
-        # найти меню на день
-        b_menu = next(m for m in menus if m.date == day and m.type == MealType.BREAKFAST)
-        l_menu = next(m for m in menus if m.date == day and m.type == MealType.LUNCH)
-
-        bset = breakfast_sets[i % len(breakfast_sets)]
-        lset = lunch_sets[i % len(lunch_sets)]
-
-        for dish_name in bset:
-            md_rows.append(MenuDishes(menu_id=b_menu.id, dish_id=d[dish_name].id))
-        for dish_name in lset:
-            md_rows.append(MenuDishes(menu_id=l_menu.id, dish_id=d[dish_name].id))
-
-    db.session.add_all(md_rows)
+    # --- меню на дни ---
+    # Составляет menu_generator: без повторов блюд в соседние дни и с безопасными
+    # блюдами для учеников с аллергиями. Остатки не учитываются - меню нужны на весь период.
+    breakfast_dishes = ["Овсяная каша на молоке", "Омлет", "Бутерброд с сыром", "Чай с сахаром", "Фрукты (яблоко/банан)"]
+    lunch_dishes = ["Куриный суп", "Гречка с курицей", "Рис с говядиной", "Рыба с картофелем", "Овощной салат"]
+    pools = {
+        MealType.BREAKFAST: [d[name].id for name in breakfast_dishes],
+        MealType.LUNCH: [d[name].id for name in lunch_dishes],
+    }
+    problem, _ = menu_generator.load(start, days, pools=pools, portions=dict.fromkeys(MealType, 100), use_stock=False)
+    # без ограничения времени - чтобы тестовые данные не зависели от скорости машины
+    plan = menu_generator.solve(problem, seed=0, seconds=None)
+    menu_generator.write(plan["menus"], prices={MealType.BREAKFAST: 120, MealType.LUNCH: 180})
+
+    menus = (
+        Menu.query
+        .filter(Menu.date >= start, Menu.date < start + timedelta(days=days))
+        .order_by(Menu.date.asc(), Menu.id.asc())
+        .all()
+    )
+    # меню по (дата, тип) - чтобы не искать линейно в цикле по дням
+    menu_by_key = {(m.date, m.type): m for m in menus}
+    planned = {(m["date"], m["type"]): set(m["dishes"]) for m in plan["menus"]}
 
     # --- оплаты (PaidMenu) ---
     # студент1 покупает все завтраки, студент2 покупает все обеды, студент3 покупает первые 3 дня
     paid_rows = []
     for i in range(days):
         day = start + timedelta(days=i)
-        b_menu = next(m for m in menus if m.date == day and m.type == MealType.BREAKFAST)
-        l_menu = next(m for m in menus if m.date == day and m.type == MealType.LUNCH)
+        b_menu = menu_by_key[(day, MealType.BREAKFAST)]
+        l_menu = menu_by_key[(day, MealType.LUNCH)]
 
-        paid_rows.append(PaidMenu(user_id=u["student1@example.com"].id, menu_id=b_menu.id, is_taken=(i % 2 == 0)))
-        paid_rows.append(PaidMenu(user_id=u["student2@example.com"].id, menu_id=l_menu.id, is_taken=(i % 3 != 0)))
+        paid_rows.append(PaidMenu(user_id=u["student1@example.com"].id, menu_id=b_menu.id, is_taken=(i % 2 == 0),
+                                  price=b_menu.price))
+        paid_rows.append(PaidMenu(user_id=u["student2@example.com"].id, menu_id=l_menu.id, is_taken=(i % 3 != 0),
+                                  price=l_menu.price))
 
         if i < 3:
-            paid_rows.append(PaidMenu(user_id=u["student3@example.com"].id, menu_id=b_menu.id, is_taken=False))
-            paid_rows.append(PaidMenu(user_id=u["student3@example.com"].id, menu_id=l_menu.id, is_taken=False))
+            paid_rows.append(PaidMenu(user_id=u["student3@example.com"].id, menu_id=b_menu.id, is_taken=False,
+                                      price=b_menu.price))
+            paid_rows.append(PaidMenu(user_id=u["student3@example.com"].id, menu_id=l_menu.id, is_taken=False,
+                                      price=l_menu.price))
 
     db.session.add_all(paid_rows)
 
     # --- отзывы (Feedback) ---
     # Пара отзывов на разные дни/блюда
     some_menus = sorted(menus, key=lambda x: (x.date, x.type.value))
+
+    def menu_with(dish_name, skip=0):
+        # отзыв - на меню, где это блюдо действительно было
+        found = [m for m in some_menus if d[dish_name].id in planned.get((m.date, m.type), ())]
+        return found[min(skip, len(found) - 1)] if found else some_menus[0]
+
     feedbacks = [
         Feedback(
             text="Каша вкусная, но хотелось бы меньше сахара.",
             user_id=u["student1@example.com"].id,
-            menu_id=some_menus[0].id,
+            menu_id=menu_with("Овсяная каша на молоке").id,
             dish_id=d["Овсяная каша на молоке"].id
         ),
         Feedback(
             text="Суп отличный, порции достаточно.",
             user_id=u["student2@example.com"].id,
-            menu_id=some_menus[3].id,
+            menu_id=menu_with("Куриный суп", 2).id,
             dish_id=d["Куриный суп"].id
         ),
         Feedback(
             text="Салат свежий, но мало масла.",
             user_id=u["student3@example.com"].id,
-            menu_id=some_menus[5].id,
+            menu_id=menu_with("Овощной салат", 2).id,
             dish_id=d["Овощной салат"].id
         ),
     ]
@@ -295,4 +298,192 @@ def seed_test_data(start=date(2026, 2, 9), days=10):
 
     db.session.commit()
     return {"start": start.isoformat(), "days": days}
+
+
+# --- большой синтетический набор для нагрузочного тестирования ---
+
+# доля учеников с аллергией (независимо по каждой)
+ALLERGY_RATES = {"Лактоза": 0.12, "Глютен": 0.03, "Рыба": 0.02, "Яйца": 0.025}
+# сколько типов еды ученик не любит: 0, 1, 2, 3
+DISLIKED_COUNT_WEIGHTS = [0.45, 0.35, 0.15, 0.05]
+# какие типы чаще не любят
+DISLIKED_TYPE_WEIGHTS = {
+    "Овощи": 5, "Рыба": 5, "Молочные": 3, "Крупы": 2,
+    "Мясо": 1, "Фрукты": 1, "Выпечка": 1, "Напитки": 1,
+}
+FEEDBACK_TEXTS = [
+    "Очень вкусно, спасибо!",
+    "Порция маленькая.",
+    "Было холодное.",
+    "Слишком солёное.",
+    "Нормально, но хотелось бы разнообразия.",
+    "Отлично, буду брать ещё.",
+    "Невкусно, не доел.",
+    "Хорошо приготовлено.",
+]
+
+
+def _copy_value(v):
+    if v is None:
+        return None
+    if isinstance(v, bool):
+        return "t" if v else "f"
+    if hasattr(v, "name") and hasattr(v, "value"):  # Enum хранится по имени
+        return v.name
+    return v
+
+
+def _bulk_load(model, columns, rows, batch_size):
+    """
+    Загружает кортежи rows в таблицу модели пачками по batch_size.
+    На PostgreSQL - через COPY, иначе - через executemany INSERT.
+    Возвращает количество строк.
+    """
+    table = model.__table__
+    conn = db.session.connection()
+    is_pg = conn.dialect.name == "postgresql"
+    total = 0
+
+    if is_pg:
+        prep = conn.dialect.identifier_preparer
+        sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+            prep.format_table(table),
+            ", ".join(prep.quote(c) for c in columns),
+        )
+        cursor = conn.connection.dbapi_connection.cursor()
+
+    def flush(batch):
+        if is_pg:
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            for row in batch:
+                writer.writerow([_copy_value(v) for v in row])
+            buf.seek(0)
+            cursor.copy_expert(sql, buf)
+        else:
+            conn.execute(insert(table), [dict(zip(columns, row)) for row in batch])
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            flush(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        flush(batch)
+        total += len(batch)
+    return total
+
+
+def generate_dataset(students=20000, start=date(2024, 9, 2), days=730, seed=42,
+                     batch_size=10000, feedback_rate=0.01, log=print):
+    """
+    Генерирует большой детерминированный (от seed) набор данных:
+    справочники и меню на days дней (через seed_test_data), students учеников
+    с аллергиями/нелюбимыми типами, покупки PaidMenu по будним дням и отзывы.
+    Большие таблицы грузятся пачками (COPY на PostgreSQL).
+    Возвращает {таблица: {"rows": ..., "seconds": ..., "rows_per_sec": ...}}.
+    """
+    rng = random.Random(seed)
+    stats = {}
+
+    def timed(name, fn):
+        t0 = time.perf_counter()
+        n = fn()
+        dt = time.perf_counter() - t0
+        stats[name] = {"rows": n, "seconds": round(dt, 3), "rows_per_sec": round(n / dt) if dt else n}
+        log(f"{name}: {n} строк за {dt:.2f} с ({stats[name]['rows_per_sec']} строк/с)")
+
+    def base():
+        # справочники, блюда и меню на весь период
+        seed_test_data(start, days=max(days, 3))
+        return db.session.query(Menu).count()
+
+    timed("base", base)
+
+    allergies = {a.name: a.id for a in Allergy.query.all()}
+    food_types = {t.name: t.id for t in FoodType.query.all()}
+
+    # один хэш на всех сгенерированных учеников: PBKDF2 на 20k паролей - это часы
+    password_hash = generate_password_hash("student")
+    logins = [f"student{i:06d}@load.test" for i in range(students)]
+
+    timed("user", lambda: _bulk_load(
+        User, ["login", "password_hash", "role", "money"],
+        ((login, password_hash, UserRole.STUDENT, rng.randint(0, 5000)) for login in logins),
+        batch_size,
+    ))
+    user_ids = dict(db.session.execute(
+        select(User.login, User.id).where(User.login.like("%@load.test"))
+    ).all())
+    uids = [user_ids[login] for login in logins]
+
+    allergy_names = [n for n in ALLERGY_RATES if n in allergies]
+    type_names = [n for n in DISLIKED_TYPE_WEIGHTS if n in food_types]
+    type_weights = [DISLIKED_TYPE_WEIGHTS[n] for n in type_names]
+
+    def allergy_rows():
+        for uid in uids:
+            for name in allergy_names:
+                if rng.random() < ALLERGY_RATES[name]:
+                    yield uid, allergies[name]
+
+    def disliked_rows():
+        for uid in uids:
+            k = rng.choices(range(len(DISLIKED_COUNT_WEIGHTS)), DISLIKED_COUNT_WEIGHTS)[0]
+            chosen = set()
+            while len(chosen) < min(k, len(type_names)):
+                chosen.add(rng.choices(type_names, type_weights)[0])
+            for name in sorted(chosen):
+                yield uid, food_types[name]
+
+    timed("user_allergy", lambda: _bulk_load(UserAllergy, ["user_id", "allergy_id"], allergy_rows(), batch_size))
+    timed("user_disliked", lambda: _bulk_load(UserDisliked, ["user_id", "type_id"], disliked_rows(), batch_size))
+
+    # покупки: у каждого ученика своя "привычка" брать завтрак и обед
+    end = start + timedelta(days=days)
+    menus = (
+        Menu.query
+        .filter(Menu.date >= start, Menu.date < end)
+        .order_by(Menu.date.asc(), Menu.id.asc())
+        .all()
+    )
+    menu_by_key = {(m.date, m.type): m.id for m in menus}
+    menu_prices = {m.id: m.price or 0 for m in menus}
+    school_days = [start + timedelta(days=i) for i in range(days) if (start + timedelta(days=i)).weekday() < 5]
+
+    menu_dishes = {}
+    for menu_id, dish_id in db.session.query(MenuDishes.menu_id, MenuDishes.dish_id):
+        menu_dishes.setdefault(menu_id, []).append(dish_id)
+    for ids in menu_dishes.values():
+        ids.sort()
+
+    habits = [(rng.betavariate(2, 3), rng.betavariate(5, 2)) for _ in uids]
+    feedback = []
+
+    def paid_rows():
+        for day in school_days:
+            b_id = menu_by_key.get((day, MealType.BREAKFAST))
+            l_id = menu_by_key.get((day, MealType.LUNCH))
+            for uid, (p_breakfast, p_lunch) in zip(uids, habits):
+                for menu_id, p in ((b_id, p_breakfast), (l_id, p_lunch)):
+                    if menu_id is None or rng.random() >= p:
+                        continue
+                    is_taken = rng.random() < 0.95
+                    if is_taken and rng.random() < feedback_rate and menu_dishes.get(menu_id):
+                        feedback.append((
+                            rng.choice(FEEDBACK_TEXTS), uid, menu_id, rng.choice(menu_dishes[menu_id]),
+                        ))
+                    yield uid, menu_id, is_taken, menu_prices[menu_id]
+
+    timed("paid_menu", lambda: _bulk_load(
+        PaidMenu, ["user_id", "menu_id", "is_taken", "price"], paid_rows(), batch_size,
+    ))
+    timed("feedback", lambda: _bulk_load(
+        Feedback, ["text", "user_id", "menu_id", "dish_id"], iter(feedback), batch_size,
+    ))
+
+    db.session.commit()
+    return stats
     
\ No newline at end of file
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import time
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+# "threads" - gthread/sync (по умолчанию), "gevent" - асинхронные воркеры:
+# один процесс держит тысячи соединений, ожидание PostgreSQL не занимает поток
+GUNICORN_MODE = os.getenv("GUNICORN_MODE", "threads")
+
+if GUNICORN_MODE == "gevent":
+    worker_class = "gevent"
+    worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+    # gevent подменяет threading/socket при старте воркера; приложение,
+    # импортированное раньше в мастере, осталось бы с обычными блокировками
+    preload_app = False
+    # scrypt в гринлете остановил бы весь воркер - хэшируем в настоящих потоках
+    os.environ.setdefault("PASSWORD_HASH_EXECUTOR", "gevent")
+else:
+    # >1 включает gthread: пока поток ждёт пул хэширования паролей (passwords.py),
+    # остальные потоки воркера продолжают отвечать
+    threads = int(os.getenv("GUNICORN_THREADS", "4"))
+    # Приложение импортируется один раз в мастере, воркеры получают его через fork
+    preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+# Каталог, через который воркеры делятся метриками (metrics.py). Задаётся до
+# импорта приложения, чтобы /metrics в любом воркере видел счётчики всех.
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), f"canteen-metrics-{os.getpid()}"))
+
+
+def on_starting(server):
+    os.makedirs(os.environ["METRICS_DIR"], exist_ok=True)
+    # без общего хранилища отзыв токенов и изменения рецептур видит только воркер, принявший запрос
+    for name, what in (("AUTH_BACKEND", "отзыв токенов"), ("ALLERGEN_INDEX_BACKEND", "изменения аллергенов блюд")):
+        backend = os.getenv(name, os.getenv("MENU_CACHE_BACKEND", ""))
+        if workers > 1 and not backend.startswith(("redis://", "rediss://", "unix://")):
+            server.log.warning("%s не задан: %s не виден другим воркерам", name, what)
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+    if not preload_app:
+        return
+
+    # Соединения пула, открытые в мастере, нельзя делить между процессами
+    from app import app
+    from models import db
+
+    with app.app_context():
+        # основная БД и реплика (db_routing.py)
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    if GUNICORN_MODE == "gevent":
+        # psycopg2 ждёт ответа PostgreSQL через цикл gevent, а не блокирует воркер
+        from psycogreen.gevent import patch_psycopg
+
+        patch_psycopg()
+    worker.log.info(
+        "worker %s ready in %.1f ms after fork",
+        worker.pid, (time.perf_counter() - worker.forked_at) * 1000,
+    )
+
+
+def worker_exit(server, worker):
+    # Файл остаётся после выхода воркера: суммарные счётчики не уменьшаются
+    from metrics import metrics
+
+    metrics.flush()
@@ -0,0 +1,234 @@
+"""
+Учёт остатков продуктов через журнал движений (StockMovement).
+Выдача и поставки только добавляют строки в журнал, не трогая Product.amount.
+Периодическое сжатие пишет StockSnapshot и обновляет Product.amount, поэтому
+текущий остаток = последний снимок + короткий хвост движений после него.
+"""
+from datetime import date as _date
+from datetime import datetime, time as _time
+
+from flask import Blueprint, jsonify, request
+from sqlalchemy import and_, false, func, insert, literal, or_, select, text, update
+
+from auth import login_required
+from models import (
+    db, Compound, MenuDishes, MovementReason, PaidMenu, Product, ProductRequest,
+    StockMovement, StockSnapshot, UserRole,
+)
+
+
+inventory_bp = Blueprint("inventory", __name__, url_prefix="/inventory")
+
+
+def record_consumption(paid_menu_ids) -> int:
+    """
+    Списывает продукты на выданные порции одним INSERT ... SELECT:
+    по одной строке журнала на продукт для всей пачки выдач.
+    Коммит делает вызывающий код.
+    """
+    if not paid_menu_ids:
+        return 0
+    consumed = (
+        select(
+            Compound.product_id,
+            -func.sum(Compound.amount),
+            literal(MovementReason.CONSUMPTION, StockMovement.reason.type),
+            literal(datetime.utcnow()),
+        )
+        .select_from(PaidMenu)
+        .join(MenuDishes, MenuDishes.menu_id == PaidMenu.menu_id)
+        .join(Compound, Compound.dish_id == MenuDishes.dish_id)
+        .where(PaidMenu.id.in_(list(paid_menu_ids)))
+        .group_by(Compound.product_id)
+    )
+    result = db.session.execute(
+        insert(StockMovement).from_select(["product_id", "delta", "reason", "created"], consumed)
+    )
+    return result.rowcount
+
+
+def receive(request_ids) -> list:
+    """
+    Отмечает согласованные заявки поставленными и приходует их в журнал.
+    Повторная отметка уже поставленной заявки ничего не делает.
+    """
+    fulfilled = db.session.execute(
+        update(ProductRequest)
+        .where(
+            ProductRequest.id.in_(list(request_ids)),
+            ProductRequest.is_agreed.is_(True),
+            ProductRequest.fulfilled.is_(None),
+        )
+        .values(fulfilled=_date.today())
+        .returning(ProductRequest.id, ProductRequest.product_id, ProductRequest.amount)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    if fulfilled:
+        now = datetime.utcnow()
+        db.session.execute(insert(StockMovement), [
+            {
+                "product_id": product_id,
+                "delta": amount or 0.0,
+                "reason": MovementReason.RECEIPT,
+                "product_request_id": request_id,
+                "created": now,
+            }
+            for request_id, product_id, amount in fulfilled
+        ])
+    db.session.commit()
+    return [r[0] for r in fulfilled]
+
+
+def _latest_snapshots(as_of: datetime | None = None):
+    """Подзапрос: последний снимок каждого продукта (на момент as_of)."""
+    q = select(
+        StockSnapshot.product_id,
+        func.max(StockSnapshot.movement_id).label("movement_id"),
+    )
+    if as_of is not None:
+        q = q.where(or_(StockSnapshot.covered_until.is_(None), StockSnapshot.covered_until <= as_of))
+    last = q.group_by(StockSnapshot.product_id).subquery()
+
+    return (
+        select(StockSnapshot.product_id, StockSnapshot.movement_id, StockSnapshot.amount)
+        .join(last, and_(
+            last.c.product_id == StockSnapshot.product_id,
+            last.c.movement_id == StockSnapshot.movement_id,
+        ))
+        .subquery()
+    )
+
+
+def stock(as_of: datetime | None = None, product_ids=None) -> dict:
+    """
+    Остатки {product_id: amount}: текущие или на момент as_of.
+    Читается снимок и только движения после него.
+    """
+    snap = _latest_snapshots(as_of)
+    tail_filter = [
+        StockMovement.product_id == Product.id,
+        StockMovement.id > func.coalesce(snap.c.movement_id, 0),
+    ]
+    if as_of is not None:
+        tail_filter.append(StockMovement.created <= as_of)
+    tail = (
+        select(func.coalesce(func.sum(StockMovement.delta), 0.0))
+        .where(*tail_filter)
+        .scalar_subquery()
+    )
+    # пока снимков нет, Product.amount - это начальный остаток
+    q = (
+        select(Product.id, func.coalesce(snap.c.amount, Product.amount, 0.0) + tail)
+        .outerjoin(snap, snap.c.product_id == Product.id)
+    )
+    if product_ids is not None:
+        q = q.where(Product.id.in_(list(product_ids)))
+    return {product_id: round(amount, 6) for product_id, amount in db.session.execute(q)}
+
+
+def _lock_movements():
+    """
+    Запрещает запись в журнал до конца транзакции и дожидается уже начатых.
+    Без этого движение из незакоммиченной транзакции могло получить id меньше
+    водяного знака снимка и навсегда выпасть из остатка (чтение идёт только
+    по id > movement_id снимка).
+    """
+    if db.session.get_bind().dialect.name == "postgresql":
+        # EXCLUSIVE конфликтует с ROW EXCLUSIVE у INSERT, но не мешает чтению остатков
+        db.session.execute(text("LOCK TABLE stock_movement IN EXCLUSIVE MODE"))
+    else:
+        # SQLite пишет одной транзакцией за раз: пустой UPDATE берёт блокировку записи
+        db.session.execute(
+            update(StockMovement).where(false()).values(delta=StockMovement.delta)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def compact() -> int:
+    """
+    Сжатие журнала: новый снимок для каждого продукта с движениями после
+    предыдущего снимка, Product.amount обновляется до текущего остатка.
+    Возвращает количество новых снимков.
+    """
+    # водяной знак читается только под блокировкой: все движения с меньшим id уже закоммичены
+    db.session.commit()
+    _lock_movements()
+    max_id = db.session.query(func.max(StockMovement.id)).scalar() or 0
+    covered_until = db.session.query(func.max(StockMovement.created)).filter(StockMovement.id <= max_id).scalar()
+
+    # начальный снимок (movement_id=0) для продуктов без снимков - чтобы
+    # остаток на любую дату не зависел от Product.amount, который дальше меняется
+    has_snapshot = select(StockSnapshot.product_id).distinct()
+    db.session.execute(
+        insert(StockSnapshot).from_select(
+            ["product_id", "movement_id", "covered_until", "amount"],
+            select(Product.id, literal(0), literal(None), func.coalesce(Product.amount, 0.0))
+            .where(Product.id.not_in(has_snapshot)),
+        )
+    )
+
+    snap = _latest_snapshots()
+    rows = db.session.execute(
+        select(StockMovement.product_id, snap.c.amount + func.sum(StockMovement.delta))
+        .join(snap, snap.c.product_id == StockMovement.product_id)
+        .where(StockMovement.id > snap.c.movement_id, StockMovement.id <= max_id)
+        .group_by(StockMovement.product_id, snap.c.amount)
+    ).all()
+
+    if rows:
+        db.session.execute(insert(StockSnapshot), [
+            {"product_id": product_id, "movement_id": max_id, "covered_until": covered_until, "amount": amount}
+            for product_id, amount in rows
+        ])
+        db.session.execute(
+            update(Product),
+            [{"id": product_id, "amount": amount} for product_id, amount in rows],
+        )
+    db.session.commit()
+    return len(rows)
+
+
+@inventory_bp.get("/stock")
+@login_required(UserRole.COOK, UserRole.ADMIN)
+def stock_view():
+    date_str = (request.args.get("date") or "").strip()
+    as_of = None
+    if date_str:
+        try:
+            as_of = datetime.combine(_date.fromisoformat(date_str), _time.max)
+        except ValueError:
+            return jsonify({"message": "Неверный формат date. Используй YYYY-MM-DD"}), 400
+
+    amounts = stock(as_of)
+    products = Product.query.order_by(Product.name.asc()).all()
+    return jsonify({
+        "date": date_str or None,
+        "products": [
+            {
+                "id": p.id,
+                "name": p.name,
+                "unit": (p.unit.value if p.unit else None),
+                "unit_code": (p.unit.name if p.unit else None),
+                "amount": amounts.get(p.id, 0.0),
+            }
+            for p in products
+        ],
+    })
+
+
+@inventory_bp.post("/receipts")
+@login_required(UserRole.COOK, UserRole.ADMIN)
+def receipts():
+    data = request.get_json(silent=True) or {}
+    ids = data.get("request_ids")
+    if not isinstance(ids, list) or not ids or not all(isinstance(x, int) for x in ids):
+        return jsonify({"message": "Нужен непустой список request_ids"}), 400
+
+    return jsonify({"received": receive(ids)})
+
+
+@inventory_bp.post("/compact")
+@login_required(UserRole.ADMIN)
+def compact_view():
+    return jsonify({"snapshots": compact()})
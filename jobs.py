@@ -0,0 +1,403 @@
+"""
+Фоновые задачи: очередь в таблице job и воркер (python worker.py).
+
+Эндпоинт только ставит задачу в очередь и сразу отвечает 202 с адресом
+/jobs/<id>, по которому видны статус, прогресс и результат. Воркер берёт
+задачу одним UPDATE ... WHERE id = (SELECT ... FOR UPDATE SKIP LOCKED): на
+PostgreSQL несколько воркеров не ждут друг друга, на SQLite FOR UPDATE не
+поддерживается, но запись в файл и так выполняется по одной, и тот же
+UPDATE остаётся атомарным.
+
+Взятая задача закреплена за воркером до locked_until. Пока она выполняется,
+отдельный поток воркера продлевает срок каждые JOB_HEARTBEAT_SECONDS (как и
+progress()), поэтому долгие задачи без прогресса (compact-stock,
+generate-menus) не достаются второму воркеру. Если воркер упал, после
+истечения срока задачу возьмёт другой. Ошибка
+(кроме JobError - неверные параметры) приводит к повтору через
+JOB_RETRY_SECONDS * 2^(попытка-1) секунд, после max_attempts - статус FAILED.
+
+Загруженный файл (список учеников с паролями) хранится в JobUpload, а не в
+params, и удаляется вместе с params таких задач (private), когда задача
+завершилась - успешно или нет.
+
+Между задачами воркер переносит приращения отчётов в MenuStats (reports.fold).
+"""
+import json
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from datetime import date as _date
+from datetime import datetime, timedelta
+
+from flask import Blueprint, g, jsonify, request
+from sqlalchemy import and_, case, delete, or_, select, update
+
+from auth import login_required
+from models import db, Job, JobStatus, JobUpload, UserRole
+
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", str(JOB_LEASE_SECONDS / 5)))
+JOB_RETRY_SECONDS = int(os.getenv("JOB_RETRY_SECONDS", "10"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+# сколько ошибок по строкам импорта сохранять в результате задачи
+JOB_MAX_ERRORS = 1000
+
+
+jobs_bp = Blueprint("jobs", __name__, url_prefix="/jobs")
+
+
+class JobError(Exception):
+    """Ошибка, которую повтор не исправит (неверные параметры)."""
+
+
+# --- типы задач ---
+
+TASKS = {}  # kind -> (функция(ctx, params), роли, которым можно ставить)
+# задачи, чьи params стираются после завершения
+PRIVATE_KINDS = set()
+
+_TERMINAL = (JobStatus.DONE, JobStatus.FAILED)
+
+
+def task(kind: str, *roles: UserRole, private=False):
+    def decorator(fn):
+        TASKS[kind] = (fn, roles or (UserRole.ADMIN,))
+        if private:
+            PRIVATE_KINDS.add(kind)
+        return fn
+    return decorator
+
+
+def _param_date(params: dict, name: str) -> _date:
+    try:
+        return _date.fromisoformat(str(params.get(name) or "").strip())
+    except ValueError:
+        raise JobError(f"Нужен параметр {name} в формате YYYY-MM-DD")
+
+
+@task("plan-demand", UserRole.COOK, UserRole.ADMIN)
+def _plan_demand(ctx, params):
+    import planner
+
+    d_from, d_to = _param_date(params, "from"), _param_date(params, "to")
+    if d_to < d_from or (d_to - d_from).days + 1 > planner.MAX_PLAN_DAYS:
+        raise JobError(f"Период от 1 до {planner.MAX_PLAN_DAYS} дней, to не раньше from")
+
+    demand = planner.compute_demand(d_from, d_to)
+    result = {"from": d_from.isoformat(), "to": d_to.isoformat(), "products": planner.public_demand(demand)}
+    if params.get("draft"):
+        db.session.rollback()
+        ctx.progress(0.5, "Потребность посчитана, создаются заявки")
+        drafts = planner.draft_requests(demand)
+        result["created"] = [{"id": r.id, "product_id": r.product_id, "amount": r.amount} for r in drafts]
+    return result
+
+
+@task("rebuild-reports")
+def _rebuild_reports(ctx, params):
+    import feedback
+    import reports
+
+    menus = reports.rebuild()
+    ctx.progress(0.5, "Отчёты пересобраны, пересчитываются отзывы")
+    return {"menus": menus, "feedback": feedback.rebuild()}
+
+
+@task("compact-stock")
+def _compact_stock(ctx, params):
+    import inventory
+
+    return {"snapshots": inventory.compact()}
+
+
+@task("generate-menus", UserRole.COOK, UserRole.ADMIN)
+def _generate_menus(ctx, params):
+    import menu_generator
+
+    d_from = _param_date(params, "from")
+    try:
+        days = int(params.get("days") or 30)
+        seed = int(params.get("seed") or 0)
+    except (TypeError, ValueError):
+        raise JobError("days и seed должны быть целыми числами")
+    if not 1 <= days <= 366:
+        raise JobError("days от 1 до 366")
+    return menu_generator.generate(d_from, days, weekdays_only=bool(params.get("weekdays_only")),
+                                   dry_run=bool(params.get("dry_run")), seed=seed)
+
+
+@task("import-roster", private=True)
+def _import_roster(ctx, params):
+    import io
+
+    import roster
+
+    fmt, text = params.get("format"), ctx.upload()
+    if fmt not in roster.FORMATS or not text or not text.strip():
+        raise JobError("Нужны параметр format (csv или ndjson) и загруженный файл")
+
+    # строк данных примерно столько же, сколько строк файла (в CSV - минус заголовок)
+    total = max(1, text.count("\n") + 1 - (fmt == "csv"))
+    errors, summary = [], None
+
+    def on_batch(stats):
+        ctx.progress(min(stats["rows"] / total, 0.99), f"Обработано строк: {stats['rows']}")
+
+    for item in roster.import_roster(roster.parse(io.StringIO(text, newline=""), fmt), on_batch=on_batch):
+        if "summary" in item:
+            summary = item["summary"]
+        elif len(errors) < JOB_MAX_ERRORS:
+            errors.append(item)
+    return {"summary": summary, "errors": errors}
+
+
+# --- очередь ---
+
+def enqueue(kind: str, params: dict, user_id=None, max_attempts=JOB_MAX_ATTEMPTS, upload: str | None = None) -> Job:
+    """Ставит задачу в очередь (и коммитит). upload - файл задачи, см. JobContext.upload()."""
+    if kind not in TASKS:
+        raise JobError(f"Неизвестный тип задачи: {kind}")
+    job = Job(kind=kind, params=json.dumps(params, ensure_ascii=False), created_by=user_id,
+              max_attempts=max_attempts, status=JobStatus.QUEUED, run_at=datetime.utcnow())
+    db.session.add(job)
+    if upload is not None:
+        db.session.flush()
+        db.session.add(JobUpload(job_id=job.id, data=upload))
+    db.session.commit()
+    return job
+
+
+def claim(worker_id: str):
+    """Берёт одну готовую задачу. Возвращает (id, kind, params, attempts, max_attempts) или None."""
+    now = datetime.utcnow()
+    candidate = (
+        select(Job.id)
+        .where(or_(
+            and_(Job.status == JobStatus.QUEUED, Job.run_at <= now),
+            # воркер не продлил срок - считаем, что он упал
+            and_(Job.status == JobStatus.RUNNING, Job.locked_until < now, Job.attempts < Job.max_attempts),
+        ))
+        .order_by(Job.run_at.asc(), Job.id.asc())
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    row = db.session.execute(
+        update(Job)
+        .where(Job.id == candidate)
+        .values(
+            status=JobStatus.RUNNING, locked_by=worker_id, locked_until=now + timedelta(seconds=JOB_LEASE_SECONDS),
+            attempts=Job.attempts + 1, started=now, finished=None,
+        )
+        .returning(Job.id, Job.kind, Job.params, Job.attempts, Job.max_attempts)
+        .execution_options(synchronize_session=False)
+    ).first()
+    db.session.commit()
+    return row
+
+
+def _forget(values: dict) -> dict:
+    """Значения UPDATE для завершённой задачи: params задач из PRIVATE_KINDS стираются."""
+    return {**values, "params": case((Job.kind.in_(PRIVATE_KINDS), None), else_=Job.params)}
+
+
+def _expire_abandoned():
+    """Задачи упавших воркеров без оставшихся попыток - FAILED."""
+    now = datetime.utcnow()
+    expired = db.session.execute(
+        update(Job)
+        .where(Job.status == JobStatus.RUNNING, Job.locked_until < now, Job.attempts >= Job.max_attempts)
+        .values(**_forget(dict(status=JobStatus.FAILED, finished=now, locked_by=None, locked_until=None,
+                               error="Воркер не завершил задачу за отведённое время")))
+        .returning(Job.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    if expired:
+        db.session.execute(delete(JobUpload).where(JobUpload.job_id.in_(expired)))
+    db.session.commit()
+
+
+def _finish(job_id: int, worker_id: str, **values) -> bool:
+    terminal = values.get("status") in _TERMINAL
+    # задачу могли отдать другому воркеру, если срок истёк: тогда не перезаписываем
+    result = db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.locked_by == worker_id, Job.status == JobStatus.RUNNING)
+        .values(**(_forget(values) if terminal else values), locked_by=None, locked_until=None)
+        .execution_options(synchronize_session=False)
+    )
+    if terminal and result.rowcount == 1:
+        db.session.execute(delete(JobUpload).where(JobUpload.job_id == job_id))
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _extend_lease(conn, job_id: int, worker_id: str, **values):
+    conn.execute(
+        update(Job.__table__)
+        .where(Job.id == job_id, Job.locked_by == worker_id)
+        .values(locked_until=datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS), **values)
+    )
+
+
+class _Heartbeat:
+    """Поток, продлевающий срок задачи, пока она выполняется (with _Heartbeat(...): ...)."""
+
+    def __init__(self, engine, job_id: int, worker_id: str):
+        self._engine = engine
+        self._job_id = job_id
+        self._worker_id = worker_id
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"job-{job_id}-heartbeat", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(JOB_HEARTBEAT_SECONDS):
+            try:
+                with self._engine.begin() as conn:
+                    _extend_lease(conn, self._job_id, self._worker_id)
+            except Exception:
+                # БД занята (SQLite пишет по одному) - повторим на следующем такте
+                pass
+
+
+class JobContext:
+    def __init__(self, job_id: int, worker_id: str):
+        self.job_id = job_id
+        self.worker_id = worker_id
+
+    def upload(self) -> str | None:
+        """Файл, переданный в enqueue(upload=...)."""
+        return db.session.execute(select(JobUpload.data).where(JobUpload.job_id == self.job_id)).scalar()
+
+    def progress(self, fraction: float, message: str | None = None):
+        """
+        Прогресс 0..1 и продление срока задачи. Пишется отдельным соединением,
+        поэтому вызывать между транзакциями задачи (на SQLite запись одна на файл).
+        """
+        with db.engine.begin() as conn:
+            _extend_lease(conn, self.job_id, self.worker_id,
+                          progress=max(0.0, min(float(fraction), 1.0)), message=(message or "")[:500] or None)
+
+
+def execute(row, worker_id: str, log=print) -> JobStatus:
+    job_id, kind, params, attempts, max_attempts = row
+    started = time.perf_counter()
+    try:
+        if kind not in TASKS:
+            raise JobError(f"Неизвестный тип задачи: {kind}")
+        with _Heartbeat(db.engine, job_id, worker_id):
+            result = TASKS[kind][0](JobContext(job_id, worker_id), json.loads(params or "{}"))
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        error = f"{e.__class__.__name__}: {e}"
+        if isinstance(e, JobError) or attempts >= max_attempts:
+            status = JobStatus.FAILED
+            _finish(job_id, worker_id, status=status, error=error, finished=datetime.utcnow())
+        else:
+            status = JobStatus.QUEUED
+            delay = JOB_RETRY_SECONDS * 2 ** (attempts - 1)
+            _finish(job_id, worker_id, status=status, error=error,
+                    run_at=datetime.utcnow() + timedelta(seconds=delay))
+        log(f"задача {job_id} ({kind}), попытка {attempts}/{max_attempts}: {error}")
+        if not isinstance(e, JobError):
+            log(traceback.format_exc())
+        return status
+
+    _finish(job_id, worker_id, status=JobStatus.DONE, progress=1.0, error=None, finished=datetime.utcnow(),
+            result=json.dumps(result, ensure_ascii=False, default=str))
+    log(f"задача {job_id} ({kind}) выполнена за {time.perf_counter() - started:.2f} с")
+    return JobStatus.DONE
+
+
+def run_worker(worker_id=None, once=False, poll=JOB_POLL_SECONDS, log=print) -> int:
+    """
+    Выполняет задачи, пока не придёт SIGTERM/SIGINT (текущая задача доделывается).
+    once - выйти, когда очередь опустеет. Возвращает число выполненных задач.
+    """
+    import reports
+
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    stop = threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda *_: stop.set())
+
+    log(f"воркер {worker_id} запущен, задачи: {', '.join(sorted(TASKS))}")
+    done = 0
+    folded_at = None
+    while not stop.is_set():
+        _expire_abandoned()
+        if folded_at is None or time.monotonic() - folded_at >= reports.REPORTS_FOLD_SECONDS:
+            reports.fold()
+            folded_at = time.monotonic()
+        row = claim(worker_id)
+        if row is None:
+            if once:
+                break
+            stop.wait(poll)
+            continue
+        execute(row, worker_id, log)
+        done += 1
+    log(f"воркер {worker_id} остановлен, выполнено задач: {done}")
+    return done
+
+
+# --- эндпоинты ---
+
+def job_json(job: Job) -> dict:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status.name,
+        "progress": round(job.progress or 0, 3),
+        "message": job.message,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "created": job.created.isoformat() if job.created else None,
+        "started": job.started.isoformat() if job.started else None,
+        "finished": job.finished.isoformat() if job.finished else None,
+    }
+
+
+def accepted(job: Job):
+    """Ответ 202 на поставленную задачу."""
+    return jsonify(job_json(job)), 202, {"Location": f"/jobs/{job.id}"}
+
+
+@jobs_bp.post("")
+@login_required(UserRole.COOK, UserRole.ADMIN)
+def create_job():
+    data = request.get_json(silent=True) or {}
+    kind = str(data.get("kind") or "")
+    params = data.get("params") or {}
+    if kind not in TASKS:
+        return jsonify({"message": f"kind: {', '.join(sorted(TASKS))}"}), 400
+    if not isinstance(params, dict):
+        return jsonify({"message": "params должен быть объектом"}), 400
+    if g.principal.role not in TASKS[kind][1]:
+        return jsonify({"message": "Недостаточно прав"}), 403
+    return accepted(enqueue(kind, params, g.principal.id))
+
+
+@jobs_bp.get("/<int:job_id>")
+@login_required(UserRole.COOK, UserRole.ADMIN)
+def job_status(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None or (g.principal.role != UserRole.ADMIN and job.created_by != g.principal.id):
+        return jsonify({"message": "Задача не найдена"}), 404
+    return jsonify(job_json(job))
@@ -0,0 +1,270 @@
+"""
+Списки для админки: /admin/users, /admin/purchases, /admin/product-requests.
+
+Страницы выдаются по ключу: следующая продолжается с последнего значения
+ключа сортировки (WHERE (created, id) < (...)), а не через OFFSET, поэтому
+далёкая страница стоит столько же, сколько первая. Ключ отдаётся клиенту
+непрозрачной строкой next_cursor, её нужно вернуть как cursor.
+
+fields=id,login,... - только нужные поля; join-ы выполняются только ради
+запрошенных полей (дата меню и логин в покупках, название продукта в заявках).
+Замер далёких страниц: flask --app app bench-pages.
+"""
+import base64
+import binascii
+import json
+from datetime import date as _date
+
+from flask import Blueprint, jsonify, request
+from sqlalchemy import select, tuple_
+
+from auth import login_required
+from exports import json_value
+from models import db, Menu, PaidMenu, Product, ProductRequest, User, UserRole
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+listings_bp = Blueprint("listings", __name__, url_prefix="/admin")
+
+
+class ListingError(Exception):
+    pass
+
+
+class Listing:
+    def __init__(self, name, model, fields, default_fields, key, descending=False, joins=None):
+        self.name = name
+        self.model = model
+        self.fields = fields  # имя -> (колонка, нужный join или None)
+        self.default_fields = default_fields
+        self.key = key  # [(колонка, разбор значения из cursor)]
+        self.descending = descending
+        self.joins = joins or {}  # join -> (таблица, условие)
+
+    def select(self, wanted: list, where: list):
+        columns = [self.fields[name][0].label(name) for name in wanted]
+        columns += [column.label(f"_key{i}") for i, (column, _) in enumerate(self.key)]
+        query = select(*columns).select_from(self.model)
+        for join in dict.fromkeys(self.fields[name][1] for name in wanted if self.fields[name][1]):
+            target, onclause = self.joins[join]
+            query = query.outerjoin(target, onclause)
+        return query.where(*where)
+
+    def order_by(self) -> list:
+        return [column.desc() if self.descending else column.asc() for column, _ in self.key]
+
+    def encode(self, key_values) -> str:
+        raw = json.dumps([self.name, [json_value(v) for v in key_values]], separators=(",", ":"))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    def decode(self, cursor: str) -> list:
+        try:
+            name, values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            if name != self.name or len(values) != len(self.key):
+                raise ValueError(cursor)
+            return [parse(v) for (_, parse), v in zip(self.key, values)]
+        except (ValueError, TypeError, binascii.Error):
+            raise ListingError("Неверный cursor")
+
+    def after(self, cursor: str):
+        """Условие "строго после cursor" в порядке сортировки."""
+        values = self.decode(cursor)
+        columns = [column for column, _ in self.key]
+        if len(columns) == 1:
+            left, right = columns[0], values[0]
+        else:
+            # сравнение строк (created, id) < (...) - PostgreSQL идёт по составному индексу
+            left, right = tuple_(*columns), tuple_(*values)
+        return left < right if self.descending else left > right
+
+    def page(self, wanted: list, where: list, cursor=None, limit=PAGE_SIZE) -> tuple:
+        """Возвращает (строки, cursor следующей страницы или None)."""
+        if cursor:
+            where = [*where, self.after(cursor)]
+        rows = db.session.execute(self.select(wanted, where).order_by(*self.order_by()).limit(limit + 1)).all()
+        items = [{name: json_value(v) for name, v in zip(wanted, row)} for row in rows[:limit]]
+        next_cursor = self.encode(rows[limit - 1][len(wanted):]) if len(rows) > limit else None
+        return items, next_cursor
+
+
+USERS = Listing(
+    "users", User,
+    fields={
+        "id": (User.id, None),
+        "login": (User.login, None),
+        "role": (User.role, None),
+        "money": (User.money, None),
+    },
+    default_fields=["id", "login", "role", "money"],
+    key=[(User.id, int)],
+)
+
+PURCHASES = Listing(
+    "purchases", PaidMenu,
+    fields={
+        "id": (PaidMenu.id, None),
+        "user_id": (PaidMenu.user_id, None),
+        "login": (User.login, "user"),
+        "menu_id": (PaidMenu.menu_id, None),
+        "date": (Menu.date, "menu"),
+        "type": (Menu.type, "menu"),
+        "price": (Menu.price, "menu"),
+        "is_taken": (PaidMenu.is_taken, None),
+    },
+    default_fields=["id", "user_id", "menu_id", "date", "type", "is_taken"],
+    key=[(PaidMenu.id, int)],
+    descending=True,
+    joins={
+        "user": (User, User.id == PaidMenu.user_id),
+        "menu": (Menu, Menu.id == PaidMenu.menu_id),
+    },
+)
+
+PRODUCT_REQUESTS = Listing(
+    "product-requests", ProductRequest,
+    fields={
+        "id": (ProductRequest.id, None),
+        "product_id": (ProductRequest.product_id, None),
+        "product": (Product.name, "product"),
+        "unit": (Product.unit, "product"),
+        "amount": (ProductRequest.amount, None),
+        "is_agreed": (ProductRequest.is_agreed, None),
+        "created": (ProductRequest.created, None),
+        "fulfilled": (ProductRequest.fulfilled, None),
+    },
+    default_fields=["id", "product_id", "product", "amount", "is_agreed", "created", "fulfilled"],
+    key=[(ProductRequest.created, _date.fromisoformat), (ProductRequest.id, int)],
+    descending=True,
+    joins={"product": (Product, Product.id == ProductRequest.product_id)},
+)
+
+LISTINGS = {listing.name: listing for listing in (USERS, PURCHASES, PRODUCT_REQUESTS)}
+
+
+# --- параметры запроса ---
+
+def _int(name: str):
+    value = (request.args.get(name) or "").strip()
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ListingError(f"{name} должно быть целым числом")
+
+
+def _bool(name: str):
+    value = (request.args.get(name) or "").strip().lower()
+    if not value:
+        return None
+    if value not in ("true", "false", "1", "0"):
+        raise ListingError(f"{name}: true или false")
+    return value in ("true", "1")
+
+
+def _day(name: str):
+    value = (request.args.get(name) or "").strip()
+    if not value:
+        return None
+    try:
+        return _date.fromisoformat(value)
+    except ValueError:
+        raise ListingError(f"Неверный формат {name}. Используй YYYY-MM-DD")
+
+
+def _fields(listing: Listing) -> list:
+    raw = request.args.get("fields")
+    if raw is None:
+        return listing.default_fields
+    wanted = list(dict.fromkeys(f.strip() for f in raw.split(",") if f.strip()))
+    unknown = [f for f in wanted if f not in listing.fields]
+    if not wanted or unknown:
+        raise ListingError(f"Доступные поля: {', '.join(listing.fields)}")
+    return wanted
+
+
+def _user_filters() -> list:
+    where = []
+    role = (request.args.get("role") or "").strip()
+    if role:
+        try:
+            where.append(User.role == UserRole[role])
+        except KeyError:
+            raise ListingError(f"role: {', '.join(r.name for r in UserRole)}")
+    return where
+
+
+def _purchase_filters() -> list:
+    where = []
+    for name, column in (("user_id", PaidMenu.user_id), ("menu_id", PaidMenu.menu_id)):
+        value = _int(name)
+        if value is not None:
+            where.append(column == value)
+    taken = _bool("taken")
+    if taken is not None:
+        where.append(PaidMenu.is_taken.is_(taken))
+
+    d_from, d_to = _day("from"), _day("to")
+    if d_from or d_to:
+        menus = select(Menu.id)
+        if d_from:
+            menus = menus.where(Menu.date >= d_from)
+        if d_to:
+            menus = menus.where(Menu.date <= d_to)
+        where.append(PaidMenu.menu_id.in_(menus))
+    return where
+
+
+def _product_request_filters() -> list:
+    where = []
+    product_id = _int("product_id")
+    if product_id is not None:
+        where.append(ProductRequest.product_id == product_id)
+    agreed = _bool("agreed")
+    if agreed is not None:
+        where.append(ProductRequest.is_agreed.is_(agreed))
+    fulfilled = _bool("fulfilled")
+    if fulfilled is not None:
+        where.append(ProductRequest.fulfilled.isnot(None) if fulfilled else ProductRequest.fulfilled.is_(None))
+    d_from, d_to = _day("from"), _day("to")
+    if d_from:
+        where.append(ProductRequest.created >= d_from)
+    if d_to:
+        where.append(ProductRequest.created <= d_to)
+    return where
+
+
+def _respond(listing: Listing, filters):
+    try:
+        where = filters()
+        wanted = _fields(listing)
+        limit = _int("limit")
+        limit = PAGE_SIZE if limit is None else limit
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ListingError(f"limit от 1 до {MAX_PAGE_SIZE}")
+        items, next_cursor = listing.page(wanted, where, (request.args.get("cursor") or "").strip(), limit)
+    except ListingError as e:
+        return jsonify({"message": str(e)}), 400
+    return jsonify({"items": items, "next_cursor": next_cursor})
+
+
+# --- эндпоинты ---
+
+@listings_bp.get("/users")
+@login_required(UserRole.ADMIN)
+def list_users():
+    return _respond(USERS, _user_filters)
+
+
+@listings_bp.get("/purchases")
+@login_required(UserRole.ADMIN)
+def list_purchases():
+    return _respond(PURCHASES, _purchase_filters)
+
+
+@listings_bp.get("/product-requests")
+@login_required(UserRole.ADMIN)
+def list_product_requests():
+    return _respond(PRODUCT_REQUESTS, _product_request_filters)
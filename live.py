@@ -0,0 +1,277 @@
+"""
+Живые счётчики оплаченных и выданных порций для экранов поваров (SSE).
+
+GET /live/menus?date=YYYY-MM-DD отдаёт поток text/event-stream: сначала
+событие snapshot с текущими счётчиками, затем delta после каждого коммита
+покупки или выдачи за эту дату.
+
+Изменения собирает reports._increment (track), перед коммитом счётчики
+затронутых меню читаются одним запросом (reports.totals) - сколько бы ни было
+подписчиков, - а после коммита событие публикуется. Публикация идёт через
+брокер в памяти процесса; с LIVE_BACKEND ("local" или "redis://...") -
+через общий канал, чтобы событие дошло до подписчиков всех воркеров.
+
+Каждый поток держит соединение открытым, поэтому в режиме GUNICORN_MODE=threads
+число подписчиков на воркер ограничено LIVE_MAX_SUBSCRIBERS (по умолчанию - половина
+GUNICORN_THREADS), чтобы они не заняли все потоки; в режиме gevent подписчик - это
+гринлет, и по умолчанию их ограничивает только GUNICORN_WORKER_CONNECTIONS.
+Для большого числа экранов нужен GUNICORN_MODE=gevent.
+"""
+import json
+import os
+import queue
+import threading
+from collections import defaultdict
+from datetime import date as _date
+
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from auth import login_required
+from models import db, UserRole
+
+
+def _default_max_subscribers() -> int:
+    # те же переменные и значения по умолчанию, что в gunicorn.conf.py
+    if os.getenv("GUNICORN_MODE", "threads") == "gevent":
+        return int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+    # вторая половина потоков gthread остаётся обычным запросам
+    return max(1, int(os.getenv("GUNICORN_THREADS", "4")) // 2)
+
+
+LIVE_BACKEND = os.getenv("LIVE_BACKEND", "")
+LIVE_MAX_SUBSCRIBERS = int(os.getenv("LIVE_MAX_SUBSCRIBERS") or _default_max_subscribers())
+# раз в сколько секунд слать комментарий, чтобы прокси не закрыли тихое соединение
+LIVE_KEEPALIVE_SECONDS = float(os.getenv("LIVE_KEEPALIVE_SECONDS", "15"))
+# сколько событий может ждать медленный подписчик, дальше он получает resync
+LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "100"))
+
+
+live_bp = Blueprint("live", __name__, url_prefix="/live")
+
+
+# --- общий канал ---
+
+class LocalBus:
+    """Заглушка общего канала в памяти процесса (для локального запуска)."""
+
+    def __init__(self):
+        self._listeners = []
+
+    def listen(self, callback):
+        self._listeners.append(callback)
+
+    def publish(self, message: str):
+        for callback in list(self._listeners):
+            callback(message)
+
+
+class RedisBus:
+    CHANNEL = "live:menu-counts"
+
+    def __init__(self, url):
+        import redis
+
+        self._r = redis.Redis.from_url(url)
+
+    def listen(self, callback):
+        pubsub = self._r.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.CHANNEL)
+
+        def loop():
+            for message in pubsub.listen():
+                callback(message["data"])
+
+        threading.Thread(target=loop, name="live-redis", daemon=True).start()
+
+    def publish(self, message: str):
+        self._r.publish(self.CHANNEL, message)
+
+
+def make_bus(spec: str):
+    if not spec:
+        return None
+    if spec == "local":
+        return LocalBus()
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBus(spec)
+    raise ValueError(f"Неизвестный LIVE_BACKEND: {spec}")
+
+
+# --- брокер ---
+
+class Subscription:
+    def __init__(self, d: _date):
+        self.date = d
+        self.queue = queue.Queue(maxsize=LIVE_QUEUE_SIZE)
+        self.overflowed = False
+
+
+class Broker:
+    def __init__(self, bus=None):
+        self._bus = bus
+        self._subs = defaultdict(set)
+        self._lock = threading.Lock()
+        self._listening_pid = None
+
+    def _ensure_listening(self):
+        # подписка на канал своя у каждого воркера: после fork проверяем pid
+        if self._bus is None or self._listening_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listening_pid != os.getpid():
+                self._listening_pid = os.getpid()
+                self._bus.listen(self._deliver)
+
+    def subscribe(self, d: _date):
+        self._ensure_listening()
+        sub = Subscription(d)
+        with self._lock:
+            if sum(len(s) for s in self._subs.values()) >= LIVE_MAX_SUBSCRIBERS:
+                return None
+            self._subs[d].add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            subs = self._subs.get(sub.date)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.date]
+
+    def publish(self, payload: dict):
+        message = json.dumps(payload, ensure_ascii=False)
+        if self._bus is None:
+            self._deliver(message)
+        else:
+            self._bus.publish(message)
+
+    def _deliver(self, message):
+        payload = json.loads(message)
+        with self._lock:
+            subs = list(self._subs.get(_date.fromisoformat(payload["date"]), ()))
+        for sub in subs:
+            try:
+                sub.queue.put_nowait(payload)
+            except queue.Full:
+                sub.overflowed = True
+
+
+broker = Broker(make_bus(LIVE_BACKEND))
+
+
+# --- изменения в сессии ---
+# Приращения копятся в session.info, перед коммитом читаются итоги,
+# после коммита публикуется; откат всё отбрасывает.
+
+def track(rows):
+    """rows как в reports._increment: приращения sold/taken по menu_id."""
+    pending = db.session.info.setdefault("live_pending", {})
+    for row in rows:
+        d_sold, d_taken = pending.get(row["menu_id"], (0, 0))
+        pending[row["menu_id"]] = (d_sold + row["sold"], d_taken + row["taken"])
+
+
+def _counts(session, **filters) -> list:
+    # reports импортирует live, поэтому импорт здесь
+    from reports import totals
+
+    return [(menu_id, d, t, sold, taken) for menu_id, d, t, sold, taken, _ in totals(session=session, **filters)]
+
+
+def _menu_item(menu_id, t, sold, taken) -> dict:
+    return {
+        "menu_id": menu_id,
+        "type": t.value if t else None,
+        "type_code": t.name if t else None,
+        "sold": sold,
+        "taken": taken,
+        "left": sold - taken,
+    }
+
+
+@event.listens_for(Session, "before_commit")
+def _refresh_counts(session):
+    pending = session.info.get("live_pending")
+    if not pending:
+        return
+    events = {}
+    with session.no_autoflush:
+        rows = _counts(session, menu_ids=pending)
+    for menu_id, d, t, sold, taken in rows:
+        d_sold, d_taken = pending[menu_id]
+        item = _menu_item(menu_id, t, sold, taken)
+        item.update(d_sold=d_sold, d_taken=d_taken)
+        events.setdefault(d.isoformat(), []).append(item)
+    session.info["live_events"] = events
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_counts(session):
+    session.info.pop("live_pending", None)
+    events = session.info.pop("live_events", None)
+    for d, menus in (events or {}).items():
+        broker.publish({"date": d, "menus": menus})
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_counts(session):
+    session.info.pop("live_pending", None)
+    session.info.pop("live_events", None)
+
+
+# --- поток ---
+
+def _sse(event_name: str, payload) -> str:
+    return f"event: {event_name}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+@live_bp.get("/menus")
+@login_required(UserRole.COOK, UserRole.ADMIN)
+def menu_counts():
+    try:
+        d = _date.fromisoformat((request.args.get("date") or _date.today().isoformat()).strip())
+    except ValueError:
+        return jsonify({"message": "Неверный формат date. Используй YYYY-MM-DD"}), 400
+
+    sub = broker.subscribe(d)
+    if sub is None:
+        return jsonify({"message": "Слишком много подписчиков, попробуйте позже"}), 503, {"Retry-After": "5"}
+
+    # подписка раньше снимка: изменение между ними придёт дельтой, а не потеряется
+    try:
+        snapshot = [_menu_item(menu_id, t, sold, taken) for menu_id, _, t, sold, taken in _counts(db.session, d_from=d, d_to=d)]
+    except BaseException:
+        # поток не запустится и не освободит место сам
+        broker.unsubscribe(sub)
+        raise
+    finally:
+        db.session.close()
+
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            yield _sse("snapshot", {"date": d.isoformat(), "menus": snapshot})
+            while True:
+                try:
+                    payload = sub.queue.get(timeout=LIVE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if sub.overflowed:
+                    # клиент не успевал читать: пусть переподключится и получит свежий снимок
+                    yield _sse("resync", {"date": d.isoformat()})
+                    return
+                yield _sse("delta", payload)
+        finally:
+            broker.unsubscribe(sub)
+
+    resp = Response(stream_with_context(stream()), mimetype="text/event-stream")
+    # если клиент ушёл до первого события, генератор не запускался и его finally не выполнится
+    resp.call_on_close(lambda: broker.unsubscribe(sub))
+    resp.headers["Cache-Control"] = "no-cache"
+    # nginx не должен буферизовать поток
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import Menu, MenuDishes, Dish
+
+
+MENU_CACHE_SIZE = int(os.getenv("MENU_CACHE_SIZE", "256"))
+# Сколько секунд локальная копия считается свежей. Нужно, чтобы воркеры,
+# не видевшие чужую запись в БД, не отдавали устаревшее меню бесконечно.
+MENU_CACHE_TTL = float(os.getenv("MENU_CACHE_TTL", "30"))
+# "" - только локальный LRU, "local" - общий бэкенд-заглушка в памяти,
+# "redis://..." - общий кэш в Redis (нужен пакет redis)
+MENU_CACHE_BACKEND = os.getenv("MENU_CACHE_BACKEND", "")
+# Срок жизни записей общего кэша (не меньше MENU_CACHE_TTL)
+MENU_CACHE_SHARED_TTL = float(os.getenv("MENU_CACHE_SHARED_TTL", "600"))
+
+
+class LocalBackend:
+    """Заглушка общего хранилища в памяти процесса (для локального запуска)."""
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return self._data.get(key)
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def get_many(self, *keys):
+        with self._lock:
+            return [self._get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = value
+            if ex is None:
+                self._expires.pop(key, None)
+            else:
+                self._expires[key] = time.monotonic() + ex
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+                self._expires.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self._get(key) or 0) + 1
+            self._data[key] = value
+            return value
+
+
+class RedisBackend:
+    def __init__(self, url):
+        import redis
+
+        self._r = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self._r.get(key)
+
+    def get_many(self, *keys):
+        return self._r.mget(keys)
+
+    def set(self, key, value, ex=None):
+        # ex - секунды; Redis принимает только целые
+        self._r.set(key, value, ex=None if ex is None else max(1, int(ex + 0.999)))
+
+    def delete(self, *keys):
+        if keys:
+            self._r.delete(*keys)
+
+    def incr(self, key):
+        return self._r.incr(key)
+
+
+def make_backend(spec: str):
+    if not spec:
+        return None
+    if spec == "local":
+        return LocalBackend()
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(spec)
+    raise ValueError(f"Неизвестный MENU_CACHE_BACKEND: {spec}")
+
+
+class CacheEntry:
+    __slots__ = ("body", "etag", "expires")
+
+    def __init__(self, body: bytes, etag: str, expires: float = 0.0):
+        self.body = body
+        self.etag = etag
+        self.expires = expires
+
+
+class MenuCache:
+    """
+    Кэш готовых JSON-ответов меню по дате.
+    Первый уровень - LRU в памяти процесса, второй (необязательный) - общий бэкенд.
+
+    У каждой даты есть версия, которую увеличивает invalidate(). Версия
+    снимается до чтения меню из БД (version()) и входит в ключ записи: если
+    дату сбросили, пока читали БД, старый ответ запишется под ключом, который
+    уже никто не прочитает, и истечёт через shared_ttl.
+    """
+
+    GEN_KEY = "menu:gen"
+
+    def __init__(self, size=MENU_CACHE_SIZE, ttl=MENU_CACHE_TTL, backend=None, shared_ttl=MENU_CACHE_SHARED_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.shared_ttl = max(shared_ttl, ttl)
+        self.backend = backend
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        # та же версия для LRU процесса: (номер clear(), число invalidate() даты)
+        self._epoch = 0
+        self._versions = {}
+
+    @staticmethod
+    def _version_key(d):
+        return f"menu:ver:{d.isoformat()}"
+
+    def version(self, d) -> tuple:
+        """Версия даты (локальная, общая); передаётся в set()."""
+        with self._lock:
+            local = (self._epoch, self._versions.get(d, 0))
+        if self.backend is None:
+            return local, None
+        gen, ver = self.backend.get_many(self.GEN_KEY, self._version_key(d))
+        return local, (int(gen or 0), int(ver or 0))
+
+    @staticmethod
+    def _shared_key(d, shared):
+        gen, ver = shared
+        return f"menu:{gen}:{d.isoformat()}:{ver}"
+
+    def get(self, d):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._lru.get(d)
+            if entry is not None:
+                if entry.expires > now:
+                    self._lru.move_to_end(d)
+                    return entry
+                del self._lru[d]
+
+        if self.backend is None:
+            return None
+
+        local, shared = self.version(d)
+        raw = self.backend.get(self._shared_key(d, shared))
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        entry = CacheEntry(data["body"].encode("utf-8"), data["etag"])
+        self._put_local(d, entry, local)
+        return entry
+
+    def set(self, d, body: bytes, version: tuple) -> CacheEntry:
+        """Кладёт ответ, прочитанный из БД после version(d)."""
+        local, shared = version
+        entry = CacheEntry(body, hashlib.sha256(body).hexdigest())
+        if self.backend is not None:
+            if self.version(d)[1] != shared:
+                # дату сбросил другой воркер: ответ отдаём, но не кэшируем
+                return entry
+            raw = json.dumps({"body": body.decode("utf-8"), "etag": entry.etag})
+            self.backend.set(self._shared_key(d, shared), raw, ex=self.shared_ttl)
+        self._put_local(d, entry, local)
+        return entry
+
+    def _put_local(self, d, entry, local):
+        entry.expires = time.monotonic() + self.ttl
+        with self._lock:
+            if (self._epoch, self._versions.get(d, 0)) != local:
+                # дату сбросили после того, как начали читать
+                return
+            self._lru[d] = entry
+            self._lru.move_to_end(d)
+            while len(self._lru) > self.size:
+                self._lru.popitem(last=False)
+
+    def invalidate(self, dates):
+        dates = set(dates)
+        if not dates:
+            return
+        with self._lock:
+            for d in dates:
+                self._lru.pop(d, None)
+                self._versions[d] = self._versions.get(d, 0) + 1
+        if self.backend is not None:
+            for d in dates:
+                self.backend.incr(self._version_key(d))
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+            self._epoch += 1
+            self._versions.clear()
+        if self.backend is not None:
+            # старые ключи становятся недостижимы, не нужно их перечислять
+            self.backend.incr(self.GEN_KEY)
+
+
+menu_cache = MenuCache(backend=make_backend(MENU_CACHE_BACKEND))
+
+
+# --- инвалидация по изменениям в сессии ---
+# Даты собираются в after_flush, а применяются только после commit,
+# чтобы откат транзакции не сбрасывал кэш зря.
+
+def _pending(session):
+    return session.info.setdefault("menu_cache_pending", {"dates": set(), "all": False})
+
+
+def _history_values(obj, attr):
+    """Старые и новые значения атрибута (дата меню могла поменяться)."""
+    hist = getattr(inspect(obj).attrs, attr).history
+    return {v for v in chain(hist.added or (), hist.deleted or (), hist.unchanged or ()) if v is not None}
+
+
+def invalidate_after_commit(session, dates):
+    """Для изменений меню в обход ORM (bulk INSERT): сбросить даты после коммита."""
+    _pending(session)["dates"].update(d for d in dates if d is not None)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_menu_changes(session, flush_context):
+    pending = _pending(session)
+    menu_ids = set()
+
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Menu):
+            pending["dates"] |= _history_values(obj, "date")
+        elif isinstance(obj, MenuDishes):
+            menu_ids |= _history_values(obj, "menu_id")
+        elif isinstance(obj, Dish):
+            pending["all"] = True
+
+    if menu_ids and not pending["all"]:
+        with session.no_autoflush:
+            rows = session.query(Menu.date).filter(Menu.id.in_(menu_ids)).all()
+        pending["dates"].update(r[0] for r in rows if r[0] is not None)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_menu_changes(session):
+    pending = session.info.pop("menu_cache_pending", None)
+    if not pending:
+        return
+    if pending["all"]:
+        menu_cache.clear()
+    else:
+        menu_cache.invalidate(pending["dates"])
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_menu_changes(session):
+    session.info.pop("menu_cache_pending", None)
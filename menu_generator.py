@@ -0,0 +1,471 @@
+"""
+Составление меню на период (flask --app app generate-menus, задача generate-menus).
+
+Для каждого блюда заранее считается вектор: маски аллергенов и типов еды
+(allergen_index.DishIndex) и расход продуктов на порцию (Compound). Меню
+строятся жадно по слотам (дата, тип), затем улучшаются локальным поиском -
+заменой одного блюда, пока растёт оценка:
+  + доля учеников с аллергиями, которым в меню хватает безопасных блюд (SAFE_DISHES);
+  + число разных типов еды в меню;
+  - повторы блюда в близкие дни (REPEAT_WEIGHT / разница в днях).
+Ограничение: расход продуктов на все новые меню (порции x Compound) не больше
+остатка плюс согласованные заявки минус расход уже составленных меню периода.
+Слот, для которого не нашлось DISHES_PER_MENU блюд, не записывается (его
+продукты достаются следующим слотам) и попадает в unfilled.
+
+Оценка считается на битовых масках групп учеников: для каждого блюда заранее
+известно, каким группам оно безопасно (Problem.safe), а для слота - каким группам
+уже набрано 1..SAFE_DISHES безопасных блюд (_State.levels), поэтому прирост
+оценки от кандидата - несколько операций с масками, а не проход по группам.
+
+Результат пишется одним INSERT меню и одним INSERT блюд меню.
+"""
+import os
+import random
+import time
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from datetime import date as _date
+from datetime import timedelta
+
+from sqlalchemy import func, insert, select
+
+import inventory
+from allergen_index import DishIndex
+from menu_cache import invalidate_after_commit
+from models import db, Compound, Dish, MealType, Menu, MenuDishes, MenuStats, ProductRequest, UserAllergy
+
+# порций на меню, если нет истории продаж
+MENU_GEN_PORTIONS = int(os.getenv("MENU_GEN_PORTIONS", "100"))
+MENU_GEN_ITERATIONS = int(os.getenv("MENU_GEN_ITERATIONS", "20000"))
+# ограничение времени локального поиска (отсчитывается после жадного построения), с
+MENU_GEN_SECONDS = float(os.getenv("MENU_GEN_SECONDS", "0.5"))
+
+DISHES_PER_MENU = 3
+# сколько безопасных блюд должно быть в меню для ученика с аллергией
+SAFE_DISHES = 2
+COVER_WEIGHT = 3.0
+TYPES_WEIGHT = 0.2
+REPEAT_WEIGHT = 1.0
+# одно блюдо на завтрак и обед в один день
+SAME_DAY_PENALTY = 5.0
+# сколько прошлых дней учитывать при штрафе за повторы
+HISTORY_DAYS = 7
+DEFAULT_PRICES = {MealType.BREAKFAST: 120, MealType.LUNCH: 180}
+
+
+class Problem:
+    """Входные данные: слоты, кандидаты и векторы блюд, остатки, группы учеников."""
+
+    def __init__(self, slots, pools, allergens, types, consumption, stock, groups, history,
+                 dishes_per_menu=DISHES_PER_MENU):
+        self.slots = slots  # [(номер дня, дата, тип, порций)]
+        self.pools = pools  # тип -> [dish_id]
+        self.allergens = allergens  # dish_id -> маска аллергенов
+        self.types = types  # dish_id -> маска типов еды
+        self.consumption = consumption  # dish_id -> [(product_id, на порцию)]
+        self.stock = stock  # product_id -> доступно; None - без ограничения
+        self.groups = groups  # [(маска аллергий, учеников)]
+        self.history = history  # [(номер дня < 0, dish_id)]
+        self.k = dishes_per_menu
+        self.allergic = sum(n for _, n in groups)
+        # сколько безопасных блюд нужно группе и бит g в safe[dish_id] - блюдо безопасно группе g
+        self.need = min(SAFE_DISHES, dishes_per_menu)
+        self.safe = {
+            d: sum(1 << g for g, (mask, _) in enumerate(groups) if not a_mask & mask) for d, a_mask in allergens.items()
+        }
+        # учеников в группах по маске: таблица на каждые 8 групп
+        self._weights = []
+        for start in range(0, len(groups), 8):
+            table = [0] * 256
+            for b in range(1, 256):
+                low = (b & -b).bit_length() - 1
+                table[b] = table[b & (b - 1)] + (groups[start + low][1] if start + low < len(groups) else 0)
+            self._weights.append(table)
+
+    def students(self, group_mask: int) -> int:
+        """Сколько учеников в группах маски."""
+        total = 0
+        for table in self._weights:
+            if not group_mask:
+                break
+            total += table[group_mask & 0xFF]
+            group_mask >>= 8
+        return total
+
+    def cover_score(self, covered: int) -> float:
+        return COVER_WEIGHT * (self.students(covered) / self.allergic if self.allergic else 1.0)
+
+
+def _slots(d_from: _date, days: int, meal_types, weekdays_only: bool, portions: dict, existing: set):
+    slots, skipped = [], []
+    for i in range(days):
+        d = d_from + timedelta(days=i)
+        if weekdays_only and d.weekday() >= 5:
+            continue
+        for t in meal_types:
+            if (d, t) in existing:
+                skipped.append((d, t))
+            else:
+                slots.append((i, d, t, portions[t]))
+    return slots, skipped
+
+
+def _portions(meal_types) -> dict:
+    """Средние продажи по типу меню за 4 недели (MenuStats) или MENU_GEN_PORTIONS."""
+    today = _date.today()
+    sold = dict(db.session.execute(
+        select(MenuStats.type, func.avg(MenuStats.sold))
+        .where(MenuStats.date >= today - timedelta(days=28), MenuStats.date < today)
+        .group_by(MenuStats.type)
+    ).all())
+    return {t: int(round(sold[t])) if sold.get(t) else MENU_GEN_PORTIONS for t in meal_types}
+
+
+def _pools(meal_types) -> dict:
+    # блюдо подходит типу меню, если уже было в таком меню; новые блюда - во всех
+    used = defaultdict(set)
+    for t, dish_id in db.session.execute(
+        select(Menu.type, MenuDishes.dish_id).join(MenuDishes, MenuDishes.menu_id == Menu.id).distinct()
+    ):
+        used[dish_id].add(t)
+    all_ids = [d for (d,) in db.session.execute(select(Dish.id).order_by(Dish.id.asc()))]
+    return {t: [d for d in all_ids if not used[d] or t in used[d]] for t in meal_types}
+
+
+def _stock(d_from: _date, d_to: _date, consumption: dict, portions: dict) -> dict:
+    available = dict(inventory.stock())
+    for product_id, amount in db.session.execute(
+        select(ProductRequest.product_id, func.sum(ProductRequest.amount))
+        .where(ProductRequest.is_agreed.is_(True), ProductRequest.fulfilled.is_(None))
+        .group_by(ProductRequest.product_id)
+    ):
+        available[product_id] = available.get(product_id, 0.0) + (amount or 0.0)
+
+    # уже составленные меню периода тоже будут выдаваться
+    for t, dish_id in db.session.execute(
+        select(Menu.type, MenuDishes.dish_id)
+        .join(MenuDishes, MenuDishes.menu_id == Menu.id)
+        .where(Menu.date >= d_from, Menu.date <= d_to)
+    ):
+        for product_id, amount in consumption.get(dish_id, ()):
+            available[product_id] = available.get(product_id, 0.0) - amount * portions.get(t, MENU_GEN_PORTIONS)
+    return available
+
+
+def load(d_from: _date, days: int, meal_types=tuple(MealType), weekdays_only=False, pools=None, portions=None,
+         use_stock=True, dishes_per_menu=DISHES_PER_MENU) -> tuple:
+    """Собирает Problem из БД. Возвращает (Problem, пропущенные слоты с уже существующими меню)."""
+    d_to = d_from + timedelta(days=days - 1)
+    portions = portions or _portions(meal_types)
+    pools = pools or _pools(meal_types)
+
+    existing = set(db.session.execute(
+        select(Menu.date, Menu.type).where(Menu.date >= d_from, Menu.date <= d_to)
+    ).all())
+    slots, skipped = _slots(d_from, days, meal_types, weekdays_only, portions, existing)
+
+    dish_ids = sorted({d for ids in pools.values() for d in ids})
+    index = DishIndex()
+    masks = index.masks_many(dish_ids)
+    allergens = {d: a_mask for d, (a_mask, _) in masks.items()}
+    types = {d: t_mask for d, (_, t_mask) in masks.items()}
+    consumption = defaultdict(list)
+    for dish_id, product_id, amount in db.session.execute(
+        select(Compound.dish_id, Compound.product_id, Compound.amount)
+    ):
+        consumption[dish_id].append((product_id, amount or 0.0))
+
+    user_masks = defaultdict(int)
+    for user_id, allergy_id in db.session.execute(select(UserAllergy.user_id, UserAllergy.allergy_id)):
+        user_masks[user_id] |= 1 << allergy_id
+    groups = sorted(Counter(user_masks.values()).items())
+
+    history = [
+        ((d - d_from).days, dish_id)
+        for d, dish_id in db.session.execute(
+            select(Menu.date, MenuDishes.dish_id)
+            .join(MenuDishes, MenuDishes.menu_id == Menu.id)
+            .where(Menu.date >= d_from - timedelta(days=HISTORY_DAYS), Menu.date < d_from)
+        )
+    ]
+
+    stock = _stock(d_from, d_to, consumption, portions) if use_stock else None
+    problem = Problem(slots, pools, allergens, types, dict(consumption), stock, groups, history, dishes_per_menu)
+    return problem, skipped
+
+
+# --- поиск ---
+
+def _add_safe(levels: list, safe: int) -> list:
+    """levels[i] - группы, которым в меню хватает i+1 безопасных блюд; добавляет блюдо с маской safe."""
+    return [levels[0] | safe] + [levels[i] | levels[i - 1] & safe for i in range(1, len(levels))]
+
+
+class _State:
+    def __init__(self, problem: Problem):
+        self.p = problem
+        self.menus = [[] for _ in problem.slots]
+        # по слотам: уровни покрытия групп (_add_safe), маска типов еды и оценка меню
+        self.levels = [[0] * problem.need for _ in problem.slots]
+        self.type_masks = [0] * len(problem.slots)
+        self.scores = [0.0] * len(problem.slots)
+        self.uses = defaultdict(list)  # dish_id -> отсортированные номера дней
+        for day, dish_id in problem.history:
+            insort(self.uses[dish_id], day)
+        self.used = defaultdict(float)  # product_id -> расход новых меню
+
+    def _counters(self, dishes) -> tuple:
+        p = self.p
+        levels, type_mask = [0] * p.need, 0
+        for d in dishes:
+            levels = _add_safe(levels, p.safe[d])
+            type_mask |= p.types[d]
+        return levels, type_mask
+
+    def menu_score(self, dishes) -> float:
+        if not dishes:
+            return 0.0
+        levels, type_mask = self._counters(dishes)
+        return self.p.cover_score(levels[-1]) + TYPES_WEIGHT * bin(type_mask).count("1")
+
+    def add_gain(self, s: int, dish_id: int) -> float:
+        """Прирост оценки слота s от добавления блюда (по счётчикам слота, без пересчёта меню)."""
+        p = self.p
+        levels, type_mask = self.levels[s], self.type_masks[s]
+        top = levels[-2] & p.safe[dish_id] if p.need > 1 else p.safe[dish_id]
+        new_types = bin((type_mask | p.types[dish_id]) & ~type_mask).count("1")
+        if not self.menus[s]:
+            # пустое меню оценивается в 0, а не в долю покрытых групп
+            return p.cover_score(levels[-1] | top) + TYPES_WEIGHT * new_types
+        gain = TYPES_WEIGHT * new_types
+        newly = top & ~levels[-1]
+        if newly and p.allergic:
+            gain += COVER_WEIGHT * p.students(newly) / p.allergic
+        return gain
+
+    def _rescore(self, s: int):
+        self.levels[s], self.type_masks[s] = self._counters(self.menus[s])
+        self.scores[s] = self.menu_score(self.menus[s])
+
+    @staticmethod
+    def _gap_penalty(gap: int) -> float:
+        return SAME_DAY_PENALTY if gap == 0 else REPEAT_WEIGHT / gap
+
+    def repeat_delta(self, dish_id: int, day: int, add: bool) -> float:
+        """Изменение штрафа за повторы при добавлении/удалении использования блюда в день day."""
+        days = self.uses[dish_id]
+        i = bisect_left(days, day)
+        if not add:
+            # удаляем days[i] == day: соседи - days[i-1] и days[i+1]
+            prev_day = days[i - 1] if i > 0 else None
+            next_day = days[i + 1] if i + 1 < len(days) else None
+        else:
+            prev_day = days[i - 1] if i > 0 else None
+            next_day = days[i] if i < len(days) else None
+        delta = 0.0
+        if prev_day is not None:
+            delta += self._gap_penalty(day - prev_day)
+        if next_day is not None:
+            delta += self._gap_penalty(next_day - day)
+        if prev_day is not None and next_day is not None:
+            delta -= self._gap_penalty(next_day - prev_day)
+        return delta if add else -delta
+
+    def fits(self, dish_id: int, portions: int, removed=None) -> bool:
+        stock = self.p.stock
+        if stock is None:
+            return True
+        freed = dict(self.p.consumption.get(removed, ())) if removed is not None else {}
+        for product_id, amount in self.p.consumption.get(dish_id, ()):
+            after = self.used[product_id] + (amount - freed.get(product_id, 0.0)) * portions
+            if after > stock.get(product_id, 0.0) + 1e-9:
+                return False
+        return True
+
+    def _consume(self, dish_id: int, portions: int, sign: int):
+        for product_id, amount in self.p.consumption.get(dish_id, ()):
+            self.used[product_id] += sign * amount * portions
+
+    def place(self, s: int, dish_id: int):
+        day, _, _, portions = self.p.slots[s]
+        self.scores[s] += self.add_gain(s, dish_id)
+        self.levels[s] = _add_safe(self.levels[s], self.p.safe[dish_id])
+        self.type_masks[s] |= self.p.types[dish_id]
+        self.menus[s].append(dish_id)
+        insort(self.uses[dish_id], day)
+        self._consume(dish_id, portions, 1)
+
+    def clear(self, s: int):
+        """Освобождает слот: повторы и расход продуктов его блюд снимаются."""
+        day, _, _, portions = self.p.slots[s]
+        for dish_id in self.menus[s]:
+            self.uses[dish_id].pop(bisect_left(self.uses[dish_id], day))
+            self._consume(dish_id, portions, -1)
+        self.menus[s] = []
+        self._rescore(s)
+
+    def replace(self, s: int, j: int, dish_id: int):
+        day, _, _, portions = self.p.slots[s]
+        old = self.menus[s][j]
+        self.uses[old].pop(bisect_left(self.uses[old], day))
+        self._consume(old, portions, -1)
+        self.menus[s][j] = dish_id
+        insort(self.uses[dish_id], day)
+        self._consume(dish_id, portions, 1)
+        self._rescore(s)
+
+
+def _greedy(state: _State, rng: random.Random) -> dict:
+    """Заполняет слоты по очереди. Возвращает {слот: сколько блюд не хватило} для незаполненных."""
+    p = state.p
+    missing = {}
+    for s, (day, _, t, portions) in enumerate(p.slots):
+        for _ in range(p.k):
+            menu = state.menus[s]
+            best, best_gain = None, None
+            for dish_id in p.pools[t]:
+                if dish_id in menu or not state.fits(dish_id, portions):
+                    continue
+                # небольшой шум - чтобы равные блюда чередовались, а не выбиралось всегда первое
+                gain = (state.add_gain(s, dish_id)
+                        - state.repeat_delta(dish_id, day, add=True) + rng.random() * 1e-6)
+                if best_gain is None or gain > best_gain:
+                    best, best_gain = dish_id, gain
+            if best is None:
+                break
+            state.place(s, best)
+        if len(state.menus[s]) < p.k:
+            # неполное меню не создаётся
+            missing[s] = p.k - len(state.menus[s])
+            state.clear(s)
+    return missing
+
+
+def _local_search(state: _State, rng: random.Random, iterations: int, deadline) -> int:
+    p = state.p
+    filled = [s for s, menu in enumerate(state.menus) if menu]
+    if not filled:
+        return 0
+    improved = 0
+    for i in range(iterations):
+        if deadline is not None and i % 256 == 0 and time.perf_counter() > deadline:
+            break
+        s = rng.choice(filled)
+        day, _, t, portions = p.slots[s]
+        menu = state.menus[s]
+        j = rng.randrange(len(menu))
+        candidate = rng.choice(p.pools[t])
+        old = menu[j]
+        if candidate in menu or not state.fits(candidate, portions, removed=old):
+            continue
+        new_menu = menu[:j] + [candidate] + menu[j + 1:]
+        delta = state.menu_score(new_menu) - state.scores[s]
+        # сначала убираем старое блюдо из дня, потом считаем добавление нового
+        delta -= state.repeat_delta(old, day, add=False)
+        state.uses[old].pop(bisect_left(state.uses[old], day))
+        delta -= state.repeat_delta(candidate, day, add=True)
+        insort(state.uses[old], day)
+        if delta > 1e-9:
+            state.replace(s, j, candidate)
+            improved += 1
+    return improved
+
+
+def solve(problem: Problem, seed=0, iterations=MENU_GEN_ITERATIONS, seconds=MENU_GEN_SECONDS) -> dict:
+    """
+    Жадное построение и локальный поиск. seconds - время локального поиска после жадного
+    построения; None - без ограничения времени (детерминированно).
+    """
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    state = _State(problem)
+    missing = _greedy(state, rng)
+    greedy_done = time.perf_counter()
+    greedy_seconds = greedy_done - started
+    improved = _local_search(state, rng, iterations, None if seconds is None else greedy_done + seconds)
+
+    menus, unfilled, scores, repeats = [], [], [], 0
+    for s, ((day, d, t, portions), dishes) in enumerate(zip(problem.slots, state.menus)):
+        if s in missing:
+            unfilled.append({"date": d.isoformat(), "type": t.name, "missing": missing[s]})
+            continue
+        menus.append({"date": d, "type": t, "dishes": sorted(dishes), "portions": portions})
+        scores.append(state.scores[s])
+    for dish_days in state.uses.values():
+        repeats += sum(1 for a, b in zip(dish_days, dish_days[1:]) if b - a < 3)
+
+    return {
+        "menus": menus,
+        "unfilled": unfilled,
+        "score": round(sum(scores) / len(scores), 4) if scores else 0.0,
+        # повторы одного блюда чаще чем раз в 3 дня
+        "close_repeats": repeats,
+        "allergic_students": problem.allergic,
+        "improvements": improved,
+        "greedy_seconds": round(greedy_seconds, 3),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+# --- запись ---
+
+def _prices(meal_types) -> dict:
+    """Цена как у последнего меню того же типа."""
+    prices = dict(DEFAULT_PRICES)
+    for t in meal_types:
+        last = db.session.execute(
+            select(Menu.price).where(Menu.type == t).order_by(Menu.date.desc()).limit(1)
+        ).scalar()
+        if last:
+            prices[t] = last
+    return prices
+
+
+def write(menus: list, prices=None, dishes_per_menu=DISHES_PER_MENU) -> int:
+    """Одним INSERT меню и одним INSERT их блюд. Коммит делает вызывающий код."""
+    if not menus:
+        return 0
+    incomplete = [m for m in menus if len(m["dishes"]) < dishes_per_menu]
+    if incomplete:
+        m = incomplete[0]
+        raise ValueError(f"Неполное меню {m['date']} {m['type'].name}: {len(m['dishes'])} из {dishes_per_menu} блюд")
+    prices = prices or _prices({m["type"] for m in menus})
+    created = db.session.execute(
+        insert(Menu).returning(Menu.id, Menu.date, Menu.type),
+        [{"date": m["date"], "type": m["type"], "price": prices.get(m["type"], 0)} for m in menus],
+    ).all()
+    ids = {(d, t): menu_id for menu_id, d, t in created}
+    db.session.execute(insert(MenuDishes), [
+        {"menu_id": ids[m["date"], m["type"]], "dish_id": dish_id} for m in menus for dish_id in m["dishes"]
+    ])
+    invalidate_after_commit(db.session, {m["date"] for m in menus})
+    return len(created)
+
+
+def generate(d_from: _date, days: int, weekdays_only=False, dry_run=False, seed=0, portions=None,
+             use_stock=True, seconds=MENU_GEN_SECONDS) -> dict:
+    """Составляет и (если не dry_run) записывает меню. Возвращает сводку с меню."""
+    started = time.perf_counter()
+    problem, skipped = load(d_from, days, weekdays_only=weekdays_only, portions=portions, use_stock=use_stock)
+    load_seconds = time.perf_counter() - started
+    result = solve(problem, seed=seed, seconds=seconds)
+
+    created = 0
+    if not dry_run:
+        t0 = time.perf_counter()
+        created = write(result["menus"], dishes_per_menu=problem.k)
+        db.session.commit()
+        result["write_seconds"] = round(time.perf_counter() - t0, 3)
+
+    result.update(
+        created=created,
+        skipped=[{"date": d.isoformat(), "type": t.name} for d, t in skipped],
+        dishes={t.name: len(ids) for t, ids in problem.pools.items()},
+        load_seconds=round(load_seconds, 3),
+    )
+    result["menus"] = [
+        {"date": m["date"].isoformat(), "type": m["type"].name, "dishes": m["dishes"], "portions": m["portions"]}
+        for m in result["menus"]
+    ]
+    return result
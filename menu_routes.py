@@ -1,12 +1,23 @@
+import json
+from collections import defaultdict
 from datetime import date as _date
 from datetime import datetime
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request
 
+from allergen_index import annotate_dishes
+from auth import AuthError, current_principal
+from db_routing import read_primary, use_replica
+from menu_cache import menu_cache
 from models import db, Menu, MenuDishes, Dish
 
 
 menu_bp = Blueprint("menu", __name__, url_prefix="/menu")
+# маршруты только читают: SELECT идут на реплику, если она настроена
+menu_bp.before_request(use_replica)
+
+# Максимальная длина периода для /menu/range (в днях, включительно)
+MAX_RANGE_DAYS = 62
 
 
 def _dish_to_dict(d: Dish) -> dict:
@@ -19,24 +30,46 @@ def _dish_to_dict(d: Dish) -> dict:
     }
 
 
-def _menu_to_dict(m: Menu) -> dict:
-    dishes = (
-        db.session.query(Dish)
-        .join(MenuDishes, MenuDishes.dish_id == Dish.id)
-        .filter(MenuDishes.menu_id == m.id)
-        .order_by(Dish.name.asc())
+def _load_dishes(menu_ids) -> dict:
+    """
+    Загружает блюда сразу для набора меню одним запросом.
+    Возвращает {menu_id: [Dish, ...]}, блюда отсортированы по имени.
+    """
+    result = defaultdict(list)
+    if not menu_ids:
+        return result
+
+    rows = (
+        db.session.query(MenuDishes.menu_id, Dish)
+        .join(Dish, MenuDishes.dish_id == Dish.id)
+        .filter(MenuDishes.menu_id.in_(menu_ids))
+        .order_by(MenuDishes.menu_id.asc(), Dish.name.asc())
         .all()
     )
+    for menu_id, dish in rows:
+        result[menu_id].append(dish)
+    return result
+
+
+def _menu_to_dict(m: Menu, dishes=None) -> dict:
+    if dishes is None:
+        dishes = _load_dishes([m.id])[m.id]
 
     return {
         "id": m.id,
         "date": m.date.isoformat() if m.date else None,
         "type": (m.type.value if m.type else None),
         "type_code": (m.type.name if m.type else None),
+        "price": m.price,
         "dishes": [_dish_to_dict(d) for d in dishes],
     }
 
 
+def _menus_to_dicts(menus) -> list:
+    dishes = _load_dishes([m.id for m in menus])
+    return [_menu_to_dict(m, dishes[m.id]) for m in menus]
+
+
 def _parse_date(date_str: str) -> _date | None:
     try:
         return _date.fromisoformat(date_str)
@@ -44,15 +77,70 @@ def _parse_date(date_str: str) -> _date | None:
         return None
 
 
+def _menus_for_date(d: _date) -> dict:
+    menus = Menu.query.filter_by(date=d).order_by(Menu.id.asc()).all()
+    return {
+        "date": d.isoformat(),
+        "menus": _menus_to_dicts(menus),
+    }
+
+
+FOR_USER_MODES = ("annotate", "filter")
+
+
+def _for_user():
+    """
+    Параметр for_user=annotate|filter: отметить или убрать блюда
+    с аллергенами текущего ученика. Возвращает (mode, user_id) или (None, None).
+    """
+    mode = (request.args.get("for_user") or "").strip()
+    if not mode:
+        return None, None
+    if mode not in FOR_USER_MODES:
+        raise AuthError("for_user должен быть annotate или filter", 400)
+    return mode, current_principal().id
+
+
+def _personalize(menus: list, mode: str, user_id: int) -> list:
+    return [{**m, "dishes": annotate_dishes(m["dishes"], user_id, mode)} for m in menus]
+
+
+def _cached_menus_for_date(d: _date) -> Response:
+    """
+    Ответ с меню на дату из кэша. Если клиент прислал совпадающий
+    If-None-Match, отдаём 304 без обращения к БД.
+    """
+    try:
+        mode, user_id = _for_user()
+    except AuthError as e:
+        return jsonify({"message": e.message}), e.status
+
+    entry = menu_cache.get(d)
+    if entry is None:
+        # версия - до чтения из БД, чтобы не закэшировать меню, сброшенное за это время;
+        # промах бывает сразу после сброса, а реплика может ещё не видеть изменение
+        version = menu_cache.version(d)
+        with read_primary():
+            entry = menu_cache.set(d, jsonify(_menus_for_date(d)).get_data(), version)
+
+    if mode:
+        # персональный ответ строится из общего кэша, сам не кэшируется
+        payload = json.loads(entry.body)
+        payload["menus"] = _personalize(payload["menus"], mode, user_id)
+        return jsonify(payload)
+
+    if request.if_none_match.contains(entry.etag):
+        resp = Response(status=304)
+    else:
+        resp = Response(entry.body, mimetype="application/json")
+    resp.set_etag(entry.etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
 @menu_bp.get("/today")
 def menu_today():
-    today = _date.today()
-    menus = Menu.query.filter_by(date=today).order_by(Menu.id.asc()).all()
-
-    return jsonify({
-        "date": today.isoformat(),
-        "menus": [_menu_to_dict(m) for m in menus],
-    })
+    return _cached_menus_for_date(_date.today())
 
 
 @menu_bp.get("")
@@ -65,10 +153,47 @@ def menu_by_date_query():
     if not d:
         return jsonify({"message": "Неверный формат date. Используй YYYY-MM-DD"}), 400
 
-    menus = Menu.query.filter_by(date=d).order_by(Menu.id.asc()).all()
+    return _cached_menus_for_date(d)
+
+
+@menu_bp.get("/range")
+def menu_range():
+    try:
+        mode, user_id = _for_user()
+    except AuthError as e:
+        return jsonify({"message": e.message}), e.status
+
+    d_from = _parse_date((request.args.get("from") or "").strip())
+    d_to = _parse_date((request.args.get("to") or "").strip())
+    if not d_from or not d_to:
+        return jsonify({"message": "Нужны параметры from и to в формате YYYY-MM-DD"}), 400
+
+    if d_to < d_from:
+        return jsonify({"message": "Параметр to не может быть раньше from"}), 400
+
+    if (d_to - d_from).days + 1 > MAX_RANGE_DAYS:
+        return jsonify({"message": f"Период не может быть длиннее {MAX_RANGE_DAYS} дней"}), 400
+
+    # 2 запроса на весь период: меню + блюда всех меню
+    menus = (
+        Menu.query
+        .filter(Menu.date >= d_from, Menu.date <= d_to)
+        .order_by(Menu.date.asc(), Menu.id.asc())
+        .all()
+    )
+
+    items = _menus_to_dicts(menus)
+    if mode:
+        items = _personalize(items, mode, user_id)
+
+    days = defaultdict(list)
+    for item in items:
+        days[item["date"]].append(item)
+
     return jsonify({
-        "date": d.isoformat(),
-        "menus": [_menu_to_dict(m) for m in menus],
+        "from": d_from.isoformat(),
+        "to": d_to.isoformat(),
+        "days": [{"date": k, "menus": v} for k, v in days.items()],
     })
 
 
@@ -78,8 +203,4 @@ def menu_by_date_path(date_str: str):
     if not d:
         return jsonify({"message": "Неверный формат даты. Используй YYYY-MM-DD"}), 400
 
-    menus = Menu.query.filter_by(date=d).order_by(Menu.id.asc()).all()
-    return jsonify({
-        "date": d.isoformat(),
-        "menus": [_menu_to_dict(m) for m in menus],
-    })
+    return _cached_menus_for_date(d)
@@ -0,0 +1,304 @@
+"""
+Метрики запросов и SQL в формате Prometheus (GET /metrics).
+Для каждого маршрута: гистограмма времени ответа, число SQL-запросов и время в БД.
+Медленные запросы сохраняются вместе с маршрутом (GET /metrics/slow, только администратору:
+в ответе текст SQL).
+
+С несколькими воркерами gunicorn нужен METRICS_DIR (gunicorn.conf.py задаёт его сам):
+каждый воркер раз в METRICS_FLUSH_SECONDS сбрасывает свои счётчики в файл,
+а /metrics складывает файлы всех воркеров, поэтому ответ не зависит от того,
+какой воркер принял запрос.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from flask import g, has_request_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from auth import login_required
+from models import UserRole
+from passwords import hasher
+
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "1"))
+METRICS_DEBUG_HEADER = os.getenv("METRICS_DEBUG_HEADER", "1") == "1"
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "0.1"))
+SLOW_QUERY_SAMPLES = int(os.getenv("SLOW_QUERY_SAMPLES", "50"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Metrics:
+    """Счётчики одного процесса. Ключи - кортежи меток, значения - числа."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self.slow = deque(maxlen=SLOW_QUERY_SAMPLES)
+        self._dirty = False
+        self._flusher_pid = None
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self._lock:
+            self._dirty = True
+            self.counters[key] = self.counters.get(key, 0) + value
+        self._ensure_flusher()
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, labels)
+        with self._lock:
+            self._dirty = True
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    h[i] += 1
+            h[len(buckets)] += 1
+            h[len(buckets) + 1] += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": [[n, list(l), v] for (n, l), v in self.counters.items()],
+                "histograms": [[n, list(l), list(h)] for (n, l), h in self.histograms.items()],
+                "slow": list(self.slow),
+                "password_hash": dict(hasher.stats),
+                "pid": os.getpid(),
+                "rss_bytes": _rss_bytes(),
+            }
+
+    def flush(self):
+        """Сбрасывает счётчики процесса в METRICS_DIR/worker-<pid>.json."""
+        if not METRICS_DIR:
+            return
+        with self._lock:
+            self._dirty = False
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"worker-{os.getpid()}.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+    def _ensure_flusher(self):
+        # поток сброса свой у каждого воркера: после fork проверяем pid
+        if not METRICS_DIR or self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(METRICS_FLUSH_SECONDS)
+            if self._dirty:
+                try:
+                    self.flush()
+                except OSError:
+                    pass
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, TypeError):
+        pass
+    return True
+
+
+metrics = Metrics()
+
+
+def _collect_snapshots() -> list:
+    """Снимки всех воркеров (свой - из памяти, свежий)."""
+    own = metrics.snapshot()
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return [own]
+    snapshots = [own]
+    own_file = f"worker-{os.getpid()}.json"
+    for name in os.listdir(METRICS_DIR):
+        if not name.endswith(".json") or name == own_file:
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name), encoding="utf-8") as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for n, v in zip(names, values):
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{n}="{v}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+# имя метрики -> (тип, описание, имена меток, границы корзин)
+METRIC_DEFS = {
+    "canteen_http_requests_total": ("counter", "HTTP-запросы", ("route", "method", "status"), None),
+    "canteen_http_request_duration_seconds": (
+        "histogram", "Время ответа", ("route", "method"), LATENCY_BUCKETS),
+    "canteen_db_queries_total": ("counter", "SQL-запросы", ("route",), None),
+    "canteen_db_seconds_total": ("counter", "Время в БД", ("route",), None),
+    "canteen_db_queries_per_request": (
+        "histogram", "SQL-запросов на HTTP-запрос", ("route",), QUERY_COUNT_BUCKETS),
+    "canteen_db_slow_queries_total": ("counter", "Медленные SQL-запросы", ("route",), None),
+}
+
+
+def render_prometheus() -> str:
+    counters = {}
+    histograms = {}
+    snapshots = _collect_snapshots()
+    for snap in snapshots:
+        for name, labels, value in snap["counters"]:
+            key = (name, tuple(labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, h in snap["histograms"]:
+            key = (name, tuple(labels))
+            acc = histograms.setdefault(key, [0] * len(h))
+            for i, v in enumerate(h):
+                acc[i] += v
+
+    lines = []
+    for name, (kind, help_text, label_names, buckets) in METRIC_DEFS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{_labels(label_names, labels)} {value}")
+            continue
+
+        for (n, labels), h in sorted(histograms.items()):
+            if n != name:
+                continue
+            for bound, count in zip(buckets, h):
+                lines.append(f"{name}_bucket{_labels(label_names + ('le',), labels + (bound,))} {count}")
+            lines.append(f"{name}_bucket{_labels(label_names + ('le',), labels + ('+Inf',))} {h[len(buckets)]}")
+            lines.append(f"{name}_sum{_labels(label_names, labels)} {h[len(buckets) + 1]}")
+            lines.append(f"{name}_count{_labels(label_names, labels)} {h[len(buckets)]}")
+
+    # пул хэширования паролей (passwords.py): счётчики складываются, максимумы - нет
+    password_hash = {}
+    for snap in snapshots:
+        for key, value in snap.get("password_hash", {}).items():
+            if key.endswith("_max"):
+                password_hash[key] = max(password_hash.get(key, 0), value)
+            else:
+                password_hash[key] = password_hash.get(key, 0) + value
+    for key, value in sorted(password_hash.items()):
+        kind = "gauge" if key.endswith("_max") else "counter"
+        name = f"canteen_password_hash_{key}" + ("" if kind == "gauge" or key.endswith("_total") else "_total")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {value}")
+
+    # память всех живых воркеров: по ней сравниваются режимы gunicorn при одинаковом бюджете
+    rss = sum(snap.get("rss_bytes", 0) for snap in snapshots if _alive(snap.get("pid")))
+    lines.append("# TYPE canteen_process_resident_memory_bytes gauge")
+    lines.append(f"canteen_process_resident_memory_bytes {rss}")
+    return "\n".join(lines) + "\n"
+
+
+# --- SQL ---
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("metrics_started")
+    if not started:
+        return
+    spent = time.perf_counter() - started.pop()
+    route = "<no request>"
+    if has_request_context():
+        g.db_queries = g.get("db_queries", 0) + 1
+        g.db_seconds = g.get("db_seconds", 0.0) + spent
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+
+    if spent >= SLOW_QUERY_SECONDS:
+        metrics.inc("canteen_db_slow_queries_total", (route,))
+        metrics.slow.append({
+            "route": route,
+            "seconds": round(spent, 4),
+            "sql": statement[:1000],
+            "at": time.time(),
+            "pid": os.getpid(),
+        })
+
+
+@event.listens_for(Engine, "handle_error")
+def _drop_started(context):
+    # after_cursor_execute после ошибки не вызывается: иначе стек рос бы на каждой ошибке,
+    # а время следующих запросов соединения считалось бы от чужого начала
+    conn = context.connection
+    started = conn.info.get("metrics_started") if conn is not None else None
+    if started:
+        started.pop()
+
+
+# --- HTTP ---
+
+def init_metrics(app):
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+        g.db_queries = 0
+        g.db_seconds = 0.0
+
+    @app.after_request
+    def _record(response):
+        started = g.get("metrics_started")
+        if started is None:
+            return response
+        spent = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        method = request.method
+
+        metrics.inc("canteen_http_requests_total", (route, method, response.status_code))
+        metrics.observe("canteen_http_request_duration_seconds", (route, method), spent, LATENCY_BUCKETS)
+        metrics.inc("canteen_db_queries_total", (route,), g.db_queries)
+        metrics.inc("canteen_db_seconds_total", (route,), g.db_seconds)
+        metrics.observe("canteen_db_queries_per_request", (route,), g.db_queries, QUERY_COUNT_BUCKETS)
+
+        if METRICS_DEBUG_HEADER:
+            response.headers["X-DB-Query-Count"] = str(g.db_queries)
+            response.headers["X-DB-Time-Ms"] = f"{g.db_seconds * 1000:.1f}"
+        return response
+
+    @app.get("/metrics")
+    def metrics_view():
+        return render_prometheus(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+    @app.get("/metrics/slow")
+    @login_required(UserRole.ADMIN)
+    def slow_queries():
+        samples = [s for snap in _collect_snapshots() for s in snap["slow"]]
+        samples.sort(key=lambda s: s["at"], reverse=True)
+        return jsonify({"threshold_seconds": SLOW_QUERY_SECONDS, "samples": samples[:SLOW_QUERY_SAMPLES]})
@@ -0,0 +1,254 @@
+"""
+Версионные миграции схемы (flask --app app migrate).
+Применённые версии хранятся в schema_version. Миграция 1 - исходная схема,
+записанная здесь же (не по текущим моделям); каждая следующая создаёт только
+то, что добавила её версия. Миграции идемпотентны: на БД, созданной до появления
+миграций, они досоздают недостающие таблицы, колонки и индексы.
+Новые миграции добавляются в конец MIGRATIONS.
+"""
+from datetime import datetime
+
+from sqlalchemy import (
+    Boolean, Column, Date, DateTime, Enum, Float, ForeignKey, Integer, MetaData, String, Table, inspect, select, text,
+)
+
+from models import db, MealType, Unit, UserRole
+
+_meta = MetaData()
+schema_version = Table(
+    "schema_version", _meta,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(200), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+# ключ pg_advisory_xact_lock: две команды migrate не выполнятся одновременно
+_LOCK_KEY = 7_202_602
+
+
+class MigrationError(Exception):
+    pass
+
+
+def _add_column(conn, table: str, column: str, ddl: str):
+    if column not in {c["name"] for c in inspect(conn).get_columns(table)}:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def _model_tables(*names) -> list:
+    return [db.metadata.tables[name] for name in names]
+
+
+def _create_indexes(conn, names):
+    # индексы и ограничения уникальности из models.py - только перечисленные
+    indexes = {index.name: index for table in db.metadata.sorted_tables for index in table.indexes}
+    for name in names:
+        try:
+            indexes[name].create(conn, checkfirst=True)
+        except Exception as e:
+            raise MigrationError(
+                f"Не удалось создать индекс {name}: {e.__class__.__name__}. "
+                f"Для уникальных индексов сначала удалите дубли."
+            ) from e
+
+
+# Исходная схема (до появления миграций). Не менять: изменения - только новыми миграциями.
+_baseline = MetaData()
+Table(
+    "food_type", _baseline,
+    Column("id", Integer, primary_key=True),
+    Column("name", String(120), index=True, unique=True),
+)
+Table(
+    "user", _baseline,
+    Column("id", Integer, primary_key=True),
+    Column("login", String(120), index=True, unique=True),
+    Column("password_hash", String(255)),
+    Column("role", Enum(UserRole)),
+    Column("money", Integer),
+)
+Table(
+    "paid_menu", _baseline,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("user.id")),
+    Column("menu_id", Integer, ForeignKey("menu.id")),
+    Column("is_taken", Boolean),
+)
+Table(
+    "dish", _baseline,
+    Column("id", Integer, primary_key=True),
+    Column("name", String(120), index=True, unique=True, nullable=False),
+    Column("amount", Float),
+    Column("unit", Enum(Unit)),
+)
+Table(
+    "compound", _baseline,
+    Column("id", Integer, primary_key=True),
+    Column("dish_id", Integer, ForeignKey("dish.id")),
+    Column("product_id", Integer, ForeignKey("product.id")),
+    Column("amount", Float),
+)
+Table(
+    "menu", _baseline,
+    Column("id", Integer, primary_key=True),
+    Column("date", Date),
+    Column("type", Enum(MealType)),
+)
+Table(
+    "menu_dishes", _baseline,
+    Column("menu_id", Integer, ForeignKey("menu.id"), primary_key=True),
+    Column("dish_id", Integer, ForeignKey("dish.id"), primary_key=True),
+)
+Table(
+    "product", _baseline,
+    Column("id", Integer, primary_key=True),
+    Column("name", String(120), index=True, unique=True, nullable=False),
+    Column("unit", Enum(Unit)),
+    Column("amount", Float),
+)
+Table(
+    "product_type", _baseline,
+    Column("product_id", Integer, ForeignKey("product.id"), primary_key=True),
+    Column("type_id", Integer, ForeignKey("food_type.id"), primary_key=True),
+)
+Table(
+    "allergy_products", _baseline,
+    Column("product_id", Integer, ForeignKey("product.id"), primary_key=True),
+    Column("allergy_id", Integer, ForeignKey("allergy.id"), primary_key=True),
+)
+Table(
+    "allergy", _baseline,
+    Column("id", Integer, primary_key=True),
+    Column("name", String(120), index=True, unique=True, nullable=False),
+    Column("description", String(500)),
+)
+Table(
+    "user_disliked", _baseline,
+    Column("user_id", Integer, ForeignKey("user.id"), primary_key=True),
+    Column("type_id", Integer, ForeignKey("food_type.id"), primary_key=True),
+)
+Table(
+    "user_allergy", _baseline,
+    Column("user_id", Integer, ForeignKey("user.id"), primary_key=True),
+    Column("allergy_id", Integer, ForeignKey("allergy.id"), primary_key=True),
+)
+Table(
+    "feedback", _baseline,
+    Column("id", Integer, primary_key=True),
+    Column("text", String(500)),
+    Column("user_id", Integer, ForeignKey("user.id")),
+    Column("menu_id", Integer, ForeignKey("menu.id")),
+    Column("dish_id", Integer, ForeignKey("dish.id")),
+)
+Table(
+    "product_request", _baseline,
+    Column("id", Integer, primary_key=True),
+    Column("product_id", Integer, ForeignKey("product.id")),
+    Column("amount", Float),
+    Column("is_agreed", Boolean),
+    Column("created", Date),
+    Column("fulfilled", Date),
+)
+
+
+def _initial(conn):
+    _baseline.create_all(conn)
+
+
+def _menu_price(conn):
+    # цена меню и таблицы, которые появились до миграций (create_all при старте):
+    # ключи идемпотентности покупок, журнал остатков, итоги продаж
+    _add_column(conn, "menu", "price", "INTEGER NOT NULL DEFAULT 0")
+    db.metadata.create_all(conn, tables=_model_tables("purchase_key", "stock_movement", "stock_snapshot", "menu_stats"))
+
+
+def _hot_indexes(conn):
+    _create_indexes(conn, [
+        "ux_menu_date_type", "ux_paid_menu_user_id_menu_id", "ix_paid_menu_menu_id_is_taken",
+        "ix_compound_dish_id", "ix_compound_product_id", "ix_menu_dishes_dish_id",
+        "ix_feedback_menu_id", "ix_feedback_dish_id",
+        "ix_product_request_created_is_agreed", "ix_product_request_open_product_id",
+    ])
+
+
+def _feedback_search(conn):
+    # полнотекстовый индекс отзывов и счётчики для сводки по блюдам
+    import feedback
+
+    db.metadata.create_all(conn, tables=_model_tables("dish_feedback_stats", "menu_feedback_stats", "dish_feedback_tag"))
+    feedback.create_search_index(conn)
+    feedback.rebuild_stats(conn)
+
+
+def _listing_indexes(conn):
+    _create_indexes(conn, ["ix_user_role_id", "ix_product_request_created_id"])
+
+
+def _jobs(conn):
+    db.metadata.create_all(conn, tables=_model_tables("job"))
+
+
+def _menu_stats_deltas(conn):
+    # покупки пишут приращения в menu_stats_delta; итоги по уже сделанным покупкам - из paid_menu
+    # (в схеме этой версии списанной суммы ещё нет - выручка по цене меню)
+    db.metadata.create_all(conn, tables=_model_tables("menu_stats_delta"))
+    conn.execute(text("DELETE FROM menu_stats_delta"))
+    conn.execute(text("DELETE FROM menu_stats"))
+    conn.execute(text(
+        "INSERT INTO menu_stats (menu_id, date, type, sold, taken, revenue) "
+        "SELECT menu.id, menu.date, menu.type, COUNT(paid_menu.id), "
+        "SUM(CASE WHEN paid_menu.is_taken THEN 1 ELSE 0 END), COUNT(paid_menu.id) * COALESCE(menu.price, 0) "
+        "FROM menu JOIN paid_menu ON paid_menu.menu_id = menu.id "
+        "GROUP BY menu.id, menu.date, menu.type, menu.price"
+    ))
+
+
+def _job_uploads(conn):
+    db.metadata.create_all(conn, tables=_model_tables("job_upload"))
+
+
+def _paid_menu_price(conn):
+    # списанная сумма покупки; для старых покупок известна только текущая цена меню
+    _add_column(conn, "paid_menu", "price", "INTEGER NOT NULL DEFAULT 0")
+    conn.execute(text(
+        "UPDATE paid_menu SET price = (SELECT COALESCE(menu.price, 0) FROM menu WHERE menu.id = paid_menu.menu_id)"
+    ))
+
+
+MIGRATIONS = [
+    (1, "initial schema", _initial),
+    (2, "menu.price and pre-migration tables", _menu_price),
+    (3, "hot query indexes and uniqueness", _hot_indexes),
+    (4, "feedback full-text index and stats", _feedback_search),
+    (5, "admin listing indexes", _listing_indexes),
+    (6, "background job queue", _jobs),
+    (7, "menu stats deltas and backfill", _menu_stats_deltas),
+    (8, "job uploads", _job_uploads),
+    (9, "paid_menu.price", _paid_menu_price),
+]
+
+
+def migrate(engine, log=print) -> list:
+    """Применяет недостающие миграции в одной транзакции. Возвращает их версии."""
+    applied_now = []
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _LOCK_KEY})
+        _meta.create_all(conn)
+
+        applied = {row[0] for row in conn.execute(select(schema_version.c.version))}
+        for version, name, fn in MIGRATIONS:
+            if version in applied:
+                continue
+            log(f"миграция {version}: {name}")
+            fn(conn)
+            conn.execute(schema_version.insert().values(version=version, name=name, applied_at=datetime.utcnow()))
+            applied_now.append(version)
+    return applied_now
+
+
+def current_version(engine) -> int:
+    with engine.connect() as conn:
+        if not inspect(conn).has_table("schema_version"):
+            return 0
+        return conn.execute(select(schema_version.c.version).order_by(schema_version.c.version.desc())).scalar() or 0
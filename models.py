@@ -1,8 +1,10 @@
 from flask_sqlalchemy import SQLAlchemy
 from enum import Enum
-from datetime import date
+from datetime import date, datetime
 
-db = SQLAlchemy()
+from db_routing import RoutingSession
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 class UserRole(Enum):
     STUDENT = 'ученик'
@@ -27,6 +29,11 @@ class FoodType(db.Model):
 
 
 class User(db.Model):
+    # список пользователей по роли в админке (listings)
+    __table_args__ = (
+        db.Index('ix_user_role_id', 'role', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     login = db.Column(db.String(120), index=True, unique=True)
     password_hash = db.Column(db.String(255))
@@ -36,10 +43,26 @@ class User(db.Model):
 
 
 class PaidMenu(db.Model):
+    __table_args__ = (
+        db.Index('ux_paid_menu_user_id_menu_id', 'user_id', 'menu_id', unique=True),
+        db.Index('ix_paid_menu_menu_id_is_taken', 'menu_id', 'is_taken'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     menu_id = db.Column(db.Integer, db.ForeignKey('menu.id'))
     is_taken = db.Column(db.Boolean, default=False)
+    # списанная сумма: цена меню на момент покупки (цену меню потом могут поменять)
+    price = db.Column(db.Integer, nullable=False, default=0)
+
+
+class PurchaseKey(db.Model):
+    # Idempotency-Key покупки и сохранённый ответ на неё
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    key = db.Column(db.String(64), primary_key=True)
+    status_code = db.Column(db.Integer)
+    response = db.Column(db.Text)
+    created = db.Column(db.DateTime, default=datetime.utcnow)
 
 
 class Dish(db.Model):
@@ -50,6 +73,11 @@ class Dish(db.Model):
 
 
 class Compound(db.Model):
+    __table_args__ = (
+        db.Index('ix_compound_dish_id', 'dish_id'),
+        db.Index('ix_compound_product_id', 'product_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     dish_id = db.Column(db.Integer, db.ForeignKey('dish.id'))
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
@@ -57,12 +85,22 @@ class Compound(db.Model):
 
 
 class Menu(db.Model):
+    # не больше одного завтрака и одного обеда на дату
+    __table_args__ = (
+        db.Index('ux_menu_date_type', 'date', 'type', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date)
     type = db.Column(db.Enum(MealType))
+    price = db.Column(db.Integer, nullable=False, default=0)
 
 
 class MenuDishes(db.Model):
+    __table_args__ = (
+        db.Index('ix_menu_dishes_dish_id', 'dish_id'),
+    )
+
     menu_id = db.Column(db.Integer, db.ForeignKey('menu.id'), primary_key=True)
     dish_id = db.Column(db.Integer, db.ForeignKey('dish.id'), primary_key=True)
 
@@ -101,6 +139,11 @@ class UserAllergy(db.Model):
 
 
 class Feedback(db.Model):
+    __table_args__ = (
+        db.Index('ix_feedback_menu_id', 'menu_id'),
+        db.Index('ix_feedback_dish_id', 'dish_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     text = db.Column(db.String(500))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -108,10 +151,147 @@ class Feedback(db.Model):
     dish_id = db.Column(db.Integer, db.ForeignKey('dish.id'))
 
 
+class DishFeedbackStats(db.Model):
+    # Число отзывов о блюде, обновляется при добавлении отзыва
+    dish_id = db.Column(db.Integer, db.ForeignKey('dish.id'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class MenuFeedbackStats(db.Model):
+    # Число отзывов о меню, обновляется при добавлении отзыва
+    menu_id = db.Column(db.Integer, db.ForeignKey('menu.id'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DishFeedbackTag(db.Model):
+    # Сколько отзывов о блюде попало под метку (feedback.TAGS)
+    dish_id = db.Column(db.Integer, db.ForeignKey('dish.id'), primary_key=True)
+    tag = db.Column(db.String(40), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class MenuStats(db.Model):
+    # Итоги продаж и выдачи по меню, обновляются при покупке и выдаче
+    __table_args__ = (
+        db.Index('ix_menu_stats_date', 'date'),
+    )
+
+    menu_id = db.Column(db.Integer, db.ForeignKey('menu.id'), primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    type = db.Column(db.Enum(MealType))
+    sold = db.Column(db.Integer, nullable=False, default=0)
+    taken = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0)
+
+
+class MenuStatsDelta(db.Model):
+    # Приращения MenuStats от покупок и выдачи: только INSERT, без блокировки строки
+    # итогов; reports.fold() переносит их в MenuStats
+    __table_args__ = (
+        db.Index('ix_menu_stats_delta_date', 'date'),
+        db.Index('ix_menu_stats_delta_menu_id', 'menu_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    menu_id = db.Column(db.Integer, db.ForeignKey('menu.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    type = db.Column(db.Enum(MealType))
+    sold = db.Column(db.Integer, nullable=False, default=0)
+    taken = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0)
+
+
+class MovementReason(Enum):
+    CONSUMPTION = 'расход'
+    RECEIPT = 'поступление'
+    ADJUSTMENT = 'корректировка'
+
+
+class StockMovement(db.Model):
+    # Журнал движения продуктов: строки только добавляются
+    __table_args__ = (
+        db.Index('ix_stock_movement_product_id_id', 'product_id', 'id'),
+        db.Index('ix_stock_movement_product_id_created', 'product_id', 'created'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    delta = db.Column(db.Float, nullable=False)
+    reason = db.Column(db.Enum(MovementReason), nullable=False)
+    product_request_id = db.Column(db.Integer, db.ForeignKey('product_request.id'))
+    created = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class StockSnapshot(db.Model):
+    # Остаток продукта с учётом всех движений с id <= movement_id
+    __table_args__ = (
+        db.Index('ix_stock_snapshot_product_id_movement_id', 'product_id', 'movement_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    movement_id = db.Column(db.Integer, nullable=False)
+    # время последнего учтённого движения (NULL - начальный остаток)
+    covered_until = db.Column(db.DateTime)
+    amount = db.Column(db.Float, nullable=False)
+
+
 class ProductRequest(db.Model):
+    __table_args__ = (
+        db.Index('ix_product_request_created_is_agreed', 'created', 'is_agreed'),
+        # страницы списка заявок по ключу (created, id)
+        db.Index('ix_product_request_created_id', 'created', 'id'),
+        # незакрытые заявки (планировщик закупок)
+        db.Index(
+            'ix_product_request_open_product_id', 'product_id',
+            postgresql_where=db.text('fulfilled IS NULL'),
+            sqlite_where=db.text('fulfilled IS NULL'),
+        ),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
     amount = db.Column(db.Float)
     is_agreed = db.Column(db.Boolean, default=False)
     created = db.Column(db.Date, default=date.today)
     fulfilled = db.Column(db.Date)
+
+class JobStatus(Enum):
+    QUEUED = 'в очереди'
+    RUNNING = 'выполняется'
+    DONE = 'готово'
+    FAILED = 'ошибка'
+
+
+class Job(db.Model):
+    # Очередь фоновых задач (jobs.py), выполняет worker.py
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    params = db.Column(db.Text)
+    status = db.Column(db.Enum(JobStatus), nullable=False, default=JobStatus.QUEUED)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    # раньше этого времени задачу не брать (отложенный повтор)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # воркер, взявший задачу, и до какого времени она за ним (продлевается отчётом о прогрессе)
+    locked_by = db.Column(db.String(100))
+    locked_until = db.Column(db.DateTime)
+    progress = db.Column(db.Float, nullable=False, default=0)
+    message = db.Column(db.String(500))
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started = db.Column(db.DateTime)
+    finished = db.Column(db.DateTime)
+
+
+class JobUpload(db.Model):
+    # Загруженный файл задачи (список учеников с паролями): не в Job.params,
+    # удаляется, как только задача завершилась
+    job_id = db.Column(db.Integer, db.ForeignKey('job.id'), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
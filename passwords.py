@@ -0,0 +1,118 @@
+"""
+Хэширование паролей вне потока запроса.
+PBKDF2/scrypt выполняются в ограниченном пуле; если пул и очередь заняты,
+запрос сразу получает PasswordPoolBusy, а не ждёт неограниченно.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Формат как у werkzeug: "scrypt:32768:8:1", "pbkdf2:sha256:600000" и т.п.
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+# Сколько задач может ждать свободного исполнителя сверх работающих
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
+# Сколько секунд ждать места в очереди и результата
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "5"))
+# "thread", "process" или "gevent" (настоящие потоки gevent; для GUNICORN_MODE=gevent)
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+
+
+class PasswordPoolBusy(Exception):
+    pass
+
+
+def _timed(fn, submitted, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, started - submitted, time.perf_counter() - started
+
+
+class PasswordHasher:
+    def __init__(self, method=PASSWORD_HASH_METHOD, workers=PASSWORD_HASH_WORKERS,
+                 queue=PASSWORD_HASH_QUEUE, timeout=PASSWORD_HASH_TIMEOUT,
+                 executor=PASSWORD_HASH_EXECUTOR):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self.executor_kind = executor
+        self._slots = threading.BoundedSemaphore(workers + queue)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._method_prefix = None
+
+        self.stats = {
+            "calls": 0,
+            "rejected": 0,
+            "queue_seconds_total": 0.0,
+            "queue_seconds_max": 0.0,
+            "hash_seconds_total": 0.0,
+            "hash_seconds_max": 0.0,
+        }
+
+    def _get_executor(self):
+        # Пул создаётся лениво и заново после fork (воркеры gunicorn)
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._lock:
+                if self._executor is None or self._executor_pid != pid:
+                    if self.executor_kind == "gevent":
+                        from gevent.threadpool import ThreadPoolExecutor as cls
+                    else:
+                        cls = ProcessPoolExecutor if self.executor_kind == "process" else ThreadPoolExecutor
+                    self._executor = cls(max_workers=self.workers)
+                    self._executor_pid = pid
+        return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.stats["rejected"] += 1
+            raise PasswordPoolBusy()
+
+        try:
+            future = self._get_executor().submit(_timed, fn, time.perf_counter(), *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # место освобождается, только когда задача реально закончилась
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            result, queued, spent = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            with self._lock:
+                self.stats["rejected"] += 1
+            raise PasswordPoolBusy()
+
+        with self._lock:
+            s = self.stats
+            s["calls"] += 1
+            s["queue_seconds_total"] += queued
+            s["queue_seconds_max"] = max(s["queue_seconds_max"], queued)
+            s["hash_seconds_total"] += spent
+            s["hash_seconds_max"] = max(s["hash_seconds_max"], spent)
+        return result
+
+    def hash(self, password: str) -> str:
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, password_hash: str, password: str) -> bool:
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """True, если хэш посчитан с другими параметрами, чем настроены сейчас."""
+        if self._method_prefix is None:
+            # werkzeug может дописать параметры по умолчанию ("pbkdf2" -> "pbkdf2:sha256:N"),
+            # поэтому берём префикс из настоящего хэша
+            self._method_prefix = self.hash("").split("$", 1)[0]
+        return password_hash.split("$", 1)[0] != self._method_prefix
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,162 @@
+"""
+Выдача оплаченных меню на линии раздачи.
+Ученик показывает короткий подписанный код (подходит для QR), повар его сканирует.
+Подпись проверяется без БД, отметка is_taken - один UPDATE по первичному ключу.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import struct
+from datetime import date as _date
+from datetime import timedelta
+
+from flask import Blueprint, g, jsonify, request
+from sqlalchemy import update
+
+from auth import JWT_SECRET, login_required
+from inventory import record_consumption
+from models import db, Menu, PaidMenu, UserRole
+from reports import record_taken
+
+
+pickup_bp = Blueprint("pickup", __name__, url_prefix="/pickup")
+
+PICKUP_SECRET = os.getenv("PICKUP_SECRET", JWT_SECRET).encode("utf-8")
+# Сколько дней после даты меню планшет может досылать офлайн-сканы
+PICKUP_OFFLINE_DAYS = int(os.getenv("PICKUP_OFFLINE_DAYS", "1"))
+MAX_BATCH_CODES = 1000
+
+_EPOCH = _date(2000, 1, 1)
+_SIG_BYTES = 6
+
+
+def make_pickup_code(paid_menu_id: int, menu_date: _date) -> str:
+    """20 символов base32 (A-Z, 2-7): id оплаты, дата меню и обрезанный HMAC."""
+    payload = struct.pack(">IH", paid_menu_id, (menu_date - _EPOCH).days)
+    sig = hmac.new(PICKUP_SECRET, payload, hashlib.sha256).digest()[:_SIG_BYTES]
+    return base64.b32encode(payload + sig).decode("ascii").rstrip("=")
+
+
+def parse_pickup_code(code: str):
+    """Возвращает (paid_menu_id, menu_date) или None, если код испорчен или подделан."""
+    code = code.strip().upper()
+    try:
+        raw = base64.b32decode(code + "=" * (-len(code) % 8))
+    except Exception:
+        return None
+    if len(raw) != 6 + _SIG_BYTES:
+        return None
+
+    payload, sig = raw[:6], raw[6:]
+    expected = hmac.new(PICKUP_SECRET, payload, hashlib.sha256).digest()[:_SIG_BYTES]
+    if not hmac.compare_digest(sig, expected):
+        return None
+
+    paid_menu_id, days = struct.unpack(">IH", payload)
+    return paid_menu_id, _EPOCH + timedelta(days=days)
+
+
+def _mark_taken(ids) -> set:
+    """Одним UPDATE отмечает выданными; возвращает id, которые действительно были не выданы."""
+    if not ids:
+        return set()
+    rows = db.session.execute(
+        update(PaidMenu)
+        .where(PaidMenu.id.in_(ids), PaidMenu.is_taken.is_(False))
+        .values(is_taken=True)
+        .returning(PaidMenu.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    return {r[0] for r in rows}
+
+
+@pickup_bp.get("/code/<int:menu_id>")
+@login_required(UserRole.STUDENT)
+def pickup_code(menu_id: int):
+    row = (
+        db.session.query(PaidMenu.id, PaidMenu.is_taken, Menu.date)
+        .join(Menu, Menu.id == PaidMenu.menu_id)
+        .filter(PaidMenu.user_id == g.principal.id, PaidMenu.menu_id == menu_id)
+        .first()
+    )
+    if row is None:
+        return jsonify({"message": "Меню не оплачено"}), 404
+
+    return jsonify({
+        "menu_id": menu_id,
+        "code": make_pickup_code(row.id, row.date),
+        "is_taken": row.is_taken,
+    })
+
+
+@pickup_bp.post("")
+@login_required(UserRole.COOK, UserRole.ADMIN)
+def pickup():
+    data = request.get_json(silent=True) or {}
+    parsed = parse_pickup_code(str(data.get("code") or ""))
+    if parsed is None:
+        return jsonify({"message": "Неверный код"}), 400
+
+    paid_menu_id, menu_date = parsed
+    if menu_date != _date.today():
+        return jsonify({"message": "Код не на сегодня", "date": menu_date.isoformat()}), 409
+
+    taken = _mark_taken([paid_menu_id])
+    record_consumption(taken)
+    record_taken(taken)
+    db.session.commit()
+    if not taken:
+        return jsonify({"message": "Уже выдано", "paid_menu_id": paid_menu_id}), 409
+
+    return jsonify({"message": "Выдано", "paid_menu_id": paid_menu_id})
+
+
+@pickup_bp.post("/batch")
+@login_required(UserRole.COOK, UserRole.ADMIN)
+def pickup_batch():
+    """
+    Синхронизация офлайн-сканов с планшета: {"codes": [...]}.
+    Все коды отмечаются одним UPDATE, по каждому возвращается статус:
+    taken, already_taken, invalid или expired.
+    """
+    data = request.get_json(silent=True) or {}
+    codes = data.get("codes")
+    if not isinstance(codes, list) or not codes:
+        return jsonify({"message": "Нужен непустой список codes"}), 400
+    if len(codes) > MAX_BATCH_CODES:
+        return jsonify({"message": f"Не больше {MAX_BATCH_CODES} кодов за раз"}), 400
+
+    today = _date.today()
+    results = []
+    ids = []
+    for code in codes:
+        parsed = parse_pickup_code(str(code or ""))
+        if parsed is None:
+            results.append({"code": code, "status": "invalid"})
+            continue
+        paid_menu_id, menu_date = parsed
+        if not (today - timedelta(days=PICKUP_OFFLINE_DAYS) <= menu_date <= today):
+            results.append({"code": code, "status": "expired", "paid_menu_id": paid_menu_id})
+            continue
+        results.append({"code": code, "status": None, "paid_menu_id": paid_menu_id})
+        ids.append(paid_menu_id)
+
+    taken = _mark_taken(set(ids))
+    record_consumption(taken)
+    record_taken(taken)
+    db.session.commit()
+
+    for item in results:
+        if item["status"] is None:
+            if item["paid_menu_id"] in taken:
+                item["status"] = "taken"
+                # повторный скан того же кода в пачке - уже выдано
+                taken.discard(item["paid_menu_id"])
+            else:
+                item["status"] = "already_taken"
+
+    return jsonify({
+        "taken": sum(1 for r in results if r["status"] == "taken"),
+        "results": results,
+    })
@@ -0,0 +1,165 @@
+"""
+Планирование закупок: сколько продуктов нужно на оплаченные меню за период.
+Спрос считается одним агрегирующим SQL-запросом PaidMenu × MenuDishes × Compound.
+"""
+from datetime import date as _date
+
+from flask import Blueprint, jsonify, request
+from sqlalchemy import func
+
+from auth import login_required
+from inventory import stock
+from models import db, Compound, Menu, MenuDishes, PaidMenu, Product, ProductRequest, Unit, UserRole
+
+
+planner_bp = Blueprint("planner", __name__, url_prefix="/planner")
+
+MAX_PLAN_DAYS = 366
+
+# Единицы приводятся к базовой: граммы -> килограммы
+UNIT_BASE = {
+    Unit.GRAMMS: (Unit.KILOGRAMMS, 0.001),
+    Unit.KILOGRAMMS: (Unit.KILOGRAMMS, 1.0),
+    Unit.LITERS: (Unit.LITERS, 1.0),
+    Unit.UNITS: (Unit.UNITS, 1.0),
+}
+
+
+def to_base(amount: float, unit: Unit | None):
+    base, factor = UNIT_BASE.get(unit, (unit, 1.0))
+    return (amount or 0.0) * factor, base
+
+
+def from_base(amount: float, unit: Unit | None) -> float:
+    _, factor = UNIT_BASE.get(unit, (unit, 1.0))
+    return amount / factor
+
+
+def compute_demand(d_from: _date, d_to: _date) -> list:
+    """
+    Спрос на продукты для меню с датами в [d_from, d_to].
+    Количество в Compound задано в единицах продукта на одну порцию.
+    Выданные порции уже списаны в журнале остатков, поэтому считаются только невыданные.
+    """
+    paid = (
+        db.session.query(PaidMenu.menu_id.label("menu_id"), func.count().label("portions"))
+        .join(Menu, Menu.id == PaidMenu.menu_id)
+        .filter(Menu.date >= d_from, Menu.date <= d_to)
+        .filter(PaidMenu.is_taken.is_(False))
+        .group_by(PaidMenu.menu_id)
+        .subquery()
+    )
+    demand = (
+        db.session.query(
+            Compound.product_id.label("product_id"),
+            func.sum(Compound.amount * paid.c.portions).label("demand"),
+        )
+        .select_from(paid)
+        .join(MenuDishes, MenuDishes.menu_id == paid.c.menu_id)
+        .join(Compound, Compound.dish_id == MenuDishes.dish_id)
+        .group_by(Compound.product_id)
+        .subquery()
+    )
+    # уже заказанное, но ещё не поставленное
+    pending = (
+        db.session.query(
+            ProductRequest.product_id.label("product_id"),
+            func.sum(ProductRequest.amount).label("ordered"),
+        )
+        .filter(ProductRequest.fulfilled.is_(None))
+        .group_by(ProductRequest.product_id)
+        .subquery()
+    )
+    rows = (
+        db.session.query(
+            Product.id, Product.name, Product.unit, Product.amount,
+            demand.c.demand, func.coalesce(pending.c.ordered, 0.0),
+        )
+        .join(demand, demand.c.product_id == Product.id)
+        .outerjoin(pending, pending.c.product_id == Product.id)
+        .order_by(Product.name.asc())
+        .all()
+    )
+
+    # остаток по журналу движений: Product.amount обновляется только при сжатии
+    current = stock(product_ids=[r[0] for r in rows]) if rows else {}
+
+    result = []
+    for product_id, name, unit, amount, need, ordered in rows:
+        need_base, base_unit = to_base(need, unit)
+        stock_base, _ = to_base(current.get(product_id, amount), unit)
+        ordered_base, _ = to_base(ordered, unit)
+        shortfall = max(0.0, need_base - stock_base - ordered_base)
+        result.append({
+            "product_id": product_id,
+            "name": name,
+            "unit": base_unit.value if base_unit else None,
+            "unit_code": base_unit.name if base_unit else None,
+            "demand": round(need_base, 3),
+            "stock": round(stock_base, 3),
+            "ordered": round(ordered_base, 3),
+            "shortfall": round(shortfall, 3),
+            "_product_unit": unit,
+        })
+    return result
+
+
+def draft_requests(demand: list) -> list:
+    """Создаёт несогласованные ProductRequest на нехватку (в единицах продукта)."""
+    drafts = [
+        ProductRequest(
+            product_id=item["product_id"],
+            amount=round(from_base(item["shortfall"], item["_product_unit"]), 3),
+            is_agreed=False,
+        )
+        for item in demand if item["shortfall"] > 0
+    ]
+    db.session.add_all(drafts)
+    db.session.commit()
+    return drafts
+
+
+def public_demand(demand: list) -> list:
+    """Потребность без служебных полей (ключи с "_") - для ответа и результата задачи."""
+    return [{k: v for k, v in item.items() if not k.startswith("_")} for item in demand]
+
+
+def _parse_range():
+    try:
+        d_from = _date.fromisoformat((request.args.get("from") or "").strip())
+        d_to = _date.fromisoformat((request.args.get("to") or "").strip())
+    except ValueError:
+        return None, None, ({"message": "Нужны параметры from и to в формате YYYY-MM-DD"}, 400)
+    if d_to < d_from or (d_to - d_from).days + 1 > MAX_PLAN_DAYS:
+        return None, None, ({"message": f"Период от 1 до {MAX_PLAN_DAYS} дней, to не раньше from"}, 400)
+    return d_from, d_to, None
+
+
+@planner_bp.get("/demand")
+@login_required(UserRole.COOK, UserRole.ADMIN)
+def demand():
+    d_from, d_to, error = _parse_range()
+    if error:
+        return error
+
+    return jsonify({
+        "from": d_from.isoformat(),
+        "to": d_to.isoformat(),
+        "products": public_demand(compute_demand(d_from, d_to)),
+    })
+
+
+@planner_bp.post("/demand/draft")
+@login_required(UserRole.COOK, UserRole.ADMIN)
+def demand_draft():
+    d_from, d_to, error = _parse_range()
+    if error:
+        return error
+
+    drafts = draft_requests(compute_demand(d_from, d_to))
+    return jsonify({
+        "created": [
+            {"id": r.id, "product_id": r.product_id, "amount": r.amount}
+            for r in drafts
+        ],
+    }), 201
@@ -0,0 +1,166 @@
+import json
+from datetime import date as _date
+from datetime import timedelta
+
+from flask import Blueprint, g, jsonify, request
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+
+from auth import evict_principal, login_required
+from db_routing import mark_written
+from models import db, Menu, MealType, PaidMenu, PurchaseKey, User, UserRole
+from reports import record_sales
+
+
+purchase_bp = Blueprint("purchase", __name__, url_prefix="/menu")
+
+# Сколько меню можно купить одним запросом
+MAX_MENUS_PER_PURCHASE = 62
+
+
+class PurchaseError(Exception):
+    def __init__(self, message, status, **extra):
+        super().__init__(message)
+        self.body = {"message": message, **extra}
+        self.status = status
+
+
+def _week_menus(week_str: str, types) -> list:
+    try:
+        day = _date.fromisoformat(week_str)
+    except Exception:
+        raise PurchaseError("Неверный формат week. Используй YYYY-MM-DD", 400)
+
+    try:
+        meal_types = [MealType[t] for t in (types or [m.name for m in MealType])]
+    except KeyError:
+        raise PurchaseError("Неизвестный тип меню в types", 400)
+
+    monday = day - timedelta(days=day.weekday())
+    return (
+        Menu.query
+        .filter(Menu.date >= monday, Menu.date <= monday + timedelta(days=4))
+        .filter(Menu.type.in_(meal_types))
+        .order_by(Menu.date.asc(), Menu.id.asc())
+        .all()
+    )
+
+
+def purchase(user_id: int, menus: list) -> dict:
+    """
+    Покупка набора меню одной короткой транзакцией:
+    условный UPDATE баланса (без SELECT ... FOR UPDATE) и пачка INSERT в PaidMenu.
+    Коммит делает вызывающий код.
+    """
+    if not menus:
+        raise PurchaseError("Нет меню для покупки", 404)
+    if len(menus) > MAX_MENUS_PER_PURCHASE:
+        raise PurchaseError(f"За раз можно купить не больше {MAX_MENUS_PER_PURCHASE} меню", 400)
+
+    today = _date.today()
+    if any(m.date is None or m.date < today for m in menus):
+        raise PurchaseError("Нельзя купить меню на прошедшую дату", 400)
+
+    menu_ids = [m.id for m in menus]
+    already = {
+        row[0] for row in
+        db.session.query(PaidMenu.menu_id)
+        .filter(PaidMenu.user_id == user_id, PaidMenu.menu_id.in_(menu_ids))
+    }
+    if already:
+        raise PurchaseError("Меню уже куплено", 409, menu_ids=sorted(already))
+
+    total = sum(m.price or 0 for m in menus)
+
+    # списание только если денег хватает: проверка и запись атомарны в одной команде
+    result = db.session.execute(
+        update(User)
+        .where(User.id == user_id, User.money >= total)
+        .values(money=User.money - total)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        raise PurchaseError("Недостаточно средств", 402, total=total)
+
+    db.session.execute(
+        insert(PaidMenu),
+        [{"user_id": user_id, "menu_id": m.id, "is_taken": False, "price": m.price or 0} for m in menus],
+    )
+    record_sales(menus)
+
+    return {"message": "Покупка успешна", "menu_ids": menu_ids, "total": total}
+
+
+def _idempotent(user_id: int, load_menus):
+    """
+    Выполняет покупку с учётом заголовка Idempotency-Key: повтор запроса
+    с тем же ключом возвращает сохранённый ответ и не списывает деньги повторно.
+    """
+    key = (request.headers.get("Idempotency-Key") or "").strip()
+    if len(key) > 64:
+        return {"message": "Idempotency-Key длиннее 64 символов"}, 400
+
+    def saved_response():
+        saved = db.session.get(PurchaseKey, (user_id, key)) if key else None
+        return (json.loads(saved.response), saved.status_code) if saved is not None else None
+
+    replay = saved_response()
+    if replay:
+        return replay
+
+    try:
+        body, status = purchase(user_id, load_menus()), 201
+        if key:
+            # ключ пишется в той же транзакции, что и списание
+            db.session.add(PurchaseKey(user_id=user_id, key=key, status_code=status, response=json.dumps(body)))
+        db.session.commit()
+    except PurchaseError as e:
+        # ошибки не запоминаем: клиент может пополнить счёт и повторить с тем же ключом
+        db.session.rollback()
+        # но параллельный запрос с тем же ключом мог успеть купить эти меню ("уже куплено")
+        return saved_response() or (e.body, e.status)
+    except IntegrityError:
+        # параллельный запрос с тем же ключом или то же меню уже куплено
+        db.session.rollback()
+        return saved_response() or ({"message": "Меню уже куплено"}, 409)
+
+    evict_principal(user_id)
+    # следующие чтения ученика - из основной БД, пока реплика не догнала покупку
+    mark_written(user_id)
+    return body, status
+
+
+@purchase_bp.post("/<int:menu_id>/buy")
+@login_required(UserRole.STUDENT)
+def buy_menu(menu_id: int):
+    def load_menus():
+        menu = db.session.get(Menu, menu_id)
+        return [menu] if menu else []
+
+    body, status = _idempotent(g.principal.id, load_menus)
+    return jsonify(body), status
+
+
+@purchase_bp.post("/buy")
+@login_required(UserRole.STUDENT)
+def buy_bulk():
+    """
+    Покупка нескольких меню: {"menu_ids": [...]} или
+    {"week": "YYYY-MM-DD", "types": ["BREAKFAST", "LUNCH"]} - будние дни недели.
+    """
+    data = request.get_json(silent=True) or {}
+
+    def load_menus():
+        if data.get("week"):
+            return _week_menus(str(data["week"]), data.get("types"))
+
+        ids = data.get("menu_ids")
+        if not isinstance(ids, list) or not all(isinstance(x, int) for x in ids):
+            raise PurchaseError("Нужен menu_ids (список id) или week", 400)
+        menus = Menu.query.filter(Menu.id.in_(set(ids))).order_by(Menu.date.asc(), Menu.id.asc()).all()
+        if len(menus) != len(set(ids)):
+            raise PurchaseError("Меню не найдено", 404)
+        return menus
+
+    body, status = _idempotent(g.principal.id, load_menus)
+    return jsonify(body), status
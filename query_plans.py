@@ -0,0 +1,88 @@
+"""
+Проверка планов горячих запросов (flask --app app check-plans).
+Запускать на большом наборе (generate-data): если запрос к большой таблице
+читает её целиком вместо индекса, команда завершается с ошибкой.
+"""
+from datetime import date, timedelta
+
+from sqlalchemy import func, select, text
+
+from models import (
+    db, Compound, Feedback, Menu, MenuDishes, MenuStats, PaidMenu, ProductRequest, StockMovement,
+)
+
+
+def hot_queries() -> list:
+    """(название, таблица, которую нельзя читать целиком, запрос)."""
+    today = date.today()
+    return [
+        ("меню на дату", "menu",
+         select(Menu.id).where(Menu.date == today)),
+        ("меню за период", "menu",
+         select(Menu.id).where(Menu.date >= today, Menu.date <= today + timedelta(days=6))),
+        ("покупка ученика", "paid_menu",
+         select(PaidMenu.id).where(PaidMenu.user_id == 1, PaidMenu.menu_id == 1)),
+        ("покупки меню", "paid_menu",
+         select(func.count()).select_from(PaidMenu).where(PaidMenu.menu_id == 1)),
+        ("блюда меню", "menu_dishes",
+         select(MenuDishes.dish_id).where(MenuDishes.menu_id.in_([1, 2]))),
+        ("меню с блюдом", "menu_dishes",
+         select(MenuDishes.menu_id).where(MenuDishes.dish_id == 1)),
+        ("состав блюда", "compound",
+         select(Compound.product_id).where(Compound.dish_id == 1)),
+        ("блюда с продуктом", "compound",
+         select(Compound.dish_id).where(Compound.product_id == 1)),
+        ("отзывы о блюде", "feedback",
+         select(Feedback.id).where(Feedback.dish_id == 1)),
+        ("отзывы о меню", "feedback",
+         select(Feedback.id).where(Feedback.menu_id == 1)),
+        ("заявки за период", "product_request",
+         select(ProductRequest.id).where(ProductRequest.created >= today, ProductRequest.is_agreed.is_(False))),
+        ("незакрытые заявки продукта", "product_request",
+         select(ProductRequest.id).where(ProductRequest.product_id == 1, ProductRequest.fulfilled.is_(None))),
+        ("хвост журнала остатков", "stock_movement",
+         select(func.sum(StockMovement.delta)).where(StockMovement.product_id == 1, StockMovement.id > 0)),
+        ("отчёт за период", "menu_stats",
+         select(MenuStats.menu_id).where(MenuStats.date >= today, MenuStats.date <= today + timedelta(days=6))),
+    ]
+
+
+def _full_scans(conn, sql: str) -> set:
+    """Таблицы, которые план читает целиком."""
+    if conn.dialect.name == "postgresql":
+        plan = conn.execute(text("EXPLAIN (FORMAT JSON) " + sql)).scalar()
+        scans = set()
+        stack = [plan[0]["Plan"]]
+        while stack:
+            node = stack.pop()
+            if node.get("Node Type") == "Seq Scan":
+                scans.add(node.get("Relation Name"))
+            stack.extend(node.get("Plans", ()))
+        return scans
+
+    # SQLite: "SCAN t" - полный проход (в т.ч. по покрывающему индексу), "SEARCH t USING ..." - поиск.
+    # "SEARCH t ... (ANY(col) AND ...)" - skip-scan: обход индекса по всем значениям первой колонки,
+    # т.е. тот же полный проход, если подходящего индекса нет.
+    scans = set()
+    for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql)):
+        detail = row[-1]
+        if detail.startswith("SCAN ") or detail.startswith("SEARCH ") and "ANY(" in detail:
+            scans.add(detail.split()[1])
+    return scans
+
+
+def check_plans(log=print) -> list:
+    """Возвращает список проваленных проверок (пустой - всё хорошо)."""
+    failed = []
+    conn = db.session.connection()
+    conn.execute(text("ANALYZE"))
+
+    for name, table, query in hot_queries():
+        sql = str(query.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+        scans = _full_scans(conn, sql)
+        ok = table not in scans
+        log(f"{'OK  ' if ok else 'FAIL'} {name}: {', '.join(sorted(scans)) or 'без полных проходов'}")
+        if not ok:
+            failed.append(name)
+    db.session.rollback()
+    return failed
@@ -0,0 +1,245 @@
+"""
+Отчёты по продажам, выдаче и невыданным порциям.
+
+Итоги хранятся в MenuStats (одна строка на меню). Покупка и выдача не
+обновляют её, а добавляют строки MenuStatsDelta: иначе параллельные
+покупки одного меню ждали бы блокировку строки итогов до коммита.
+fold() переносит приращения в MenuStats (воркер jobs.py - раз в
+REPORTS_FOLD_SECONDS), а до этого отчёты и экраны поваров складывают
+обе таблицы (totals()). rebuild-reports пересобирает всё по PaidMenu.
+"""
+import os
+from collections import OrderedDict
+from datetime import date as _date
+from datetime import timedelta
+
+from flask import Blueprint, jsonify, request
+from sqlalchemy import case, delete, func, insert, select, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from auth import login_required
+from live import track as track_live
+from models import db, Menu, MenuStats, MenuStatsDelta, PaidMenu, UserRole
+
+
+reports_bp = Blueprint("reports", __name__, url_prefix="/reports")
+
+MAX_REPORT_DAYS = 366 * 5
+REPORTS_FOLD_SECONDS = float(os.getenv("REPORTS_FOLD_SECONDS", "5"))
+REPORTS_FOLD_BATCH = int(os.getenv("REPORTS_FOLD_BATCH", "5000"))
+
+_COUNTERS = ("sold", "taken", "revenue")
+
+
+def _increment(rows: list):
+    """
+    rows: [{"menu_id", "date", "type", "sold", "taken", "revenue"}] - приращения
+    пишутся в MenuStatsDelta одним INSERT, строки итогов не блокируются.
+    """
+    if not rows:
+        return
+    db.session.execute(insert(MenuStatsDelta), rows)
+    # экраны поваров получат новые счётчики после коммита
+    track_live(rows)
+
+
+def record_sales(menus: list):
+    """Покупка по одной порции каждого меню из списка. Коммит делает вызывающий код."""
+    _increment([
+        {"menu_id": m.id, "date": m.date, "type": m.type, "sold": 1, "taken": 0, "revenue": m.price or 0}
+        for m in menus
+    ])
+
+
+def record_taken(paid_menu_ids):
+    """Выдача порций по id оплат. Коммит делает вызывающий код."""
+    if not paid_menu_ids:
+        return
+    counts = (
+        db.session.query(Menu.id, Menu.date, Menu.type, func.count())
+        .join(PaidMenu, PaidMenu.menu_id == Menu.id)
+        .filter(PaidMenu.id.in_(list(paid_menu_ids)))
+        .group_by(Menu.id, Menu.date, Menu.type)
+        .all()
+    )
+    _increment([
+        {"menu_id": menu_id, "date": d, "type": t, "sold": 0, "taken": n, "revenue": 0}
+        for menu_id, d, t, n in counts
+    ])
+
+
+def totals(d_from: _date | None = None, d_to: _date | None = None, menu_ids=None, session=None) -> list:
+    """
+    Итоги по меню с ещё не перенесёнными приращениями:
+    [(menu_id, date, type, sold, taken, revenue)] по дате и menu_id.
+    """
+    parts = []
+    for model in (MenuStats, MenuStatsDelta):
+        where = []
+        if d_from is not None:
+            where.append(model.date >= d_from)
+        if d_to is not None:
+            where.append(model.date <= d_to)
+        if menu_ids is not None:
+            where.append(model.menu_id.in_(list(menu_ids)))
+        parts.append(select(model.menu_id, model.date, model.type, *(getattr(model, c) for c in _COUNTERS)).where(*where))
+    u = union_all(*parts).subquery()
+    return (session or db.session).execute(
+        select(u.c.menu_id, u.c.date, u.c.type, *(func.sum(u.c[c]) for c in _COUNTERS))
+        .group_by(u.c.menu_id, u.c.date, u.c.type)
+        .order_by(u.c.date.asc(), u.c.menu_id.asc())
+    ).all()
+
+
+def _upsert_stats(conn, rows: list):
+    """Прибавляет счётчики к MenuStats одним INSERT ... ON CONFLICT DO UPDATE (PostgreSQL и SQLite)."""
+    if not rows:
+        return
+    make_insert = pg_insert if conn.dialect.name == "postgresql" else sqlite_insert
+    stmt = make_insert(MenuStats)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MenuStats.menu_id],
+        set_={c: getattr(MenuStats, c) + getattr(stmt.excluded, c) for c in _COUNTERS},
+    )
+    conn.execute(stmt, rows)
+
+
+def fold(batch_size=REPORTS_FOLD_BATCH) -> int:
+    """
+    Переносит приращения в MenuStats пачками. Каждая пачка удаляется с
+    RETURNING в той же транзакции, что и прибавляется к итогам: строку,
+    которую удалил параллельный fold(), DELETE не вернёт второй раз, а
+    незакоммиченные приращения останутся до следующего вызова.
+    Возвращает число перенесённых строк.
+    """
+    total = 0
+    while True:
+        batch = select(MenuStatsDelta.id).order_by(MenuStatsDelta.id.asc()).limit(batch_size)
+        rows = db.session.execute(
+            delete(MenuStatsDelta)
+            .where(MenuStatsDelta.id.in_(batch.scalar_subquery()))
+            .returning(MenuStatsDelta.menu_id, MenuStatsDelta.date, MenuStatsDelta.type,
+                       *(getattr(MenuStatsDelta, c) for c in _COUNTERS))
+            .execution_options(synchronize_session=False)
+        ).all()
+        merged = {}
+        for menu_id, d, t, *counts in rows:
+            item = merged.setdefault(menu_id, {"menu_id": menu_id, "date": d, "type": t, **dict.fromkeys(_COUNTERS, 0)})
+            for c, n in zip(_COUNTERS, counts):
+                item[c] += n
+        # по menu_id: параллельные fold() блокируют строки итогов в одном порядке
+        _upsert_stats(db.session.connection(), [merged[k] for k in sorted(merged)])
+        db.session.commit()
+        total += len(rows)
+        if len(rows) < batch_size:
+            return total
+
+
+def rebuild_stats(conn, d_from: _date | None = None, d_to: _date | None = None) -> int:
+    """Пересобирает MenuStats по PaidMenu (для всего периода или [d_from, d_to])."""
+    menu_filter = []
+    if d_from is not None:
+        menu_filter.append(Menu.date >= d_from)
+    if d_to is not None:
+        menu_filter.append(Menu.date <= d_to)
+
+    menu_ids = [MenuStats.menu_id.in_(select(Menu.id).where(*menu_filter))] if menu_filter else []
+    conn.execute(delete(MenuStats).where(*menu_ids))
+    # приращения уже учтены в PaidMenu
+    delta_ids = [MenuStatsDelta.menu_id.in_(select(Menu.id).where(*menu_filter))] if menu_filter else []
+    conn.execute(delete(MenuStatsDelta).where(*delta_ids))
+
+    source = (
+        select(
+            Menu.id, Menu.date, Menu.type,
+            func.count(PaidMenu.id),
+            func.sum(case((PaidMenu.is_taken.is_(True), 1), else_=0)),
+            # выручка - по суммам, списанным при покупке, а не по текущей цене меню
+            func.sum(PaidMenu.price),
+        )
+        .join(PaidMenu, PaidMenu.menu_id == Menu.id)
+        .where(*menu_filter)
+        .group_by(Menu.id, Menu.date, Menu.type)
+    )
+    result = conn.execute(
+        insert(MenuStats).from_select(["menu_id", "date", "type", "sold", "taken", "revenue"], source)
+    )
+    return result.rowcount
+
+
+def rebuild(d_from: _date | None = None, d_to: _date | None = None) -> int:
+    n = rebuild_stats(db.session.connection(), d_from, d_to)
+    db.session.commit()
+    return n
+
+
+def _row(sold, taken, revenue, no_show, waste, past):
+    return {
+        "sold": sold,
+        "taken": taken,
+        # невыданные порции считаются только за прошедшие дни
+        "no_show": no_show if past else 0,
+        "revenue": revenue,
+        "waste_revenue": waste if past else 0,
+    }
+
+
+def daily(d_from: _date, d_to: _date) -> list:
+    today = _date.today()
+    days = OrderedDict()
+    for _, d, t, sold, taken, revenue in totals(d_from, d_to):
+        no_show = sold - taken
+        waste = revenue * no_show // sold if sold else 0
+        item = _row(sold, taken, revenue, no_show, waste, d < today)
+
+        day = days.setdefault(d, {"date": d.isoformat(), "menus": [], **_row(0, 0, 0, 0, 0, False)})
+        day["menus"].append({
+            "type": t.value if t else None,
+            "type_code": t.name if t else None,
+            **item,
+        })
+        for k, v in item.items():
+            day[k] += v
+    return list(days.values())
+
+
+def weekly(d_from: _date, d_to: _date) -> list:
+    weeks = OrderedDict()
+    for day in daily(d_from, d_to):
+        d = _date.fromisoformat(day["date"])
+        monday = (d - timedelta(days=d.weekday())).isoformat()
+        week = weeks.setdefault(monday, {"week": monday, **_row(0, 0, 0, 0, 0, False)})
+        for k in ("sold", "taken", "no_show", "revenue", "waste_revenue"):
+            week[k] += day[k]
+    return list(weeks.values())
+
+
+def parse_range():
+    """(from, to, None) из параметров запроса или (None, None, ответ 400)."""
+    try:
+        d_from = _date.fromisoformat((request.args.get("from") or "").strip())
+        d_to = _date.fromisoformat((request.args.get("to") or "").strip())
+    except ValueError:
+        return None, None, ({"message": "Нужны параметры from и to в формате YYYY-MM-DD"}, 400)
+    if d_to < d_from or (d_to - d_from).days + 1 > MAX_REPORT_DAYS:
+        return None, None, ({"message": f"Период от 1 до {MAX_REPORT_DAYS} дней, to не раньше from"}, 400)
+    return d_from, d_to, None
+
+
+@reports_bp.get("/daily")
+@login_required(UserRole.ADMIN)
+def daily_report():
+    d_from, d_to, error = parse_range()
+    if error:
+        return error
+    return jsonify({"from": d_from.isoformat(), "to": d_to.isoformat(), "days": daily(d_from, d_to)})
+
+
+@reports_bp.get("/weekly")
+@login_required(UserRole.ADMIN)
+def weekly_report():
+    d_from, d_to, error = parse_range()
+    if error:
+        return error
+    return jsonify({"from": d_from.isoformat(), "to": d_to.isoformat(), "weeks": weekly(d_from, d_to)})
@@ -0,0 +1,228 @@
+"""
+Массовая загрузка учеников из CSV или NDJSON (POST /roster/import, flask --app app import-roster).
+
+Строка: login, password, необязательные money, allergies и disliked (названия
+из справочников Allergy и FoodType; в CSV - через ";", в NDJSON - списком).
+Строки обрабатываются пачками: занятые логины проверяются одним запросом
+на пачку, пароли хэшируются в пуле процессов, пользователи, аллергии и
+нелюбимые типы вставляются пачечными INSERT. Наружу идут только ошибки по
+строкам и итоговая сводка с пропускной способностью.
+"""
+import csv
+import io
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import Blueprint, Response, g, jsonify, request, stream_with_context
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+
+from auth import login_required
+from models import db, Allergy, FoodType, User, UserAllergy, UserDisliked, UserRole
+from passwords import hasher
+
+ROSTER_BATCH_SIZE = int(os.getenv("ROSTER_BATCH_SIZE", "500"))
+ROSTER_HASH_WORKERS = int(os.getenv("ROSTER_HASH_WORKERS", str(os.cpu_count() or 2)))
+FORMATS = ("csv", "ndjson")
+
+
+roster_bp = Blueprint("roster", __name__, url_prefix="/roster")
+
+
+def _names(value) -> list:
+    if value is None or value == "":
+        return []
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(";") if v.strip()]
+    if isinstance(value, list):
+        return [str(v).strip() for v in value if str(v).strip()]
+    raise ValueError("allergies и disliked: список или строка через ;")
+
+
+def parse(stream, fmt: str):
+    """Генератор (номер строки, dict или текст ошибки)."""
+    if fmt == "csv":
+        # номер строки 1 - заголовок
+        for line, row in enumerate(csv.DictReader(stream), start=2):
+            yield line, row
+        return
+
+    for line, text in enumerate(stream, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError:
+            yield line, "Строка не является JSON"
+            continue
+        yield line, row if isinstance(row, dict) else "Ожидается JSON-объект"
+
+
+def _validate(row: dict, allergies: dict, food_types: dict) -> dict:
+    login = str(row.get("login") or "").strip().lower()
+    password = str(row.get("password") or "")
+    if not login or not password:
+        raise ValueError("login и password обязательны")
+    if len(login) > 120:
+        raise ValueError("login длиннее 120 символов")
+    try:
+        money = int(row.get("money") or 0)
+    except (TypeError, ValueError):
+        raise ValueError("money должно быть целым числом")
+
+    allergy_names = _names(row.get("allergies"))
+    disliked_names = _names(row.get("disliked"))
+    unknown = [n for n in allergy_names if n not in allergies] + [n for n in disliked_names if n not in food_types]
+    if unknown:
+        raise ValueError(f"Неизвестные аллергии или типы блюд: {', '.join(unknown)}")
+
+    return {
+        "login": login,
+        "password": password,
+        "money": money,
+        "allergy_ids": sorted({allergies[n] for n in allergy_names}),
+        "type_ids": sorted({food_types[n] for n in disliked_names}),
+    }
+
+
+def _hash_all(pool, passwords: list) -> list:
+    chunksize = max(1, len(passwords) // (ROSTER_HASH_WORKERS * 4))
+    return list(pool.map(generate_password_hash, passwords, [hasher.method] * len(passwords), chunksize=chunksize))
+
+
+def _insert_batch(batch: list) -> dict:
+    """Вставляет пачку. Возвращает {login: id}. Коммит - здесь же."""
+    created = db.session.execute(
+        insert(User).returning(User.id, User.login),
+        [
+            {"login": r["login"], "password_hash": r["password_hash"], "role": UserRole.STUDENT, "money": r["money"]}
+            for r in batch
+        ],
+    ).all()
+    ids = {login: user_id for user_id, login in created}
+
+    allergy_rows = [{"user_id": ids[r["login"]], "allergy_id": a} for r in batch for a in r["allergy_ids"]]
+    type_rows = [{"user_id": ids[r["login"]], "type_id": t} for r in batch for t in r["type_ids"]]
+    if allergy_rows:
+        db.session.execute(insert(UserAllergy), allergy_rows)
+    if type_rows:
+        db.session.execute(insert(UserDisliked), type_rows)
+    db.session.commit()
+    return ids
+
+
+def import_roster(rows, batch_size=ROSTER_BATCH_SIZE, on_batch=None):
+    """
+    rows - результат parse(). Генератор словарей: {"line", "login", "error"} по
+    каждой отклонённой строке и в конце {"summary": {...}}.
+    on_batch(stats) вызывается после каждой записанной пачки (прогресс задачи).
+    """
+    started = time.perf_counter()
+    stats = {"rows": 0, "created": 0, "errors": 0, "hash_seconds": 0.0, "insert_seconds": 0.0}
+    allergies = dict(db.session.execute(select(Allergy.name, Allergy.id)).all())
+    food_types = dict(db.session.execute(select(FoodType.name, FoodType.id)).all())
+    seen = set()
+
+    def error(line, login, message):
+        stats["errors"] += 1
+        return {"line": line, "login": login, "error": message}
+
+    def flush(batch):
+        # занятые логины - одним запросом на пачку
+        logins = [r["login"] for r in batch]
+        taken = set(db.session.execute(select(User.login).where(User.login.in_(logins))).scalars())
+        fresh = []
+        for r in batch:
+            if r["login"] in taken:
+                yield error(r["line"], r["login"], "Пользователь уже существует")
+            else:
+                fresh.append(r)
+        # соединение не держим, пока считаются хэши
+        db.session.rollback()
+        if not fresh:
+            return
+
+        t0 = time.perf_counter()
+        for r, password_hash in zip(fresh, _hash_all(pool, [r.pop("password") for r in fresh])):
+            r["password_hash"] = password_hash
+        stats["hash_seconds"] += time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        try:
+            _insert_batch(fresh)
+            stats["created"] += len(fresh)
+        except IntegrityError:
+            # логин заняли параллельно (register или второй импорт): вставляем по одной
+            db.session.rollback()
+            for r in fresh:
+                try:
+                    _insert_batch([r])
+                    stats["created"] += 1
+                except IntegrityError:
+                    db.session.rollback()
+                    yield error(r["line"], r["login"], "Пользователь уже существует")
+        stats["insert_seconds"] += time.perf_counter() - t0
+        if on_batch is not None:
+            on_batch(stats)
+
+    # процессы запускаются через forkserver: fork из многопоточного воркера небезопасен
+    pool = ProcessPoolExecutor(max_workers=ROSTER_HASH_WORKERS, mp_context=multiprocessing.get_context("forkserver"))
+    try:
+        batch = []
+        for line, row in rows:
+            stats["rows"] += 1
+            if isinstance(row, str):
+                yield error(line, None, row)
+                continue
+            try:
+                item = _validate(row, allergies, food_types)
+            except ValueError as e:
+                yield error(line, str(row.get("login") or "") or None, str(e))
+                continue
+            if item["login"] in seen:
+                yield error(line, item["login"], "Логин повторяется в файле")
+                continue
+            seen.add(item["login"])
+            item["line"] = line
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield from flush(batch)
+                batch = []
+        if batch:
+            yield from flush(batch)
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+    seconds = time.perf_counter() - started
+    stats["seconds"] = round(seconds, 3)
+    stats["rows_per_sec"] = round(stats["rows"] / seconds) if seconds else stats["rows"]
+    stats["hash_seconds"] = round(stats["hash_seconds"], 3)
+    stats["insert_seconds"] = round(stats["insert_seconds"], 3)
+    yield {"summary": stats}
+
+
+@roster_bp.post("/import")
+@login_required(UserRole.ADMIN)
+def import_view():
+    fmt = (request.args.get("format") or "csv").strip()
+    if fmt not in FORMATS:
+        return jsonify({"message": "format должен быть csv или ndjson"}), 400
+
+    # список класса - единицы мегабайт, читаем целиком; результат отдаётся по мере обработки
+    text = request.get_data(as_text=True)
+    if not text.strip():
+        return jsonify({"message": "Пустой файл"}), 400
+
+    if request.args.get("async") == "1":
+        # большой список - в фоновую задачу, результат по адресу из Location
+        import jobs
+
+        return jobs.accepted(jobs.enqueue("import-roster", {"format": fmt}, g.principal.id, upload=text))
+
+    results = import_roster(parse(io.StringIO(text, newline=""), fmt))
+    lines = (json.dumps(r, ensure_ascii=False) + "\n" for r in results)
+    return Response(stream_with_context(lines), mimetype="application/x-ndjson")
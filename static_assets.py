@@ -0,0 +1,203 @@
+"""
+Статика из public/: сборка (flask --app app build-static) и раздача.
+
+Сборка копирует файлы в STATIC_BUILD_DIR с хэшем содержимого в имени
+(styles.css -> styles.3f2a1b9c0d1e.css), рядом кладёт сжатые .gz и .br
+(если установлен пакет brotli) и переписывает ссылки в HTML и CSS на новые
+имена. Итог описывает manifest.json.
+
+При старте manifest загружается в память, и запросы отдаются без обращения
+к файловой системе за поиском: хэшированные имена - с Cache-Control immutable,
+HTML и старые имена - с no-cache и ETag. Кодировка выбирается по Accept-Encoding,
+файл отдаётся через send_file (в gunicorn это sendfile без копирования в Python).
+Без сборки всё работает как раньше, через send_from_directory.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+
+from flask import request, send_file, send_from_directory
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+PUBLIC_DIR = os.getenv("PUBLIC_DIR", os.path.join(_HERE, "public"))
+STATIC_BUILD_DIR = os.getenv("STATIC_BUILD_DIR", os.path.join(_HERE, "static_build"))
+MANIFEST = "manifest.json"
+
+# уже сжатые форматы (png, jpg, woff2...) повторно не сжимаются
+COMPRESSIBLE = {".css", ".js", ".mjs", ".html", ".svg", ".json", ".txt", ".xml", ".map", ".ico", ".ttf", ".otf"}
+# HTML - точки входа (/, /login), их имена не меняются
+NOT_HASHED = {".html"}
+# в каком порядке обрабатывать: сначала то, на что ссылаются, потом то, что ссылается
+REWRITE_ORDER = {".css": 1, ".html": 2}
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+_HTML_REF = re.compile(r"""(\b(?:src|href)\s*=\s*["'])([^"'#?]+)""", re.IGNORECASE)
+_CSS_REF = re.compile(r"""(url\(\s*["']?)([^"')#?]+)""", re.IGNORECASE)
+
+
+# --- сборка ---
+
+def _hashed_name(rel: str, digest: str) -> str:
+    root, ext = posixpath.splitext(rel)
+    return f"{root}.{digest[:12]}{ext}"
+
+
+def _rewrite(text: str, rel: str, pattern, names: dict) -> str:
+    base = posixpath.dirname(rel)
+
+    def sub(m):
+        ref = m.group(2)
+        if "://" in ref or ref.startswith(("data:", "//", "mailto:")):
+            return m.group(0)
+        target = posixpath.normpath(ref.lstrip("/") if ref.startswith("/") else posixpath.join(base, ref))
+        hashed = names.get(target)
+        if hashed is None:
+            return m.group(0)
+        # хэшированный файл лежит в том же каталоге: меняем только имя
+        return m.group(1) + posixpath.join(posixpath.dirname(ref), posixpath.basename(hashed))
+
+    return pattern.sub(sub, text)
+
+
+def _compress(path: str, data: bytes) -> dict:
+    """Пишет .gz и .br рядом с файлом, если они меньше оригинала. Возвращает {кодировка: имя}."""
+    variants = {}
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz) < len(data):
+        with open(path + ".gz", "wb") as f:
+            f.write(gz)
+        variants["gzip"] = os.path.basename(path) + ".gz"
+
+    try:
+        import brotli
+    except ImportError:
+        return variants
+    br = brotli.compress(data, quality=11)
+    if len(br) < len(data):
+        with open(path + ".br", "wb") as f:
+            f.write(br)
+        variants["br"] = os.path.basename(path) + ".br"
+    return variants
+
+
+def build(src: str = PUBLIC_DIR, out: str = STATIC_BUILD_DIR, log=print) -> dict:
+    """Собирает src в out. Возвращает manifest: {исходный путь: описание файла}."""
+    if not os.path.isdir(src):
+        log(f"Каталог {src} не найден, собирать нечего")
+        return {}
+
+    files = []
+    for root, _, names in os.walk(src):
+        for name in names:
+            rel = os.path.relpath(os.path.join(root, name), src).replace(os.sep, "/")
+            files.append(rel)
+    files.sort(key=lambda rel: (REWRITE_ORDER.get(posixpath.splitext(rel)[1].lower(), 0), rel))
+
+    if os.path.isdir(out):
+        shutil.rmtree(out)
+    os.makedirs(out)
+
+    names = {}
+    manifest = {}
+    for rel in files:
+        ext = posixpath.splitext(rel)[1].lower()
+        with open(os.path.join(src, rel), "rb") as f:
+            data = f.read()
+        if ext == ".css":
+            data = _rewrite(data.decode("utf-8"), rel, _CSS_REF, names).encode("utf-8")
+        elif ext == ".html":
+            data = _rewrite(data.decode("utf-8"), rel, _HTML_REF, names).encode("utf-8")
+
+        digest = hashlib.sha256(data).hexdigest()
+        hashed = rel if ext in NOT_HASHED else _hashed_name(rel, digest)
+        names[rel] = hashed
+
+        path = os.path.join(out, hashed)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+        manifest[rel] = {
+            "file": hashed,
+            "etag": digest[:32],
+            "size": len(data),
+            "encodings": _compress(path, data) if ext in COMPRESSIBLE else {},
+        }
+
+    with open(os.path.join(out, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+
+    compressed = sum(1 for item in manifest.values() if item["encodings"])
+    log(f"Собрано файлов: {len(manifest)}, сжато: {compressed}, каталог {out}")
+    return manifest
+
+
+# --- раздача ---
+
+class AssetIndex:
+    def __init__(self):
+        self.root = None
+        self._entries = {}  # URL-путь -> (файл, ETag, тип, {кодировка: файл}, Cache-Control)
+
+    def load(self, root: str = STATIC_BUILD_DIR) -> int:
+        path = os.path.join(root, MANIFEST)
+        if not os.path.isfile(path):
+            self.root, self._entries = None, {}
+            return 0
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        entries = {}
+        for rel, item in manifest.items():
+            mimetype = mimetypes.guess_type(rel)[0] or "application/octet-stream"
+            folder = posixpath.dirname(item["file"])
+            encodings = {enc: posixpath.join(folder, name) for enc, name in item["encodings"].items()}
+            hashed = item["file"] != rel
+            entries[item["file"]] = (item["file"], item["etag"], mimetype, encodings, IMMUTABLE if hashed else REVALIDATE)
+            if hashed:
+                # старое имя тоже работает, но кэшируется только с проверкой
+                entries[rel] = (item["file"], item["etag"], mimetype, encodings, REVALIDATE)
+
+        self.root = os.path.abspath(root)
+        self._entries = entries
+        return len(manifest)
+
+    def _encoding(self, encodings: dict):
+        accept = request.accept_encodings
+        best, best_q = None, 0
+        for enc in ("br", "gzip"):
+            if enc in encodings:
+                q = accept.quality(enc)
+                if q > best_q:
+                    best, best_q = enc, q
+        return best
+
+    def serve(self, path: str):
+        entry = self._entries.get(path) if self.root else None
+        if entry is None:
+            return send_from_directory(PUBLIC_DIR, path)
+
+        file, etag, mimetype, encodings, cache_control = entry
+        enc = self._encoding(encodings)
+        resp = send_file(
+            os.path.join(self.root, encodings[enc] if enc else file),
+            mimetype=mimetype,
+            etag=f"{etag}-{enc}" if enc else etag,
+            conditional=True,
+        )
+        if enc:
+            resp.headers["Content-Encoding"] = enc
+        if encodings:
+            resp.vary.add("Accept-Encoding")
+        resp.headers["Cache-Control"] = cache_control
+        return resp
+
+
+assets = AssetIndex()
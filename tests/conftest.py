@@ -0,0 +1,69 @@
+"""
+Общие фикстуры. БД - временный файл SQLite или TEST_DATABASE_URL
+(например, PostgreSQL): схема создаётся миграциями, данные - seed_test_data
+с сегодняшнего дня, чтобы меню можно было покупать.
+"""
+import os
+import tempfile
+from datetime import date
+
+import pytest
+
+_DB_FILE = None
+if os.getenv("TEST_DATABASE_URL"):
+    os.environ["DATABASE_URL"] = os.environ["TEST_DATABASE_URL"]
+else:
+    _fd, _DB_FILE = tempfile.mkstemp(prefix="canteen-test-", suffix=".db")
+    os.close(_fd)
+    os.environ["DATABASE_URL"] = f"sqlite:///{_DB_FILE}"
+# app.py читает настройки при импорте: без реплики и файлов метрик
+os.environ["DATABASE_REPLICA_URL"] = ""
+os.environ["METRICS_DIR"] = ""
+os.environ.setdefault("JWT_SECRET", "test-secret-that-is-long-enough-for-hs256")
+
+SEED_DAYS = 14
+
+
+@pytest.fixture(scope="session")
+def app():
+    import migrations
+    from app import app as flask_app
+    from models import db
+
+    with flask_app.app_context():
+        migrations.migrate(db.engine, log=lambda *args: None)
+    yield flask_app
+    if _DB_FILE:
+        os.unlink(_DB_FILE)
+
+
+@pytest.fixture(scope="module")
+def seeded(app):
+    """Свежие тестовые данные на каждый модуль тестов."""
+    import auth
+    import feedback
+    import fill
+    import reports
+    from menu_cache import menu_cache
+
+    with app.app_context():
+        fill.seed_test_data(date.today(), days=SEED_DAYS)
+        reports.rebuild()
+        feedback.rebuild()
+    menu_cache.clear()
+    auth.clear_caches()
+    return app
+
+
+@pytest.fixture
+def client(seeded):
+    return seeded.test_client()
+
+
+def auth_header(app, login: str) -> dict:
+    from auth import make_token
+    from models import User
+
+    with app.app_context():
+        user = User.query.filter_by(login=login).one()
+        return {"Authorization": "Bearer " + make_token(user)}
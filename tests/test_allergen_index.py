@@ -0,0 +1,65 @@
+"""Индекс аллергенов: блюда и рецептуры, изменённые другим процессом."""
+from datetime import date, timedelta
+
+from sqlalchemy import insert, select
+
+from allergen_index import DishIndex
+from conftest import auth_header
+from menu_cache import LocalBackend, menu_cache
+from models import db, Allergy, Compound, Dish, Menu, MenuDishes, Product, Unit
+
+DAY = date.today() + timedelta(days=3)
+
+
+def _id(model, name):
+    return db.session.execute(select(model.id).where(model.name == name)).scalar_one()
+
+
+def _other_process(*statements):
+    """Запись мимо сессии приложения: слушатели after_commit этого процесса её не видят."""
+    with db.engine.begin() as conn:
+        for stmt, rows in statements:
+            conn.execute(stmt, rows)
+
+
+def test_new_dish_from_other_process_is_not_safe(seeded, client):
+    headers = auth_header(seeded, "student2@example.com")  # аллергия на лактозу
+    url = f"/menu?date={DAY.isoformat()}&for_user=annotate"
+    assert client.get(url, headers=headers).status_code == 200  # индекс загружен
+
+    with seeded.app_context():
+        _other_process((insert(Dish), [{"name": "Молочный коктейль", "amount": 200, "unit": Unit.GRAMMS}]))
+        dish_id = _id(Dish, "Молочный коктейль")
+        menu_id = db.session.execute(select(Menu.id).where(Menu.date == DAY).limit(1)).scalar_one()
+        _other_process(
+            (insert(Compound), [{"dish_id": dish_id, "product_id": _id(Product, "Молоко"), "amount": 0.2}]),
+            (insert(MenuDishes), [{"menu_id": menu_id, "dish_id": dish_id}]),
+        )
+        lactose = _id(Allergy, "Лактоза")
+    menu_cache.clear()
+
+    dishes = [d for m in client.get(url, headers=headers).get_json()["menus"] for d in m["dishes"]]
+    shake = next(d for d in dishes if d["id"] == dish_id)
+    assert shake["allergens"] == [lactose]
+    assert shake["safe"] is False
+
+    filtered = client.get(url.replace("annotate", "filter"), headers=headers).get_json()
+    assert dish_id not in {d["id"] for m in filtered["menus"] for d in m["dishes"]}
+
+
+def test_recipe_change_is_seen_by_other_worker(seeded):
+    backend = LocalBackend()
+    worker_a, worker_b = DishIndex(backend=backend), DishIndex(backend=backend)
+    with seeded.app_context():
+        dish_id, lactose = _id(Dish, "Гречка с курицей"), _id(Allergy, "Лактоза")
+        for index in (worker_a, worker_b):
+            index.sync()
+            assert not index.masks(dish_id)[0] & (1 << lactose)
+
+        _other_process((insert(Compound), [{"dish_id": dish_id, "product_id": _id(Product, "Сыр"),
+                                            "amount": 0.01}]))
+        worker_a.publish([dish_id])  # так делает after_commit воркера, изменившего рецептуру
+        assert worker_a.masks(dish_id)[0] & (1 << lactose)
+
+        worker_b.sync()
+        assert worker_b.masks(dish_id)[0] & (1 << lactose)
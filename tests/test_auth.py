@@ -0,0 +1,110 @@
+"""Отзыв токенов виден всем воркерам через общее хранилище."""
+import time
+
+from auth import Revocations
+from conftest import auth_header
+from menu_cache import LocalBackend
+
+
+def _claims(user_id=1, iat=None):
+    return {"sub": str(user_id), "iat": int(time.time()) if iat is None else iat}
+
+
+def test_logout_is_seen_by_other_worker():
+    backend = LocalBackend()
+    worker_a, worker_b = Revocations(backend, read_ttl=0.05), Revocations(backend, read_ttl=0.05)
+
+    assert not worker_b.is_revoked("t1", _claims())  # воркер B успел закэшировать "не отозван"
+    worker_a.revoke("t1", expires_in=60)
+    assert worker_a.is_revoked("t1", _claims())
+
+    time.sleep(0.1)
+    assert worker_b.is_revoked("t1", _claims())
+    assert Revocations(backend).is_revoked("t1", _claims())
+
+
+def test_revoke_user_is_seen_by_other_worker():
+    backend = LocalBackend()
+    worker_a, worker_b = Revocations(backend), Revocations(backend)
+    issued = int(time.time()) - 10
+
+    worker_a.revoke_user(7)
+    assert worker_b.is_revoked("old", _claims(7, iat=issued))
+    assert not worker_b.is_revoked("other-user", _claims(8, iat=issued))
+    assert not worker_b.is_revoked("new", _claims(7, iat=int(time.time()) + 5))
+
+
+def test_entries_expire_with_token():
+    backend = LocalBackend()
+    Revocations(backend, lifetime=0.05).revoke("t1", expires_in=0.05)
+    time.sleep(0.1)
+    assert backend.get(Revocations._token_key("t1")) is None
+
+
+def test_logout_endpoint(seeded, client):
+    headers = auth_header(seeded, "student1@example.com")
+    assert client.get("/me", headers=headers).status_code == 200
+    assert client.post("/logout", headers=headers).status_code == 200
+    resp = client.get("/me", headers=headers)
+    assert resp.status_code == 401
+    assert resp.get_json()["message"] == "Токен отозван"
+
+
+def _student(app, login):
+    from models import db, User, UserRole
+
+    with app.app_context():
+        user = User(login=login, password_hash="-", role=UserRole.STUDENT, money=0)
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+def _update_user(app, user_id, **values):
+    from models import db, User
+
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        for name, value in values.items():
+            setattr(user, name, value)
+        db.session.commit()
+
+
+def test_role_change_revokes_tokens(seeded, client):
+    from models import UserRole
+
+    user_id = _student(seeded, "auth-role@example.com")
+    old = auth_header(seeded, "auth-role@example.com")
+    assert client.get("/me", headers=old).status_code == 200
+
+    _update_user(seeded, user_id, role=UserRole.COOK)
+    assert client.get("/me", headers=old).status_code == 401
+    # токен, выданный сразу после смены, действителен
+    new = auth_header(seeded, "auth-role@example.com")
+    assert client.get("/me", headers=new).get_json()["role"] == UserRole.COOK.value
+
+
+def test_password_change_revokes_tokens(seeded, client):
+    from passwords import hasher
+
+    user_id = _student(seeded, "auth-password@example.com")
+    old = auth_header(seeded, "auth-password@example.com")
+    _update_user(seeded, user_id, money=5)  # прочие изменения токены не трогают
+    assert client.get("/me", headers=old).status_code == 200
+
+    _update_user(seeded, user_id, password_hash=hasher.hash("new-password"))
+    assert client.get("/me", headers=old).status_code == 401
+
+
+def test_rehash_on_login_keeps_tokens(seeded, client, monkeypatch):
+    from passwords import hasher
+
+    user_id = _student(seeded, "auth-rehash@example.com")
+    _update_user(seeded, user_id, password_hash=hasher.hash("secret"))
+    old = auth_header(seeded, "auth-rehash@example.com")
+
+    monkeypatch.setattr(hasher, "needs_rehash", lambda password_hash: True)
+    resp = client.post("/login", json={"login": "auth-rehash@example.com", "password": "secret"})
+    assert resp.status_code == 200
+    assert client.get("/me", headers=old).status_code == 200
+    assert client.get("/me", headers={"Authorization": "Bearer " + resp.get_json()["token"]}).status_code == 200
@@ -0,0 +1,59 @@
+"""
+Чтение с реплики: меню, которое кладётся в кэш после сброса, читается из
+основной БД, а не с отстающей реплики (иначе старое меню вернулось бы в кэш).
+"""
+import os
+import sqlite3
+import tempfile
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+
+import db_routing
+from models import db, Menu, MealType
+
+MONDAY = date.today() + timedelta(days=7 - date.today().weekday())
+
+
+@pytest.fixture
+def stale_replica(seeded, monkeypatch):
+    """Копия основной БД на текущий момент - реплика, которая дальше не догоняет."""
+    with seeded.app_context():
+        if db.engine.dialect.name != "sqlite":
+            pytest.skip("копия реплики делается только для SQLite")
+        fd, path = tempfile.mkstemp(prefix="canteen-replica-", suffix=".db")
+        os.close(fd)
+        src, dst = sqlite3.connect(db.engine.url.database), sqlite3.connect(path)
+        src.backup(dst)
+        src.close()
+        dst.close()
+
+        engine = create_engine(f"sqlite:///{path}")
+        monkeypatch.setitem(db.engines, db_routing.REPLICA_BIND, engine)
+    monkeypatch.setattr(db_routing, "DATABASE_REPLICA_URL", f"sqlite:///{path}")
+    yield
+    engine.dispose()
+    os.unlink(path)
+
+
+def _prices(resp) -> dict:
+    assert resp.status_code == 200
+    data = resp.get_json()
+    menus = data["menus"] if "menus" in data else [m for day in data["days"] for m in day["menus"]]
+    return {m["id"]: m["price"] for m in menus}
+
+
+def test_cache_refill_reads_primary(client, seeded, stale_replica):
+    with seeded.app_context():
+        menu = Menu.query.filter_by(date=MONDAY, type=MealType.BREAKFAST).first()
+        menu_id, old_price = menu.id, menu.price
+        menu.price = old_price + 7
+        db.session.commit()  # сбрасывает кэш даты
+
+    # реплика действительно отстаёт: некэшируемый период читается с неё
+    assert _prices(client.get(f"/menu/range?from={MONDAY}&to={MONDAY}"))[menu_id] == old_price
+
+    assert _prices(client.get(f"/menu/{MONDAY}"))[menu_id] == old_price + 7
+    # и в кэше осталось новое меню
+    assert _prices(client.get(f"/menu?date={MONDAY}"))[menu_id] == old_price + 7
@@ -0,0 +1,91 @@
+"""Журнал остатков: сжатие не теряет движения из параллельных транзакций."""
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import insert, select
+
+import inventory
+from models import db, MovementReason, Product, StockMovement
+
+
+def _product_id(name):
+    return db.session.execute(select(Product.id).where(Product.name == name)).scalar_one()
+
+
+def test_compact_waits_for_uncommitted_movement(seeded):
+    with seeded.app_context():
+        product_id = _product_id("Картофель")
+        inventory.compact()
+        before = inventory.stock(product_ids=[product_id])[product_id]
+
+        # выдача в другой транзакции: строка вставлена, но не закоммичена
+        conn = db.engine.connect()
+        trans = conn.begin()
+        conn.execute(insert(StockMovement), [{
+            "product_id": product_id, "delta": -1.5, "reason": MovementReason.CONSUMPTION, "created": datetime.utcnow(),
+        }])
+
+    result = {}
+
+    def run_compact():
+        with seeded.app_context():
+            result["snapshots"] = inventory.compact()
+            result["finished"] = time.monotonic()
+
+    compactor = threading.Thread(target=run_compact)
+    compactor.start()
+    time.sleep(0.5)
+    assert "finished" not in result  # сжатие ждёт транзакцию с движением
+    committed = time.monotonic()
+    trans.commit()
+    conn.close()
+    compactor.join(timeout=30)
+
+    assert result["finished"] >= committed
+    assert result["snapshots"] == 1
+    with seeded.app_context():
+        after = inventory.stock(product_ids=[product_id])[product_id]
+        assert after == round(before - 1.5, 6)
+        assert db.session.get(Product, product_id).amount == after
+        # следующее сжатие ничего не меняет
+        assert inventory.compact() == 0
+        assert inventory.stock(product_ids=[product_id])[product_id] == after
+
+
+def test_demand_excludes_taken_portions(seeded):
+    import planner
+    from models import Compound, Menu, MenuDishes, PaidMenu, Unit
+    from pickup_routes import _mark_taken
+
+    with seeded.app_context():
+        paid_id, menu_id, day = db.session.execute(
+            select(PaidMenu.id, PaidMenu.menu_id, Menu.date)
+            .join(Menu, Menu.id == PaidMenu.menu_id)
+            .where(PaidMenu.is_taken.is_(False))
+            .order_by(Menu.date.asc())
+            .limit(1)
+        ).one()
+        # продукты этого меню в килограммах - без пересчёта единиц
+        products = set(db.session.execute(
+            select(Compound.product_id)
+            .join(MenuDishes, MenuDishes.dish_id == Compound.dish_id)
+            .join(Product, Product.id == Compound.product_id)
+            .where(MenuDishes.menu_id == menu_id, Product.unit == Unit.KILOGRAMMS)
+        ).scalars())
+        assert products
+
+        def demand():
+            return {item["product_id"]: item["demand"] for item in planner.compute_demand(day, day)}
+
+        demand_before, stock_before = demand(), inventory.stock(product_ids=products)
+        # выдача: отметка и списание в журнал, как в /pickup
+        inventory.record_consumption(_mark_taken([paid_id]))
+        db.session.commit()
+        demand_after, stock_after = demand(), inventory.stock(product_ids=products)
+
+        for product_id in products:
+            spent = round(stock_before[product_id] - stock_after[product_id], 6)
+            assert spent > 0
+            # выданная порция ушла из остатка и из спроса: нехватка не растёт
+            assert round(demand_before[product_id] - demand_after.get(product_id, 0.0), 6) == round(spent, 3)
@@ -0,0 +1,99 @@
+"""
+Фоновые задачи: пароли из импорта учеников не остаются в таблице задач,
+долгую задачу без прогресса не берёт второй воркер.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+import jobs
+from conftest import auth_header
+from models import db, Job, JobStatus, JobUpload, User
+
+CSV = "login,password,money\r\njob-import-1@example.com,secret-pass-1,100\r\njob-import-2@example.com,secret-pass-2,0\r\n"
+
+
+def _run_queue(app):
+    with app.app_context():
+        jobs.run_worker(worker_id="test", once=True, log=lambda *args: None)
+
+
+def _uploads() -> int:
+    return db.session.execute(select(func.count()).select_from(JobUpload)).scalar()
+
+
+def test_roster_upload_is_removed_after_import(client, seeded):
+    resp = client.post("/roster/import?format=csv&async=1", data=CSV,
+                       headers=auth_header(seeded, "admin@example.com"))
+    assert resp.status_code == 202
+    job_id = resp.get_json()["id"]
+
+    with seeded.app_context():
+        job = db.session.get(Job, job_id)
+        assert "secret-pass" not in job.params
+        assert _uploads() == 1
+
+    _run_queue(seeded)
+
+    with seeded.app_context():
+        job = db.session.get(Job, job_id)
+        assert job.status == JobStatus.DONE
+        assert job.params is None
+        assert "secret-pass" not in (job.result or "")
+        assert _uploads() == 0
+        assert User.query.filter(User.login.like("job-import-%")).count() == 2
+
+
+def test_failed_import_forgets_upload(seeded):
+    with seeded.app_context():
+        job_id = jobs.enqueue("import-roster", {"format": "xml"}, upload=CSV).id
+        other_id = jobs.enqueue("compact-stock", {"note": "keep"}).id
+
+    _run_queue(seeded)
+
+    with seeded.app_context():
+        job = db.session.get(Job, job_id)
+        assert job.status == JobStatus.FAILED
+        assert job.params is None
+        assert _uploads() == 0
+        # у обычных задач параметры остаются
+        assert db.session.get(Job, other_id).params == '{"note": "keep"}'
+
+
+def test_abandoned_import_forgets_upload(seeded):
+    with seeded.app_context():
+        job = jobs.enqueue("import-roster", {"format": "csv"}, max_attempts=1, upload=CSV)
+        # воркер взял задачу и упал
+        job.status, job.attempts = JobStatus.RUNNING, 1
+        job.locked_by, job.locked_until = "dead", datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        job_id = job.id
+
+        jobs._expire_abandoned()
+        job = db.session.get(Job, job_id)
+        assert job.status == JobStatus.FAILED
+        assert job.params is None
+        assert _uploads() == 0
+
+
+def test_heartbeat_keeps_lease_without_progress(seeded, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", 1)
+    monkeypatch.setattr(jobs, "JOB_HEARTBEAT_SECONDS", 0.2)
+    # задача дольше срока, прогресс не сообщает (как compact-stock)
+    monkeypatch.setitem(jobs.TASKS, "test-sleep", (lambda ctx, params: time.sleep(2.5) or {}, ()))
+    with seeded.app_context():
+        job_id = jobs.enqueue("test-sleep", {}).id
+
+    worker = threading.Thread(target=_run_queue, args=(seeded,))
+    worker.start()
+    time.sleep(1.6)
+    with seeded.app_context():
+        assert jobs.claim("second") is None
+    worker.join(timeout=30)
+
+    with seeded.app_context():
+        job = db.session.get(Job, job_id)
+        assert job.status == JobStatus.DONE
+        assert job.attempts == 1
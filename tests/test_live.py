@@ -0,0 +1,42 @@
+"""
+Живые счётчики: место подписчика освобождается, даже если поток так и не начался;
+число мест по умолчанию следует настройкам gunicorn.
+"""
+import live
+from conftest import auth_header
+
+
+def _subscribers() -> int:
+    return sum(len(subs) for subs in live.broker._subs.values())
+
+
+def test_failed_snapshot_releases_slot(client, seeded, monkeypatch):
+    def broken(*args, **kwargs):
+        raise RuntimeError("БД недоступна")
+
+    monkeypatch.setattr(live, "_counts", broken)
+    headers = auth_header(seeded, "cook@example.com")
+    for _ in range(live.LIVE_MAX_SUBSCRIBERS + 1):
+        assert client.get("/live/menus", headers=headers).status_code == 500
+        assert _subscribers() == 0
+
+
+def test_unread_stream_releases_slot(client, seeded):
+    headers = auth_header(seeded, "cook@example.com")
+    for _ in range(live.LIVE_MAX_SUBSCRIBERS + 1):
+        resp = client.get("/live/menus", headers=headers, buffered=False)
+        assert resp.status_code == 200
+        resp.close()
+        assert _subscribers() == 0
+
+
+def test_default_limit_follows_gunicorn(monkeypatch):
+    monkeypatch.delenv("GUNICORN_MODE", raising=False)
+    monkeypatch.setenv("GUNICORN_THREADS", "16")
+    assert live._default_max_subscribers() == 8
+    monkeypatch.setenv("GUNICORN_THREADS", "1")
+    assert live._default_max_subscribers() == 1
+
+    monkeypatch.setenv("GUNICORN_MODE", "gevent")
+    monkeypatch.setenv("GUNICORN_WORKER_CONNECTIONS", "500")
+    assert live._default_max_subscribers() == 500
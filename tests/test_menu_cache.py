@@ -0,0 +1,74 @@
+"""Кэш меню: сброс даты во время чтения из БД, срок жизни общих записей, ответ 304."""
+import time
+from datetime import date, timedelta
+
+from menu_cache import LocalBackend, MenuCache, menu_cache
+from models import db, Menu
+
+D = date(2026, 3, 2)
+
+
+def test_set_after_invalidate_is_not_published():
+    backend = LocalBackend()
+    worker_a, worker_b = MenuCache(backend=backend), MenuCache(backend=backend)
+
+    version = worker_a.version(D)  # начали читать меню из БД
+    worker_b.invalidate([D])       # другой воркер поменял меню и сбросил дату
+    worker_a.set(D, b'{"old": true}', version)
+
+    assert worker_a.get(D) is None
+    assert worker_b.get(D) is None
+
+    worker_b.set(D, b'{"new": true}', worker_b.version(D))
+    assert worker_a.get(D).body == b'{"new": true}'
+
+
+def test_local_invalidate_during_read():
+    cache = MenuCache()
+    version = cache.version(D)
+    cache.invalidate([D])
+    cache.set(D, b"old", version)
+    assert cache.get(D) is None
+
+
+def test_shared_entries_expire():
+    backend = LocalBackend()
+    writer = MenuCache(backend=backend, ttl=0.01, shared_ttl=0.05)
+    writer.set(D, b"menu", writer.version(D))
+    reader = MenuCache(backend=backend)
+    assert reader.get(D).body == b"menu"
+
+    time.sleep(0.1)
+    assert MenuCache(backend=backend).get(D) is None
+
+
+def test_clear_drops_all_dates():
+    backend = LocalBackend()
+    cache = MenuCache(backend=backend)
+    cache.set(D, b"menu", cache.version(D))
+    other = MenuCache(backend=backend)
+    cache.clear()
+    assert other.get(D) is None
+
+
+def test_etag_revalidation(client, seeded):
+    day = date.today() + timedelta(days=7 - date.today().weekday())  # понедельник: меню точно есть
+    url = f"/menu/{day.isoformat()}"
+    menu_cache.clear()
+    first = client.get(url)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+
+    again = client.get(url, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.data == b""
+    assert again.headers["ETag"] == etag
+
+    # изменение меню сбрасывает дату: старый ETag больше не совпадает
+    with seeded.app_context():
+        menu = Menu.query.filter_by(date=day).first()
+        menu.price += 1
+        db.session.commit()
+    changed = client.get(url, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
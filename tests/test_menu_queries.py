@@ -0,0 +1,94 @@
+"""Число SQL-запросов в маршрутах меню не зависит от числа блюд."""
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from sqlalchemy import event, insert, select
+
+from conftest import SEED_DAYS
+from menu_cache import menu_cache
+from models import db, Dish, Menu, MenuDishes, Unit
+
+DAY = date.today() + timedelta(days=2)
+URLS = [
+    f"/menu?date={DAY.isoformat()}",
+    f"/menu/{DAY.isoformat()}",
+    # неделя и месяц одним запросом
+    f"/menu/range?from={date.today().isoformat()}&to={(date.today() + timedelta(days=6)).isoformat()}",
+    f"/menu/range?from={date.today().isoformat()}&to={(date.today() + timedelta(days=30)).isoformat()}",
+]
+
+
+@contextmanager
+def _counting(app):
+    """Считает SQL-запросы к основной БД внутри блока."""
+    with app.app_context():
+        engine = db.engine
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+
+def _get_counted(client, url) -> int:
+    with _counting(client.application) as statements:
+        resp = client.get(url)
+    assert resp.status_code == 200
+    return len(statements)
+
+
+def _query_count(client, url) -> int:
+    menu_cache.clear()
+    return _get_counted(client, url)
+
+
+def _dish_count(client, url) -> int:
+    data = client.get(url).get_json()
+    days = data["days"] if "days" in data else [data]
+    return sum(len(m["dishes"]) for day in days for m in day["menus"])
+
+
+def _add_dishes(app, per_menu: int):
+    """Добавляет в каждое меню тестового периода per_menu новых блюд."""
+    with app.app_context():
+        start = len(db.session.execute(select(Dish.id)).all())
+        db.session.execute(insert(Dish), [
+            {"name": f"Тестовое блюдо {start + i}", "amount": 100, "unit": Unit.GRAMMS} for i in range(per_menu)
+        ])
+        dish_ids = db.session.execute(
+            select(Dish.id).where(Dish.name.like("Тестовое блюдо %")).order_by(Dish.id.desc()).limit(per_menu)
+        ).scalars().all()
+        menu_ids = db.session.execute(select(Menu.id)).scalars().all()
+        db.session.execute(insert(MenuDishes), [
+            {"menu_id": menu_id, "dish_id": dish_id} for menu_id in menu_ids for dish_id in dish_ids
+        ])
+        db.session.commit()
+
+
+def test_query_count_constant(seeded, client):
+    before = {url: (_query_count(client, url), _dish_count(client, url)) for url in URLS}
+    _add_dishes(seeded, per_menu=25)
+    after = {url: (_query_count(client, url), _dish_count(client, url)) for url in URLS}
+
+    for url in URLS:
+        # меню + блюда всех меню
+        assert before[url][0] == 2, url
+        assert after[url][0] == 2, url
+        assert after[url][1] > before[url][1], url
+
+
+def test_cached_menu_makes_no_queries(client):
+    url = URLS[0]
+    _query_count(client, url)
+    assert _get_counted(client, url) == 0
+
+
+def test_range_covers_seeded_days(client):
+    d_to = date.today() + timedelta(days=SEED_DAYS - 1)
+    data = client.get(f"/menu/range?from={date.today().isoformat()}&to={d_to.isoformat()}").get_json()
+    assert len(data["days"]) == SEED_DAYS
@@ -0,0 +1,24 @@
+"""Метрики: медленные запросы видит только администратор, ошибка SQL не оставляет время начала в соединении."""
+import pytest
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from conftest import auth_header
+from models import db
+
+
+def test_slow_queries_admin_only(client, seeded):
+    assert client.get("/metrics/slow").status_code == 401
+    assert client.get("/metrics/slow", headers=auth_header(seeded, "cook@example.com")).status_code == 403
+
+    resp = client.get("/metrics/slow", headers=auth_header(seeded, "admin@example.com"))
+    assert resp.status_code == 200
+    assert "samples" in resp.get_json()
+
+
+def test_failed_statement_pops_start_time(seeded):
+    with seeded.app_context(), db.engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises((OperationalError, ProgrammingError)):
+                conn.exec_driver_sql("SELECT * FROM no_such_table")
+            conn.rollback()
+        assert not conn.info.get("metrics_started")
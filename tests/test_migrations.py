@@ -0,0 +1,47 @@
+"""
+Миграции на новой БД: версия 1 - исходная схема, а не текущие модели;
+после всех миграций схема совпадает с models.py.
+"""
+import pytest
+from sqlalchemy import create_engine, inspect
+
+import migrations
+from models import db
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrations.db'}")
+    yield engine
+    engine.dispose()
+
+
+def _schema(engine) -> dict:
+    insp = inspect(engine)
+    return {
+        name: ({c["name"] for c in insp.get_columns(name)}, {i["name"] for i in insp.get_indexes(name)})
+        for name in insp.get_table_names()
+    }
+
+
+def test_initial_is_baseline(engine):
+    with engine.begin() as conn:
+        migrations._initial(conn)
+    schema = _schema(engine)
+
+    assert set(schema) == set(migrations._baseline.tables)
+    assert "price" not in schema["menu"][0]
+    assert "price" not in schema["paid_menu"][0]
+    assert "ux_menu_date_type" not in schema["menu"][1]
+
+
+def test_fresh_database_matches_models(engine):
+    assert migrations.migrate(engine, log=lambda *args: None) == [v for v, _, _ in migrations.MIGRATIONS]
+    assert migrations.current_version(engine) == migrations.MIGRATIONS[-1][0]
+    schema = _schema(engine)
+
+    for table in db.metadata.sorted_tables:
+        columns, indexes = schema[table.name]
+        assert columns == {c.name for c in table.columns}, table.name
+        assert {i.name for i in table.indexes} <= indexes, table.name
+    assert migrations.migrate(engine, log=lambda *args: None) == []
@@ -0,0 +1,75 @@
+"""
+Выдача по коду: подпись проверяется без БД, повторный скан не выдаёт второй раз,
+офлайн-пачка возвращает статус по каждому коду.
+"""
+from datetime import date, timedelta
+
+from auth import make_token
+from conftest import auth_header
+from models import db, Menu, MealType, PaidMenu, User, UserRole
+from pickup_routes import make_pickup_code, parse_pickup_code
+
+
+def _paid_menu(app, login, d) -> tuple:
+    """Оплата меню на дату d новым учеником: (id меню, id оплаты, заголовок ученика)."""
+    with app.app_context():
+        menu = Menu.query.filter_by(date=d, type=MealType.LUNCH).first()
+        if menu is None:
+            menu = Menu(date=d, type=MealType.LUNCH, price=180)
+            db.session.add(menu)
+        student = User(login=login, password_hash="-", role=UserRole.STUDENT, money=0)
+        db.session.add(student)
+        db.session.flush()
+        paid = PaidMenu(user_id=student.id, menu_id=menu.id, is_taken=False)
+        db.session.add(paid)
+        db.session.commit()
+        return menu.id, paid.id, {"Authorization": "Bearer " + make_token(student)}
+
+
+def test_code_roundtrip_and_tampering():
+    code = make_pickup_code(12345, date(2026, 3, 2))
+    assert len(code) == 20
+    assert parse_pickup_code(code.lower()) == (12345, date(2026, 3, 2))
+
+    forged = ("A" if code[0] != "A" else "B") + code[1:]
+    assert parse_pickup_code(forged) is None
+    assert parse_pickup_code("не код") is None
+
+
+def test_pickup_once(seeded, client):
+    menu_id, paid_id, student = _paid_menu(seeded, "pickup-once@example.com", date.today())
+    cook = auth_header(seeded, "cook@example.com")
+
+    resp = client.get(f"/pickup/code/{menu_id}", headers=student)
+    assert resp.status_code == 200
+    assert resp.get_json()["is_taken"] is False
+    code = resp.get_json()["code"]
+
+    assert client.post("/pickup", json={"code": code}, headers=student).status_code == 403
+    resp = client.post("/pickup", json={"code": code}, headers=cook)
+    assert resp.status_code == 200
+    assert resp.get_json()["paid_menu_id"] == paid_id
+    assert client.post("/pickup", json={"code": code}, headers=cook).status_code == 409
+    assert client.get(f"/pickup/code/{menu_id}", headers=student).get_json()["is_taken"] is True
+
+
+def test_pickup_rejects_other_day(seeded, client):
+    _, paid_id, _ = _paid_menu(seeded, "pickup-tomorrow@example.com", date.today() + timedelta(days=1))
+    resp = client.post("/pickup", json={"code": make_pickup_code(paid_id, date.today() + timedelta(days=1))},
+                       headers=auth_header(seeded, "cook@example.com"))
+    assert resp.status_code == 409
+
+
+def test_offline_batch_statuses(seeded, client):
+    _, paid_id, _ = _paid_menu(seeded, "pickup-batch@example.com", date.today())
+    code = make_pickup_code(paid_id, date.today())
+    old = make_pickup_code(paid_id, date.today() - timedelta(days=30))
+
+    resp = client.post("/pickup/batch", json={"codes": [code, code, "испорчен", old]},
+                       headers=auth_header(seeded, "cook@example.com"))
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data["taken"] == 1
+    assert [r["status"] for r in data["results"]] == ["taken", "already_taken", "invalid", "expired"]
+    with seeded.app_context():
+        assert db.session.get(PaidMenu, paid_id).is_taken is True
@@ -0,0 +1,127 @@
+"""
+Параллельные покупки одного ученика: баланс не уходит в минус, деньги
+списываются ровно за купленные меню, одно меню не продаётся дважды,
+повтор с тем же Idempotency-Key не списывает деньги повторно.
+"""
+import threading
+from collections import Counter
+from datetime import date, timedelta
+
+from sqlalchemy import func, select
+
+from auth import make_token
+from models import db, Menu, PaidMenu, User, UserRole
+
+THREADS = 16
+ROUNDS = 6
+# понедельник следующей недели: все её будние дни есть в тестовых данных (SEED_DAYS = 14)
+MONDAY = date.today() + timedelta(days=7 - date.today().weekday())
+
+
+def _student(app, login, money) -> tuple:
+    with app.app_context():
+        user = User(login=login, password_hash="-", role=UserRole.STUDENT, money=money)
+        db.session.add(user)
+        db.session.commit()
+        return user.id, {"Authorization": "Bearer " + make_token(user)}
+
+
+def _run_parallel(app, calls) -> list:
+    """calls - [(метод, url, json, headers)]; все потоки стартуют одновременно."""
+    barrier = threading.Barrier(len(calls))
+    results = [None] * len(calls)
+
+    def worker(i, call):
+        method, url, body, headers = call
+        client = app.test_client()
+        barrier.wait()
+        resp = client.open(url, method=method, json=body, headers=headers)
+        results[i] = (resp.status_code, resp.get_json())
+
+    threads = [threading.Thread(target=worker, args=(i, call)) for i, call in enumerate(calls)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def _check_invariants(app, user_id, initial) -> tuple:
+    with app.app_context():
+        money = db.session.get(User, user_id).money
+        rows = db.session.execute(select(PaidMenu.menu_id).where(PaidMenu.user_id == user_id)).scalars().all()
+        spent = db.session.execute(
+            select(func.coalesce(func.sum(Menu.price), 0))
+            .join(PaidMenu, PaidMenu.menu_id == Menu.id)
+            .where(PaidMenu.user_id == user_id)
+        ).scalar()
+    assert money >= 0
+    assert money == initial - spent
+    duplicates = [menu_id for menu_id, n in Counter(rows).items() if n > 1]
+    assert not duplicates
+    return money, rows
+
+
+def _menu_ids(app) -> list:
+    with app.app_context():
+        return db.session.execute(
+            select(Menu.id).where(Menu.date >= date.today()).order_by(Menu.date, Menu.id)
+        ).scalars().all()
+
+
+def test_parallel_buy_day_and_week(seeded):
+    # денег хватает не на всё: часть покупок должна получить 402
+    initial = 1500
+    user_id, headers = _student(seeded, "stress-mixed@example.com", initial)
+    menu_ids = _menu_ids(seeded)
+
+    for r in range(ROUNDS):
+        calls = []
+        for i in range(THREADS):
+            if i % 4 == 0:
+                body = {"week": MONDAY.isoformat(), "types": ["LUNCH"] if r % 2 else ["BREAKFAST", "LUNCH"]}
+                calls.append(("POST", "/menu/buy", body, headers))
+            else:
+                # несколько потоков покупают одно и то же меню
+                menu_id = menu_ids[(r * 3 + i % 3) % len(menu_ids)]
+                calls.append(("POST", f"/menu/{menu_id}/buy", None, headers))
+        results = _run_parallel(seeded, calls)
+        assert {status for status, _ in results} <= {201, 402, 404, 409}, results
+        _check_invariants(seeded, user_id, initial)
+
+    money, rows = _check_invariants(seeded, user_id, initial)
+    assert rows
+    assert money < initial
+
+
+def test_parallel_replay_with_same_key(seeded):
+    initial = 5000
+    user_id, headers = _student(seeded, "stress-replay@example.com", initial)
+    week = {"week": MONDAY.isoformat()}
+    keyed = {**headers, "Idempotency-Key": "week-1"}
+
+    results = _run_parallel(seeded, [("POST", "/menu/buy", week, keyed)] * THREADS)
+    statuses = Counter(status for status, _ in results)
+
+    money, rows = _check_invariants(seeded, user_id, initial)
+    # неделя куплена один раз, все повторы получили сохранённый ответ первой покупки
+    assert len(rows) == 10
+    assert statuses == {201: THREADS}, results
+    assert len({str(body) for _, body in results}) == 1
+    assert money == initial - results[0][1]["total"]
+
+    # повтор после завершения - тот же ответ, деньги не списываются
+    status, body = _run_parallel(seeded, [("POST", "/menu/buy", week, keyed)])[0]
+    assert (status, body) == (201, results[0][1])
+    assert _check_invariants(seeded, user_id, initial)[0] == money
+
+
+def test_parallel_buy_without_money(seeded):
+    user_id, headers = _student(seeded, "stress-poor@example.com", 130)
+    menu_ids = _menu_ids(seeded)
+    results = _run_parallel(seeded, [("POST", f"/menu/{menu_id}/buy", None, headers) for menu_id in menu_ids[:THREADS]])
+
+    money, rows = _check_invariants(seeded, user_id, 130)
+    # 130 хватает ровно на один завтрак (120) и ни на один обед
+    assert len(rows) <= 1
+    assert sum(1 for status, _ in results if status == 201) == len(rows)
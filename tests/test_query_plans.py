@@ -0,0 +1,55 @@
+"""
+Планы горячих запросов на большом наборе данных: ни один не читает
+таблицу целиком (query_plans.check_plans, как flask --app app check-plans).
+"""
+from datetime import date, timedelta
+
+import pytest
+
+import migrations
+import query_plans
+from models import db
+
+STUDENTS = 1000
+DAYS = 90
+
+
+@pytest.fixture(scope="module")
+def big_data(app):
+    import fill
+
+    with app.app_context():
+        # схема - только из миграций, данные - как у generate-data, но меньше
+        migrations.migrate(db.engine, log=lambda *args: None)
+        fill.generate_dataset(students=STUDENTS, start=date.today() - timedelta(days=DAYS // 2), days=DAYS,
+                              log=lambda *args: None)
+    return app
+
+
+@pytest.mark.parametrize("name", [name for name, _, _ in query_plans.hot_queries()])
+def test_hot_query_uses_index(big_data, name):
+    with big_data.app_context():
+        log = []
+        failed = query_plans.check_plans(log=log.append)
+        assert name not in failed, "\n".join(log)
+
+
+def test_check_plans_passes(big_data):
+    with big_data.app_context():
+        assert query_plans.check_plans(log=lambda *args: None) == []
+
+
+def test_missing_index_is_reported(big_data):
+    from models import PaidMenu
+
+    index = next(ix for ix in PaidMenu.__table__.indexes if ix.name == "ix_paid_menu_menu_id_is_taken")
+    with big_data.app_context():
+        with db.engine.begin() as conn:
+            index.drop(conn)
+        try:
+            assert query_plans.check_plans(log=lambda *args: None) == ["покупки меню"]
+        finally:
+            # checkfirst перечитывает схему: у соединения из пула она могла остаться старой
+            with db.engine.begin() as conn:
+                index.create(conn, checkfirst=True)
+        assert query_plans.check_plans(log=lambda *args: None) == []
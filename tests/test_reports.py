@@ -0,0 +1,85 @@
+"""
+Счётчики отчётов: покупка пишет приращение, а не строку итогов MenuStats;
+отчёт видит покупку сразу, fold() переносит её в итоги без потерь,
+миграция досчитывает итоги по уже сделанным покупкам.
+"""
+from datetime import date, timedelta
+
+from sqlalchemy import delete, func, select
+
+import migrations
+import reports
+from auth import make_token
+from conftest import auth_header
+from models import db, Menu, MealType, MenuStats, MenuStatsDelta, User, UserRole
+
+MONDAY = date.today() + timedelta(days=7 - date.today().weekday())
+
+
+def _daily_sold(client, headers) -> int:
+    resp = client.get(f"/reports/daily?from={MONDAY}&to={MONDAY}", headers=headers)
+    assert resp.status_code == 200
+    return sum(day["sold"] for day in resp.get_json()["days"])
+
+
+def _stats(menu_id):
+    row = db.session.get(MenuStats, menu_id)
+    db.session.rollback()
+    return (row.sold, row.revenue) if row else (0, 0)
+
+
+def test_purchase_writes_delta_and_fold_moves_it(client, seeded):
+    admin = auth_header(seeded, "admin@example.com")
+    with seeded.app_context():
+        reports.fold()
+        menu = Menu.query.filter_by(date=MONDAY, type=MealType.BREAKFAST).first()
+        menu_id, price = menu.id, menu.price
+        before = _stats(menu_id)
+        student = User(login="reports-buyer@example.com", password_hash="-", role=UserRole.STUDENT, money=1000)
+        db.session.add(student)
+        db.session.commit()
+        buyer = {"Authorization": "Bearer " + make_token(student)}
+    sold_before = _daily_sold(client, admin)
+
+    resp = client.post(f"/menu/{menu_id}/buy", headers=buyer)
+    assert resp.status_code == 201
+
+    with seeded.app_context():
+        # строка итогов в транзакции покупки не менялась
+        assert _stats(menu_id) == before
+        assert db.session.execute(select(func.count()).select_from(MenuStatsDelta)).scalar() == 1
+    assert _daily_sold(client, admin) == sold_before + 1
+
+    with seeded.app_context():
+        assert reports.fold() == 1
+        assert _stats(menu_id) == (before[0] + 1, before[1] + price)
+        assert db.session.execute(select(func.count()).select_from(MenuStatsDelta)).scalar() == 0
+        assert reports.fold() == 0
+    assert _daily_sold(client, admin) == sold_before + 1
+
+
+def test_migration_backfills_stats(seeded):
+    with seeded.app_context():
+        reports.fold()
+        expected = reports.totals()
+        assert expected
+        db.session.execute(delete(MenuStats))
+        db.session.commit()
+        assert reports.totals() == []
+
+        with db.engine.begin() as conn:
+            migrations._menu_stats_deltas(conn)
+        assert reports.totals() == expected
+
+
+def test_rebuild_keeps_revenue_after_price_change(seeded):
+    with seeded.app_context():
+        reports.fold()
+        reports.rebuild()
+        before = {row[0]: row[5] for row in reports.totals()}
+        menu = db.session.get(Menu, next(menu_id for menu_id, revenue in before.items() if revenue))
+        menu.price += 50
+        db.session.commit()
+
+        reports.rebuild()
+        assert {row[0]: row[5] for row in reports.totals()} == before
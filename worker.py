@@ -0,0 +1,26 @@
+"""
+Воркер фоновых задач (jobs.py), запускается рядом с gunicorn app:app:
+
+    python worker.py            # работает до SIGTERM
+    python worker.py --once     # выполнить очередь и выйти
+
+Для параллельности запускают несколько процессов.
+"""
+import argparse
+
+from app import app
+from jobs import run_worker
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Воркер фоновых задач")
+    parser.add_argument("--once", action="store_true", help="выйти, когда очередь опустеет")
+    parser.add_argument("--id", dest="worker_id", default=None, help="имя воркера (по умолчанию host:pid)")
+    args = parser.parse_args(argv)
+
+    with app.app_context():
+        run_worker(worker_id=args.worker_id, once=args.once)
+
+
+if __name__ == "__main__":
+    main()